@@ -0,0 +1,173 @@
+import os
+import time
+import shutil
+import sqlite3
+import zipfile
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+from cache_ocr import hash_archivo
+from almacen_resultados import SumideroBytes
+from modelos_datos import FacturaEndesaDistribucion
+from ventanas_fechas import a_fecha
+
+# --- CONFIGURACIÓN DEL ALMACÉN DE PDF ---
+# PDF guardados por hash de contenido en subcarpetas (ab/cd/abcd...pdf)
+DIR_PDFS = os.environ.get("EDISTRIBUCION_DIR_PDFS", os.path.join("datos", "pdfs"))
+RUTA_INDICE_PDFS = os.path.join("datos", "indice_pdfs.sqlite3")
+# Bytes leídos por trozo al emitir un PDF dentro del ZIP
+TAMANO_TROZO = 1024 * 1024
+
+
+class AlmacenPDF:
+    """
+    Almacén de PDF direccionado por contenido: cada documento se guarda una
+    sola vez con su SHA-256 como nombre, repartido en subcarpetas para no
+    acumular miles de archivos en un directorio. Un índice SQLite relaciona
+    (cups, numero_factura) con el hash, de modo que dos facturas con el mismo
+    documento comparten el archivo.
+    """
+    def __init__(self, directorio: str = DIR_PDFS, ruta_indice: str = RUTA_INDICE_PDFS):
+        self.directorio = directorio
+        self.ruta_indice = ruta_indice
+        self._lock = threading.Lock()
+        self.guardados = 0
+        self.duplicados = 0
+        os.makedirs(directorio, exist_ok=True)
+        os.makedirs(os.path.dirname(ruta_indice) or ".", exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pdfs (
+                    cups TEXT NOT NULL,
+                    numero_factura TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    tamano INTEGER NOT NULL,
+                    fecha_emision_iso TEXT,
+                    guardado REAL NOT NULL,
+                    PRIMARY KEY (cups, numero_factura)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pdfs_hash ON pdfs (hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pdfs_fecha_emision ON pdfs (fecha_emision_iso)")
+
+    @contextmanager
+    def _conectar(self):
+        conn = sqlite3.connect(self.ruta_indice, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def ruta_hash(self, hash_pdf: str) -> str:
+        return os.path.join(self.directorio, hash_pdf[:2], hash_pdf[2:4], f"{hash_pdf}.pdf")
+
+    def guardar(self, ruta_origen: str, factura: FacturaEndesaDistribucion) -> str:
+        """
+        Mueve el PDF descargado al almacén (o lo descarta si ese contenido ya
+        estaba guardado), registra la factura en el índice y devuelve la ruta
+        definitiva.
+        """
+        hash_pdf = hash_archivo(ruta_origen)
+        destino = self.ruta_hash(hash_pdf)
+        tamano = os.path.getsize(ruta_origen)
+        with self._lock:
+            if os.path.exists(destino):
+                os.remove(ruta_origen)
+                self.duplicados += 1
+            else:
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                shutil.move(ruta_origen, destino)
+                self.guardados += 1
+            emision = a_fecha(factura.fecha_emision)
+            with self._conectar() as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO pdfs (cups, numero_factura, hash, tamano, fecha_emision_iso, guardado)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (factura.cups, factura.numero_factura, hash_pdf, tamano, emision.isoformat() if emision else None, time.time()))
+        return destino
+
+    def buscar(self, cups: str, numero_factura: str) -> tuple[str, str] | None:
+        """Devuelve (hash, ruta) del PDF de la factura, o None si no está guardado."""
+        with self._conectar() as conn:
+            fila = conn.execute(
+                "SELECT hash FROM pdfs WHERE cups = ? AND numero_factura = ?", (cups, numero_factura)
+            ).fetchone()
+        if not fila:
+            return None
+        ruta = self.ruta_hash(fila[0])
+        return (fila[0], ruta) if os.path.exists(ruta) else None
+
+    def ruta(self, cups: str, numero_factura: str) -> str | None:
+        encontrado = self.buscar(cups, numero_factura)
+        return encontrado[1] if encontrado else None
+
+    def listar(self, desde: str | None = None, hasta: str | None = None, cups: list[str] | None = None) -> list[tuple[str, str, str, int]]:
+        """(cups, numero_factura, hash, tamaño) de los PDF filtrados por fecha de emisión (DD/MM/YYYY) y CUPS."""
+        condiciones, parametros = [], []
+        if desde:
+            condiciones.append("fecha_emision_iso >= ?")
+            parametros.append(a_fecha(desde).isoformat())
+        if hasta:
+            condiciones.append("fecha_emision_iso <= ?")
+            parametros.append(a_fecha(hasta).isoformat())
+        if cups:
+            condiciones.append(f"cups IN ({', '.join('?' * len(cups))})")
+            parametros.extend(cups)
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        with self._conectar() as conn:
+            return conn.execute(
+                f"SELECT cups, numero_factura, hash, tamano FROM pdfs {donde} ORDER BY fecha_emision_iso, cups, numero_factura",
+                parametros,
+            ).fetchall()
+
+    def exportar_zip(self, entradas: list[tuple[str, str, str, int]]) -> Iterator[bytes]:
+        """
+        ZIP con los PDF de `entradas` emitido por trozos: cada archivo se lee
+        y se entrega a medida que se escribe, sin montar el ZIP en memoria.
+        Los PDF ya van comprimidos: se guardan sin volver a comprimir.
+        """
+        sumidero = SumideroBytes()
+        # Sin seek, zipfile escribe los tamaños en descriptores tras cada archivo
+        with zipfile.ZipFile(sumidero, mode="w", compression=zipfile.ZIP_STORED) as archivo_zip:
+            for cups, numero_factura, hash_pdf, tamano in entradas:
+                ruta = self.ruta_hash(hash_pdf)
+                if not os.path.exists(ruta):
+                    continue
+                info = zipfile.ZipInfo(f"{cups}_{numero_factura}.pdf", date_time=time.localtime(os.path.getmtime(ruta))[:6])
+                info.file_size = tamano
+                with open(ruta, "rb") as origen, archivo_zip.open(info, "w") as destino:
+                    for trozo in iter(lambda: origen.read(TAMANO_TROZO), b""):
+                        destino.write(trozo)
+                        yield sumidero.extraer()
+                yield sumidero.extraer()
+        yield sumidero.extraer()
+
+    def estadisticas(self) -> dict:
+        with self._conectar() as conn:
+            facturas, documentos, total_bytes = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT hash), COALESCE(SUM(tamano), 0) FROM pdfs"
+            ).fetchone()
+            bytes_unicos = conn.execute(
+                "SELECT COALESCE(SUM(tamano), 0) FROM (SELECT DISTINCT hash, tamano FROM pdfs)"
+            ).fetchone()[0]
+        return {
+            "directorio": self.directorio,
+            "facturas": facturas,
+            "documentos": documentos,
+            "mb_facturas": round(total_bytes / 1024 / 1024, 2),
+            "mb_en_disco": round(bytes_unicos / 1024 / 1024, 2),
+            "guardados": self.guardados,
+            "duplicados": self.duplicados,
+        }
+
+
+# Instancia compartida por todo el proceso
+_almacen_pdf: AlmacenPDF | None = None
+
+def obtener_almacen_pdf() -> AlmacenPDF:
+    """Devuelve el almacén de PDF compartido, creándolo en el primer uso."""
+    global _almacen_pdf
+    if _almacen_pdf is None:
+        _almacen_pdf = AlmacenPDF()
+    return _almacen_pdf
@@ -0,0 +1,260 @@
+import io
+import os
+import csv
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+from modelos_datos import FacturaEndesaDistribucion
+from ventanas_fechas import a_fecha
+from cuentas import CUENTA_POR_DEFECTO
+
+# pyarrow es opcional: sin él, la exportación solo ofrece CSV
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# --- CONFIGURACIÓN DEL ALMACÉN DE RESULTADOS ---
+RUTA_ALMACEN = os.environ.get("EDISTRIBUCION_ALMACEN", os.path.join("datos", "resultados.sqlite3"))
+# Filas leídas de SQLite por bloque al exportar (un bloque = un trozo de CSV o un row group de Parquet)
+FILAS_BLOQUE_EXPORTACION = 5000
+
+CAMPOS_FACTURA = list(FacturaEndesaDistribucion.model_fields.keys())
+# Columnas que añade el almacén a los campos de la factura
+CAMPOS_ALMACEN = ["rol", "cuenta"]
+COLUMNAS_EXPORTACION = CAMPOS_FACTURA + CAMPOS_ALMACEN
+
+_TIPOS_SQL = {bool: "INTEGER", int: "INTEGER", float: "REAL", str: "TEXT"}
+
+
+def _tipo_campo(nombre: str) -> type:
+    """Tipo base del campo del modelo (Optional[float] -> float)."""
+    anotacion = FacturaEndesaDistribucion.model_fields[nombre].annotation
+    for tipo in (bool, int, float, str):
+        if anotacion is tipo or tipo in getattr(anotacion, "__args__", ()):
+            return tipo
+    return str
+
+# Posiciones de los campos booleanos (SQLite los guarda como 0/1)
+_INDICES_BOOL = {i for i, c in enumerate(CAMPOS_FACTURA) if _tipo_campo(c) is bool}
+
+def _restaurar_bool(fila: tuple) -> tuple:
+    return tuple(bool(v) if i in _INDICES_BOOL and v is not None else v for i, v in enumerate(fila))
+
+def formato_disponible(formato: str) -> bool:
+    return formato == "csv" or (formato == "parquet" and pyarrow is not None)
+
+
+class SumideroBytes:
+    """Archivo en memoria que entrega lo escrito por trozos (para emitir Parquet sin montarlo entero)."""
+    def __init__(self):
+        self.partes: list[bytes] = []
+        self.posicion = 0
+        self.closed = False
+
+    def write(self, datos) -> int:
+        datos = bytes(datos)
+        self.partes.append(datos)
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def extraer(self) -> bytes:
+        datos = b"".join(self.partes)
+        self.partes = []
+        return datos
+
+
+class AlmacenResultados:
+    """
+    Resultados de las extracciones en SQLite, una fila por (cups, numero_factura)
+    con todos los campos de la factura en columnas. Cada rol se guarda en una
+    sola transacción (upsert), de modo que repetir un rango no duplica filas y
+    dos ejecuciones concurrentes no se mezclan. Cada fila lleva la cuenta y el
+    rol con los que se leyó; si otra cuenta lee la misma factura, la fila se
+    queda con la cuenta que la guardó primero. Índices por cups, fecha de emisión, número de
+    factura y cuenta para consultar rangos sin leerlo todo.
+    """
+    def __init__(self, ruta: str = RUTA_ALMACEN):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        columnas = ",\n".join(f"{c} {_TIPOS_SQL[_tipo_campo(c)]}" for c in CAMPOS_FACTURA if c not in ("cups", "numero_factura"))
+        with self._conectar() as conn:
+            # WAL: las exportaciones leen mientras una ejecución escribe
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS facturas (
+                    cups TEXT NOT NULL,
+                    numero_factura TEXT NOT NULL,
+                    {columnas},
+                    rol TEXT,
+                    cuenta TEXT,
+                    fecha_emision_iso TEXT,
+                    actualizado REAL NOT NULL,
+                    PRIMARY KEY (cups, numero_factura)
+                )
+            """)
+            # Almacenes anteriores al registro de cuentas: todas sus filas son de la cuenta por defecto
+            if "cuenta" not in [fila[1] for fila in conn.execute("PRAGMA table_info(facturas)")]:
+                conn.execute("ALTER TABLE facturas ADD COLUMN cuenta TEXT")
+                conn.execute("UPDATE facturas SET cuenta = ?", (CUENTA_POR_DEFECTO,))
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_facturas_cups ON facturas (cups)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_facturas_fecha_emision ON facturas (fecha_emision_iso)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_facturas_numero ON facturas (numero_factura)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_facturas_cuenta ON facturas (cuenta, rol)")
+
+    @contextmanager
+    def _conectar(self, check_same_thread: bool = True):
+        conn = sqlite3.connect(self.ruta, timeout=30, check_same_thread=check_same_thread)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def guardar_lote(self, facturas: list[FacturaEndesaDistribucion], rol: str | None = None,
+                     cuenta: str = CUENTA_POR_DEFECTO) -> int:
+        """
+        Inserta o actualiza las facturas en una única transacción. Una factura ya
+        guardada por otra cuenta no se modifica: la clave es (cups, numero_factura)
+        y los reintentos buscan la factura en la cuenta y el rol de la fila.
+        Devuelve las filas procesadas.
+        """
+        ahora = time.time()
+        filas = []
+        for f in facturas:
+            # Las filas que no pudieron leerse no tienen clave útil
+            if not f.numero_factura or f.numero_factura == "N/A" or f.cups == "PENDIENTE":
+                continue
+            datos = f.model_dump()
+            emision = a_fecha(f.fecha_emision)
+            filas.append([datos[c] for c in CAMPOS_FACTURA] + [rol, cuenta, emision.isoformat() if emision else None, ahora])
+        if not filas:
+            return 0
+        columnas = CAMPOS_FACTURA + ["rol", "cuenta", "fecha_emision_iso", "actualizado"]
+        actualizar = ", ".join(f"{c} = excluded.{c}" for c in columnas if c not in ("cups", "numero_factura"))
+        with self._lock, self._conectar() as conn:
+            conn.executemany(f"""
+                INSERT INTO facturas ({", ".join(columnas)}) VALUES ({", ".join("?" * len(columnas))})
+                ON CONFLICT (cups, numero_factura) DO UPDATE SET {actualizar}
+                WHERE facturas.cuenta IS NULL OR facturas.cuenta = excluded.cuenta
+            """, filas)
+        return len(filas)
+
+    def ubicaciones_de(self, claves: list[tuple[str, str]]) -> dict[tuple[str, str], tuple[str, str]]:
+        """(cuenta, rol) con los que se guardó cada (cups, numero_factura); las claves ausentes o sin rol se omiten."""
+        ubicaciones = {}
+        with self._lock, self._conectar() as conn:
+            for cups, numero_factura in claves:
+                fila = conn.execute(
+                    "SELECT cuenta, rol FROM facturas WHERE cups = ? AND numero_factura = ?", (cups, numero_factura)
+                ).fetchone()
+                if fila and fila[1]:
+                    ubicaciones[(cups, numero_factura)] = (fila[0] or CUENTA_POR_DEFECTO, fila[1])
+        return ubicaciones
+
+    def _consulta(self, desde: str | None, hasta: str | None, cups: str | None, rol: str | None,
+                  cuenta: str | None) -> tuple[str, list]:
+        condiciones, parametros = [], []
+        if desde:
+            condiciones.append("fecha_emision_iso >= ?")
+            parametros.append(a_fecha(desde).isoformat())
+        if hasta:
+            condiciones.append("fecha_emision_iso <= ?")
+            parametros.append(a_fecha(hasta).isoformat())
+        if cups:
+            condiciones.append("cups = ?")
+            parametros.append(cups)
+        if rol:
+            condiciones.append("rol = ?")
+            parametros.append(rol)
+        if cuenta:
+            condiciones.append("cuenta = ?")
+            parametros.append(cuenta)
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        return f"SELECT {', '.join(COLUMNAS_EXPORTACION)} FROM facturas {donde} ORDER BY fecha_emision_iso, cups, numero_factura", parametros
+
+    def bloques(self, desde: str | None = None, hasta: str | None = None, cups: str | None = None,
+                rol: str | None = None, cuenta: str | None = None, tamano: int = FILAS_BLOQUE_EXPORTACION) -> Iterator[list[tuple]]:
+        """
+        Recorre las facturas filtradas por fecha de emisión (DD/MM/YYYY), cups,
+        rol y cuenta en bloques de `tamano` filas, sin cargar el resultado entero.
+        """
+        sql, parametros = self._consulta(desde, hasta, cups, rol, cuenta)
+        # El iterador puede avanzarse desde hilos distintos (StreamingResponse), siempre de uno en uno
+        with self._conectar(check_same_thread=False) as conn:
+            cursor = conn.execute(sql, parametros)
+            while True:
+                filas = cursor.fetchmany(tamano)
+                if not filas:
+                    return
+                yield [_restaurar_bool(fila) for fila in filas]
+
+    def exportar_csv(self, **filtros) -> Iterator[bytes]:
+        """CSV (separado por ';', como el antiguo log CSV) emitido bloque a bloque."""
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer, delimiter=";")
+        escritor.writerow(COLUMNAS_EXPORTACION)
+        for filas in self.bloques(**filtros):
+            escritor.writerows(filas)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+
+    def exportar_parquet(self, **filtros) -> Iterator[bytes]:
+        """Parquet emitido por row groups (requiere pyarrow)."""
+        if pyarrow is None:
+            raise RuntimeError("La exportación a Parquet requiere pyarrow.")
+        tipos = {bool: pyarrow.bool_(), int: pyarrow.int64(), float: pyarrow.float64(), str: pyarrow.string()}
+        esquema = pyarrow.schema(
+            [(c, tipos[_tipo_campo(c)]) for c in CAMPOS_FACTURA] + [(c, pyarrow.string()) for c in CAMPOS_ALMACEN]
+        )
+        sumidero = SumideroBytes()
+        with pyarrow.parquet.ParquetWriter(sumidero, esquema) as escritor:
+            for filas in self.bloques(**filtros):
+                columnas = [list(columna) for columna in zip(*filas)]
+                escritor.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(valores, type=campo.type) for valores, campo in zip(columnas, esquema)], schema=esquema
+                ))
+                yield sumidero.extraer()
+        yield sumidero.extraer()
+
+    def estadisticas(self) -> dict:
+        with self._lock, self._conectar() as conn:
+            total, cuentas, roles, primera, ultima = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT cuenta), COUNT(DISTINCT rol), MIN(fecha_emision_iso), MAX(fecha_emision_iso) FROM facturas"
+            ).fetchone()
+        return {
+            "ruta": self.ruta,
+            "facturas": total,
+            "cuentas": cuentas,
+            "roles": roles,
+            "primera_emision": primera,
+            "ultima_emision": ultima,
+            "parquet_disponible": pyarrow is not None,
+        }
+
+
+# Instancia compartida por todo el proceso
+_almacen: AlmacenResultados | None = None
+
+def obtener_almacen() -> AlmacenResultados:
+    """Devuelve el almacén compartido, creándolo en el primer uso."""
+    global _almacen
+    if _almacen is None:
+        _almacen = AlmacenResultados()
+    return _almacen
@@ -1,19 +1,85 @@
-from fastapi import FastAPI, HTTPException, Query
-from typing import List, Dict, Any
-from modelos_datos import FacturaEndesaDistribucion
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse, Response
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional
+from modelos_datos import FacturaEndesaDistribucion, EstadoTrabajo, ProgresoEjecucion, PeticionReintento
 # Cambiamos ejecutar_robot_multiempresa por ejecutar_robot_api
 from robotEndesa import ejecutar_robot_api 
-from robotEndesa import obtener_pdf_local_base64 
+from robotEndesa import ejecutar_robot_stream
+from robotEndesa import crear_pool_cuenta
+from robotEndesa import reanudar_ejecucion
+from robotEndesa import reintentar_facturas
+from planificador_cuentas import PlanificadorCuentas
+from cuentas import Cuenta, obtener_registro_cuentas
 import asyncio
 import re
 import os
+import json
 import shutil
-from logs import escribir_log
+from logs import escribir_log, obtener_escritor_log, obtener_tramos
+from cache_ocr import obtener_cache
+from trabajos import GestorTrabajos
+from cache_resultados import obtener_cache_resultados
+from lote_ocr import listar_lotes, sondear_lote, sondeo_periodico, OCR_LOTE
+from metricas import obtener_registro_metricas
+from almacen_resultados import obtener_almacen, formato_disponible
+from almacen_pdf import obtener_almacen_pdf, DIR_PDFS
+from diario_ejecuciones import obtener_diario
+from ventanas_fechas import a_fecha
+
+async def _pool_de(planificador: PlanificadorCuentas, cuenta: Optional[str]):
+    """Pool de la cuenta en el planificador, o None si no se pudo iniciar (la ejecución lanzará su propio navegador)."""
+    try:
+        return await planificador.pool(cuenta)
+    except Exception as e:
+        escribir_log(f"[API] No se pudo iniciar el pool de la cuenta {cuenta}: {e}")
+        return None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Crea el planificador de cuentas (un Chromium compartido, un pool por
+    cuenta) y arranca el pool de la cuenta por defecto; el resto de pools se
+    inician en el primer uso de cada cuenta. Todo se cierra al parar el servicio.
+    """
+    planificador = app.state.cuentas = PlanificadorCuentas(crear_pool_cuenta)
+    await _pool_de(planificador, None)
+
+    async def ejecutor(fecha_desde: str, fecha_hasta: str, incremental: bool, workers: Optional[int], reanudar: bool,
+                       ocr_lote: Optional[bool], progreso: ProgresoEjecucion, id_ejecucion: Optional[str],
+                       cuenta: Optional[str]):
+        pool = await _pool_de(planificador, cuenta)
+        if id_ejecucion is not None:
+            return await reanudar_ejecucion(id_ejecucion, num_workers=workers, pool=pool, progreso=progreso)
+        return await ejecutar_robot_api(
+            fecha_desde=fecha_desde,
+            fecha_hasta=fecha_hasta,
+            num_workers=workers,
+            incremental=incremental,
+            pool=pool,
+            progreso=progreso,
+            reanudar=reanudar,
+            ocr_lote=ocr_lote,
+            cuenta=cuenta
+        )
+
+    # Un slot solo toma trabajos de cuentas que no han llegado a su límite de ejecuciones
+    app.state.trabajos = GestorTrabajos(ejecutor, limite_cuenta=planificador.limite_cuenta).iniciar()
+    # Concilia en segundo plano los lotes OCR enviados a la Batch API
+    sondeo_lotes = asyncio.create_task(sondeo_periodico())
+    try:
+        yield
+    finally:
+        sondeo_lotes.cancel()
+        await asyncio.gather(sondeo_lotes, return_exceptions=True)
+        await app.state.trabajos.cerrar()
+        await planificador.cerrar()
 
 # Inicializar la aplicación de FastAPI
 app = FastAPI(
     title="API de Extracción de Facturas e-distribución",
-    description="API que automatiza la descarga de facturas del portal e-distribución recorriendo todos los roles."
+    description="API que automatiza la descarga de facturas del portal e-distribución recorriendo todos los roles.",
+    lifespan=lifespan
 )
 
 
@@ -32,6 +98,13 @@ def validar_fecha(fecha: str):
             detail="El formato de fecha es inválido. Use DD/MM/YYYY (ej: 01/10/2025)."
         )
 
+def validar_cuenta(cuenta: Optional[str]) -> Cuenta:
+    """Cuenta del registro (la cuenta por defecto si no se indica); 404 si no existe."""
+    try:
+        return obtener_registro_cuentas().obtener(cuenta)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
 # --- Endpoint de Salud ---
 @app.get("/")
 def read_root():
@@ -39,11 +112,11 @@ def read_root():
     return {"message": "Servicio de Extracción e-distribución activo. Visite /docs."}
 
 # --- Endpoint para Limpiar Archivos Temporales y Logs ---
-@app.get("/clear_files")
+@app.get("/clear_files", summary="Limpia las descargas temporales y el log; conserva los almacenes de resultados y de PDF.")
 async def clear_files():
     escribir_log("\nAPI llamada: /clear_files - Iniciando limpieza.", pretexto="")
-    carpetas = ["temp_endesa_downloads", "csv"]
-    archivo_logs = "logs/log.txt"
+    # Los resultados ya no se escriben en csv/: están en el almacén SQLite, que no se limpia
+    carpetas = ["temp_endesa_downloads"]
 
     for carpeta in carpetas:
         try:
@@ -55,14 +128,37 @@ async def clear_files():
         except Exception as e:
             escribir_log(f"Error al limpiar {carpeta}: {e}")
 
-    try:
-        if os.path.exists(archivo_logs):
-            with open(archivo_logs, "w") as f: pass
-            escribir_log("Archivo de logs vaciado.")
-    except Exception as e:
-        escribir_log(f"Error al vaciar logs: {e}")
+    # El vaciado lo hace el hilo escritor, en orden con los mensajes pendientes
+    obtener_escritor_log().vaciar()
+    escribir_log("Archivo de logs vaciado.")
+    # El almacén de PDF no se toca: el índice de PDF, el de facturas y el diario apuntan a sus archivos
+    escribir_log(f"Almacén de PDF conservado ({DIR_PDFS}): /clear_files no borra los PDF descargados.")
+
+    return {"message": f"Limpieza de archivos temporales y logs completada. El almacén de PDF ({DIR_PDFS}) se conserva."}
 
-    return {"message": "Limpieza de archivos temporales, logs y CSVs completada."}
+# --- Endpoint de Estado del Pool de Navegadores ---
+@app.get("/pool", response_model=Dict[str, Any], summary="Salud del navegador compartido y estadísticas del pool de cada cuenta.")
+def get_pool(request: Request):
+    return request.app.state.cuentas.estadisticas()
+
+# --- Endpoint de Estadísticas de la Caché OCR ---
+@app.get("/cache_ocr", response_model=Dict[str, Any], summary="Estadísticas de la caché de extracciones OCR.")
+def get_cache_ocr():
+    return obtener_cache().estadisticas()
+
+# --- Endpoint de Estadísticas de la Caché de Resultados ---
+@app.get("/cache_resultados", response_model=Dict[str, Any], summary="Estadísticas de la caché de resultados por rango de fechas.")
+def get_cache_resultados():
+    return obtener_cache_resultados().estadisticas()
+
+@app.get("/tramos", response_model=Dict[str, Any], summary="Tiempo acumulado por etapa (login, cambio de rol, filtro, lectura, descarga, OCR) y estado del log.")
+def get_tramos():
+    return {"tramos": obtener_tramos().resumen(), "log": obtener_escritor_log().estadisticas()}
+
+# --- Endpoint de Métricas (Prometheus) ---
+@app.get("/metrics", response_class=PlainTextResponse, summary="Métricas en formato de texto de Prometheus.")
+def get_metrics():
+    return PlainTextResponse(obtener_registro_metricas().exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # --- Endpoint de Extracción de Facturas (GET) ---
 @app.get(
@@ -71,21 +167,43 @@ async def clear_files():
     summary="Extrae facturas de todos los roles para un rango de fechas."
 )
 async def get_facturas(
+    request: Request,
     fecha_desde: str, # Formato DD/MM/YYYY
-    fecha_hasta: str  # Formato DD/MM/YYYY
+    fecha_hasta: str, # Formato DD/MM/YYYY
+    workers: Optional[int] = Query(None, ge=1, description="Contextos de navegador en paralelo (por defecto EDISTRIBUCION_WORKERS_ROLES)."),
+    incremental: bool = Query(False, description="Omite la descarga y el OCR de las facturas ya procesadas y sin cambios."),
+    reanudar: bool = Query(False, description="Sirve desde el índice las ventanas ya completadas en una ejecución anterior (backfills interrumpidos)."),
+    ocr_lote: Optional[bool] = Query(None, description="Envía el OCR a la Batch API; las facturas vuelven en estado PENDIENTE_OCR (por defecto EDISTRIBUCION_OCR_LOTE)."),
+    usar_cache: bool = Query(True, description="Sirve el rango desde la caché de resultados y se une a ejecuciones idénticas en curso."),
+    cuenta: Optional[str] = Query(None, description="Cuenta del portal (por defecto EDISTRIBUCION_CUENTA_POR_DEFECTO).")
 ):
-    escribir_log(f"\nAPI llamada GET /facturas: Desde={fecha_desde}, Hasta={fecha_hasta}\n", pretexto="\n")
+    escribir_log(f"\nAPI llamada GET /facturas: Desde={fecha_desde}, Hasta={fecha_hasta}, Cuenta={cuenta}\n", pretexto="\n")
     
     validar_fecha(fecha_desde)
     validar_fecha(fecha_hasta)
+    nombre_cuenta = validar_cuenta(cuenta).nombre
 
-    try:
+    async def ejecutar():
         # Usamos el nombre de función que existe en robotEndesa.py
-        facturas = await ejecutar_robot_api(
+        return await ejecutar_robot_api(
             fecha_desde=fecha_desde, 
-            fecha_hasta=fecha_hasta
+            fecha_hasta=fecha_hasta,
+            num_workers=workers,
+            incremental=incremental,
+            pool=await _pool_de(request.app.state.cuentas, nombre_cuenta),
+            reanudar=reanudar,
+            ocr_lote=ocr_lote,
+            cuenta=nombre_cuenta
         )
 
+    try:
+        # Con OCR por lotes las facturas vuelven PENDIENTE_OCR: ni se cachean ni se unen a ejecuciones con OCR en línea
+        # (incremental sí comparte caché: devuelve las mismas facturas, reutilizadas del índice)
+        if usar_cache and not (OCR_LOTE if ocr_lote is None else ocr_lote):
+            facturas = await obtener_cache_resultados().obtener(fecha_desde, fecha_hasta, ejecutar, cuenta=nombre_cuenta)
+        else:
+            facturas = await ejecutar()
+
         escribir_log(f"\n[API] ÉXITO: {len(facturas)} facturas procesadas.\n")
         return facturas
 
@@ -94,16 +212,313 @@ async def get_facturas(
         escribir_log(f"ERROR: {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
 
-# --- Endpoint de Lectura de PDF Local ---
+# --- Endpoint de Extracción de Facturas en Streaming ---
 @app.get(
-    "/pdf-local/{cups}/{numero_factura}",
+    "/facturas/stream",
+    summary="Extrae facturas enviando cada una (NDJSON o SSE) en cuanto termina su OCR."
+)
+async def get_facturas_stream(
+    request: Request,
+    fecha_desde: str, # Formato DD/MM/YYYY
+    fecha_hasta: str, # Formato DD/MM/YYYY
+    workers: Optional[int] = Query(None, ge=1, description="Contextos de navegador en paralelo (por defecto EDISTRIBUCION_WORKERS_ROLES)."),
+    incremental: bool = Query(False, description="Omite la descarga y el OCR de las facturas ya procesadas y sin cambios."),
+    formato: str = Query("ndjson", pattern="^(ndjson|sse)$", description="ndjson (una línea JSON por evento) o sse (text/event-stream)."),
+    cuenta: Optional[str] = Query(None, description="Cuenta del portal (por defecto EDISTRIBUCION_CUENTA_POR_DEFECTO).")
+):
+    escribir_log(f"\nAPI llamada GET /facturas/stream: Desde={fecha_desde}, Hasta={fecha_hasta}, Cuenta={cuenta}\n", pretexto="\n")
+
+    validar_fecha(fecha_desde)
+    validar_fecha(fecha_hasta)
+    nombre_cuenta = validar_cuenta(cuenta).nombre
+
+    async def cuerpo():
+        async for evento in ejecutar_robot_stream(
+            fecha_desde=fecha_desde,
+            fecha_hasta=fecha_hasta,
+            num_workers=workers,
+            incremental=incremental,
+            pool=await _pool_de(request.app.state.cuentas, nombre_cuenta),
+            cuenta=nombre_cuenta
+        ):
+            linea = json.dumps(evento, ensure_ascii=False)
+            if formato == "sse":
+                yield f"event: {evento['evento']}\ndata: {linea}\n\n"
+            else:
+                yield linea + "\n"
+
+    media_type = "text/event-stream" if formato == "sse" else "application/x-ndjson"
+    return StreamingResponse(cuerpo(), media_type=media_type)
+
+# --- Endpoint de Exportación del Almacén de Resultados ---
+@app.get(
+    "/facturas/exportar",
+    summary="Exporta en CSV o Parquet las facturas guardadas, filtradas por fecha de emisión, CUPS, rol o cuenta."
+)
+def get_facturas_exportar(
+    fecha_desde: Optional[str] = None, # Formato DD/MM/YYYY
+    fecha_hasta: Optional[str] = None, # Formato DD/MM/YYYY
+    cups: Optional[str] = None,
+    rol: Optional[str] = None,
+    cuenta: Optional[str] = None,
+    formato: str = Query("csv", pattern="^(csv|parquet)$", description="csv (separado por ';') o parquet (requiere pyarrow).")
+):
+    escribir_log(f"API llamada GET /facturas/exportar: Desde={fecha_desde}, Hasta={fecha_hasta}, Formato={formato}")
+
+    for fecha in (fecha_desde, fecha_hasta):
+        if fecha is not None:
+            validar_fecha(fecha)
+            if a_fecha(fecha) is None:
+                raise HTTPException(status_code=400, detail=f"Fecha inexistente: {fecha}.")
+    if cuenta is not None:
+        validar_cuenta(cuenta)
+    if not formato_disponible(formato):
+        raise HTTPException(status_code=501, detail="La exportación a Parquet requiere pyarrow instalado en el servidor.")
+
+    almacen = obtener_almacen()
+    filtros = {"desde": fecha_desde, "hasta": fecha_hasta, "cups": cups, "rol": rol, "cuenta": cuenta}
+    if formato == "parquet":
+        cuerpo, media_type = almacen.exportar_parquet(**filtros), "application/vnd.apache.parquet"
+    else:
+        cuerpo, media_type = almacen.exportar_csv(**filtros), "text/csv; charset=utf-8"
+    return StreamingResponse(
+        cuerpo, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="facturas_edistribucion.{formato}"'},
+    )
+
+# --- Endpoint de Reintento Selectivo ---
+@app.post(
+    "/facturas/retry",
+    response_model=Dict[str, Any],
+    summary="Reintenta la descarga y/o el OCR solo de las facturas con error de una ejecución o de una lista (cups, numero_factura)."
+)
+async def post_facturas_retry(request: Request, peticion: PeticionReintento):
+    escribir_log(f"\nAPI llamada POST /facturas/retry: Ejecucion={peticion.id_ejecucion}, Facturas={len(peticion.facturas)}\n", pretexto="\n")
+    if peticion.id_ejecucion is None and not peticion.facturas:
+        raise HTTPException(status_code=400, detail="Indique un id de ejecución o al menos una factura (cups, numero_factura).")
+    if peticion.id_ejecucion is not None and obtener_diario().obtener(peticion.id_ejecucion) is None:
+        raise HTTPException(status_code=404, detail=f"Ejecución {peticion.id_ejecucion} no encontrada.")
+
+    try:
+        resumen = await reintentar_facturas(
+            claves=[(f.cups, f.numero_factura) for f in peticion.facturas],
+            id_ejecucion=peticion.id_ejecucion,
+            planificador=request.app.state.cuentas,
+        )
+    except Exception as e:
+        error_msg = f"Fallo crítico en el reintento de facturas: {e}"
+        escribir_log(f"ERROR: {error_msg}")
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    if resumen["recuperadas"]:
+        # Los rangos cacheados contienen las versiones con error
+        obtener_cache_resultados().invalidar()
+    return resumen
+
+@app.get("/resultados", response_model=Dict[str, Any], summary="Estadísticas del almacén de resultados.")
+def get_resultados():
+    return obtener_almacen().estadisticas()
+
+# --- Endpoints de Trabajos Asíncronos ---
+@app.post(
+    "/jobs",
+    response_model=Dict[str, Any],
+    status_code=202,
+    summary="Encola una extracción de facturas y devuelve su id al momento."
+)
+def post_job(
+    request: Request,
+    fecha_desde: str, # Formato DD/MM/YYYY
+    fecha_hasta: str, # Formato DD/MM/YYYY
+    workers: Optional[int] = Query(None, ge=1, description="Contextos de navegador en paralelo (por defecto EDISTRIBUCION_WORKERS_ROLES)."),
+    incremental: bool = Query(False, description="Omite la descarga y el OCR de las facturas ya procesadas y sin cambios."),
+    reanudar: bool = Query(False, description="Sirve desde el índice las ventanas ya completadas en una ejecución anterior (backfills interrumpidos)."),
+    ocr_lote: Optional[bool] = Query(None, description="Envía el OCR a la Batch API; las facturas quedan PENDIENTE_OCR hasta conciliar el lote (por defecto EDISTRIBUCION_OCR_LOTE)."),
+    cuenta: Optional[str] = Query(None, description="Cuenta del portal (por defecto EDISTRIBUCION_CUENTA_POR_DEFECTO).")
+):
+    escribir_log(f"\nAPI llamada POST /jobs: Desde={fecha_desde}, Hasta={fecha_hasta}, Cuenta={cuenta}\n", pretexto="\n")
+
+    validar_fecha(fecha_desde)
+    validar_fecha(fecha_hasta)
+    nombre_cuenta = validar_cuenta(cuenta).nombre
+
+    trabajo = request.app.state.trabajos.encolar(
+        fecha_desde, fecha_hasta, incremental, workers, reanudar, ocr_lote, cuenta=nombre_cuenta
+    )
+    return {"id": trabajo.id, "estado": trabajo.estado, "cuenta": nombre_cuenta}
+
+@app.get(
+    "/jobs/{id_trabajo}",
+    response_model=EstadoTrabajo,
+    summary="Estado, progreso y resultados parciales de un trabajo."
+)
+def get_job(request: Request, id_trabajo: str):
+    trabajo = request.app.state.trabajos.obtener(id_trabajo)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {id_trabajo} no encontrado.")
+    return trabajo.a_modelo()
+
+@app.delete(
+    "/jobs/{id_trabajo}",
+    response_model=Dict[str, Any],
+    summary="Cancela un trabajo en cola o en curso."
+)
+def delete_job(request: Request, id_trabajo: str):
+    escribir_log(f"API llamada DELETE /jobs/{id_trabajo}")
+    trabajo = request.app.state.trabajos.cancelar(id_trabajo)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {id_trabajo} no encontrado.")
+    return {"id": trabajo.id, "estado": trabajo.estado}
+
+# --- Endpoints de Cuentas del Portal ---
+@app.get("/cuentas", response_model=Dict[str, Any], summary="Cuentas registradas, sus límites y el estado de su pool.")
+def get_cuentas(request: Request):
+    return request.app.state.cuentas.estadisticas()
+
+@app.post(
+    "/cuentas/jobs",
+    response_model=List[Dict[str, Any]],
+    status_code=202,
+    summary="Encola la misma extracción para varias cuentas (todas las activas si no se indican); se ejecutan en paralelo."
+)
+def post_cuentas_jobs(
+    request: Request,
+    fecha_desde: str, # Formato DD/MM/YYYY
+    fecha_hasta: str, # Formato DD/MM/YYYY
+    cuentas: Optional[List[str]] = Query(None, description="Una o varias cuentas (se repite el parámetro)."),
+    workers: Optional[int] = Query(None, ge=1, description="Contextos de navegador en paralelo por cuenta (por defecto EDISTRIBUCION_WORKERS_ROLES)."),
+    incremental: bool = Query(False, description="Omite la descarga y el OCR de las facturas ya procesadas y sin cambios."),
+    reanudar: bool = Query(False, description="Sirve desde el índice las ventanas ya completadas en una ejecución anterior (backfills interrumpidos)."),
+    ocr_lote: Optional[bool] = Query(None, description="Envía el OCR a la Batch API (por defecto EDISTRIBUCION_OCR_LOTE).")
+):
+    escribir_log(f"\nAPI llamada POST /cuentas/jobs: Desde={fecha_desde}, Hasta={fecha_hasta}, Cuentas={cuentas}\n", pretexto="\n")
+
+    validar_fecha(fecha_desde)
+    validar_fecha(fecha_hasta)
+    seleccion = [validar_cuenta(c) for c in cuentas] if cuentas else obtener_registro_cuentas().activas()
+
+    respuesta = []
+    for cuenta in seleccion:
+        trabajo = request.app.state.trabajos.encolar(
+            fecha_desde, fecha_hasta, incremental, workers, reanudar, ocr_lote, cuenta=cuenta.nombre
+        )
+        respuesta.append({"cuenta": cuenta.nombre, "id": trabajo.id, "estado": trabajo.estado})
+    return respuesta
+
+# --- Endpoints del Diario de Ejecuciones ---
+@app.get(
+    "/ejecuciones",
+    response_model=List[Dict[str, Any]],
+    summary="Últimas ejecuciones del robot registradas en el diario, con su estado y roles exportados."
+)
+def get_ejecuciones(limite: int = Query(50, ge=1, le=1000)):
+    return obtener_diario().listar(limite)
+
+@app.get(
+    "/ejecuciones/{id_ejecucion}",
     response_model=Dict[str, Any],
-    summary="Obtiene el PDF en Base64 desde el disco local."
+    summary="Etapa alcanzada por cada rol de una ejecución y facturas por etapa (listada, descargada, extraída, exportada)."
 )
-def get_pdf_local(cups: str, numero_factura: str):
+def get_ejecucion(id_ejecucion: str):
+    resumen = obtener_diario().resumen(id_ejecucion)
+    if resumen is None:
+        raise HTTPException(status_code=404, detail=f"Ejecución {id_ejecucion} no encontrada.")
+    return resumen
+
+@app.post(
+    "/ejecuciones/{id_ejecucion}/reanudar",
+    response_model=Dict[str, Any],
+    status_code=202,
+    summary="Encola un trabajo que retoma la ejecución desde su último punto de control."
+)
+def post_reanudar_ejecucion(
+    request: Request,
+    id_ejecucion: str,
+    workers: Optional[int] = Query(None, ge=1, description="Contextos de navegador en paralelo (por defecto, los de la ejecución original).")
+):
+    escribir_log(f"\nAPI llamada POST /ejecuciones/{id_ejecucion}/reanudar\n", pretexto="\n")
+    datos = obtener_diario().obtener(id_ejecucion)
+    if datos is None:
+        raise HTTPException(status_code=404, detail=f"Ejecución {id_ejecucion} no encontrada.")
+    trabajo = request.app.state.trabajos.encolar(
+        datos["fecha_desde"], datos["fecha_hasta"], datos["parametros"].get("incremental", False), workers,
+        id_ejecucion=id_ejecucion, cuenta=validar_cuenta(datos["parametros"].get("cuenta")).nombre,
+    )
+    return {"id": trabajo.id, "estado": trabajo.estado, "id_ejecucion": id_ejecucion}
+
+# --- Endpoints de Lotes OCR (Batch API) ---
+@app.get(
+    "/lotes_ocr",
+    response_model=List[Dict[str, Any]],
+    summary="Lotes OCR enviados a la Batch API y su estado de conciliación."
+)
+def get_lotes_ocr():
+    return listar_lotes()
+
+@app.get(
+    "/lotes_ocr/{nombre}",
+    response_model=Dict[str, Any],
+    summary="Consulta un lote OCR y, si ha terminado, aplica sus resultados a las facturas."
+)
+async def get_lote_ocr(nombre: str):
+    escribir_log(f"API llamada GET /lotes_ocr/{nombre}")
+    try:
+        resumen = await sondear_lote(nombre)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"No se pudo consultar el lote: {e}")
+    if resumen is None:
+        raise HTTPException(status_code=404, detail=f"Lote {nombre} no encontrado.")
+    return resumen
+
+# --- Endpoints de PDF del Almacén Local ---
+@app.get(
+    "/pdf-local/{cups}/{numero_factura}",
+    response_class=FileResponse,
+    summary="Descarga el PDF de una factura desde el almacén local (admite ETag y Range)."
+)
+def get_pdf_local(request: Request, cups: str, numero_factura: str):
     escribir_log(f"API llamada (PDF Local): CUPS={cups}, Factura={numero_factura}")
-    resultado = obtener_pdf_local_base64(
-        cups=cups,
-        numero_factura=numero_factura,
+    encontrado = obtener_almacen_pdf().buscar(cups, numero_factura)
+    if encontrado is None:
+        raise HTTPException(status_code=404, detail=f"PDF de la factura {numero_factura} ({cups}) no encontrado.")
+    hash_pdf, ruta = encontrado
+    # El hash del contenido es un ETag fuerte: el documento no cambia mientras no cambie el hash
+    etag = f'"{hash_pdf}"'
+    if etag in [e.strip() for e in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return FileResponse(
+        ruta, media_type="application/pdf", filename=f"{cups}_{numero_factura}.pdf",
+        content_disposition_type="inline", headers={"ETag": etag, "Cache-Control": "private, max-age=86400"},
     )
-    return resultado
\ No newline at end of file
+
+@app.get(
+    "/pdfs/zip",
+    summary="Descarga en un ZIP (emitido por trozos) los PDF de un rango de fechas de emisión o de una lista de CUPS."
+)
+def get_pdfs_zip(
+    fecha_desde: Optional[str] = None, # Formato DD/MM/YYYY
+    fecha_hasta: Optional[str] = None, # Formato DD/MM/YYYY
+    cups: Optional[List[str]] = Query(None, description="Uno o varios CUPS (se repite el parámetro).")
+):
+    escribir_log(f"API llamada GET /pdfs/zip: Desde={fecha_desde}, Hasta={fecha_hasta}, CUPS={cups}")
+
+    if not (fecha_desde or fecha_hasta or cups):
+        raise HTTPException(status_code=400, detail="Indique un rango de fechas o al menos un CUPS.")
+    for fecha in (fecha_desde, fecha_hasta):
+        if fecha is not None:
+            validar_fecha(fecha)
+            if a_fecha(fecha) is None:
+                raise HTTPException(status_code=400, detail=f"Fecha inexistente: {fecha}.")
+
+    almacen = obtener_almacen_pdf()
+    entradas = almacen.listar(fecha_desde, fecha_hasta, cups)
+    if not entradas:
+        raise HTTPException(status_code=404, detail="No hay PDF guardados para ese filtro.")
+    return StreamingResponse(
+        almacen.exportar_zip(entradas), media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="facturas_edistribucion_pdf.zip"'},
+    )
+
+@app.get("/pdfs", response_model=Dict[str, Any], summary="Estadísticas del almacén de PDF (facturas, documentos únicos, espacio).")
+def get_pdfs():
+    return obtener_almacen_pdf().estadisticas()
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+Mide el extractor local de texto (documentos/segundo, facturas que no
+necesitan LLM) y su precisión por campo frente a una referencia:
+- con --pdfs, las extracciones del LLM guardadas en la caché OCR;
+- con --sinteticas, los datos con los que se generaron los PDFs.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_extractor_local.py --sinteticas 200
+    python benchmarks/bench_extractor_local.py --pdfs temp_endesa_downloads/Facturas_Edistribucion_PDFs
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modelos_datos import FacturaEndesaDistribucion
+from extractor_local import CAMPOS_DETALLE, PdfReader, extraer_texto_pdf, extraer_campos
+from cache_ocr import obtener_cache
+from indice_facturas import obtener_indice
+from pdf_parser import huella_extraccion
+
+
+def _normalizar(valor):
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, (int, float)):
+        return round(float(valor), 2)
+    return str(valor).strip().replace("/", "-").casefold()
+
+def _casos_sinteticos(num: int, carpeta: str) -> list[tuple[FacturaEndesaDistribucion, str, dict]]:
+    from fixture_factura_pdf import generar_facturas, pdf_factura
+    casos = []
+    for datos in generar_facturas(num):
+        ruta = os.path.join(carpeta, f"{datos['cups']}_{datos['numero_factura']}.pdf")
+        with open(ruta, "wb") as f:
+            f.write(pdf_factura(datos))
+        factura = FacturaEndesaDistribucion(cups=datos["cups"], numero_factura=datos["numero_factura"], importe_total_tabla=datos["importe_facturado"])
+        casos.append((factura, ruta, datos))
+    return casos
+
+def _casos_reales(carpeta: str) -> list[tuple[FacturaEndesaDistribucion, str, dict]]:
+    """PDFs descargados cuya extracción LLM está en la caché; los datos de tabla salen del índice."""
+    cache, indice, huella = obtener_cache(), obtener_indice(), huella_extraccion()
+    casos = []
+    for nombre in sorted(os.listdir(carpeta)):
+        if not nombre.lower().endswith(".pdf") or "_" not in nombre:
+            continue
+        ruta = os.path.join(carpeta, nombre)
+        referencia = cache.obtener(cache.calcular_clave(ruta, huella))
+        if referencia is None:
+            continue
+        cups, numero = nombre[:-4].split("_", 1)
+        registro = indice.obtener(cups, numero)
+        if registro:
+            factura = FacturaEndesaDistribucion.model_validate_json(registro["datos_json"])
+        else:
+            factura = FacturaEndesaDistribucion(cups=cups, numero_factura=numero)
+        casos.append((factura, ruta, referencia))
+    return casos
+
+
+def main(casos: list[tuple[FacturaEndesaDistribucion, str, dict]]):
+    if not casos:
+        print("No hay PDFs con referencia para comparar.")
+        return
+
+    t0 = time.perf_counter()
+    resultados = [extraer_campos(extraer_texto_pdf(ruta), factura) for factura, ruta, _ in casos]
+    segundos = time.perf_counter() - t0
+
+    sin_llm = sum(1 for r in resultados if not r.campos_pendientes())
+    print(f"Documentos: {len(casos)} | {len(casos) / segundos:.1f} docs/s ({segundos / len(casos) * 1000:.2f} ms/doc)")
+    print(f"Resueltos sin LLM: {sin_llm}/{len(casos)} ({sin_llm / len(casos):.0%})")
+    print(f"\n{'campo':<30} {'cobertura':>10} {'aciertos':>10}")
+
+    total_fiables = total_aciertos = 0
+    for campo in CAMPOS_DETALLE:
+        con_referencia = fiables = aciertos = 0
+        for (_, _, referencia), resultado in zip(casos, resultados):
+            esperado = _normalizar(referencia.get(campo))
+            if esperado is None:
+                continue
+            con_referencia += 1
+            valores = resultado.fiables()
+            if campo in valores:
+                fiables += 1
+                aciertos += _normalizar(valores[campo]) == esperado
+        if not con_referencia:
+            continue
+        total_fiables += fiables
+        total_aciertos += aciertos
+        precision = f"{aciertos / fiables:.1%}" if fiables else "-"
+        print(f"{campo:<30} {fiables / con_referencia:>10.1%} {precision:>10}")
+    if total_fiables:
+        print(f"\nPrecisión global de los campos aceptados: {total_aciertos / total_fiables:.2%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdfs", help="Carpeta con PDFs descargados (referencia: caché OCR del LLM).")
+    parser.add_argument("--sinteticas", type=int, default=200, help="Número de PDFs sintéticos si no se indica --pdfs.")
+    args = parser.parse_args()
+
+    if PdfReader is None:
+        sys.exit("pypdf no está instalado: pip install pypdf")
+    if args.pdfs:
+        main(_casos_reales(args.pdfs))
+    else:
+        with tempfile.TemporaryDirectory() as carpeta:
+            main(_casos_sinteticos(args.sinteticas, carpeta))
@@ -0,0 +1,97 @@
+"""
+Lanza N extracciones concurrentes con `procesar_pdf_local_async` contra el
+servidor simulado de OpenAI y muestra el rendimiento del extractor.
+Compara el envío del PDF completo como archivo (subida + borrado) con el
+envío en línea del texto de las páginas relevantes: latencia y tokens por factura.
+
+Uso (desde la raíz del repositorio, con benchmarks/mock_openai.py en marcha):
+    python benchmarks/bench_extractor_openai.py --facturas 50 --paginas-legales 3
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import json
+import tempfile
+import statistics
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("OPENAI_BASE_URL", "http://127.0.0.1:8001/v1")
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+# Medimos el LLM: la extracción local resolvería las facturas sintéticas sin llamarlo
+os.environ["EDISTRIBUCION_OCR_LOCAL"] = "0"
+
+import cache_ocr
+import pdf_parser
+from fixture_factura_pdf import generar_facturas, pdf_factura
+from modelos_datos import FacturaEndesaDistribucion
+from pdf_parser import procesar_pdf_local_async
+from extractor_openai import obtener_extractor
+
+URL_STATS = os.environ["OPENAI_BASE_URL"].rsplit("/v1", 1)[0] + "/stats"
+
+
+def _estadisticas_mock() -> dict:
+    with urllib.request.urlopen(URL_STATS) as respuesta:
+        return json.load(respuesta)
+
+
+async def _medir(factura: FacturaEndesaDistribucion, ruta: str) -> tuple[bool, float]:
+    t0 = time.perf_counter()
+    ok = await procesar_pdf_local_async(factura, ruta)
+    return ok, time.perf_counter() - t0
+
+async def _ejecutar_modo(modo: str, casos: list[tuple[dict, str]], carpeta_cache: str) -> dict:
+    pdf_parser.ENVIO_TEXTO = modo == "texto"
+    # Caché OCR vacía en cada modo para que todas las facturas lleguen al LLM
+    cache_ocr._cache = cache_ocr.CacheExtracciones(ruta=os.path.join(carpeta_cache, f"{modo}.sqlite3"))
+    antes = _estadisticas_mock()
+
+    facturas = [(FacturaEndesaDistribucion(cups=d["cups"], numero_factura=d["numero_factura"]), ruta) for d, ruta in casos]
+    t0 = time.perf_counter()
+    resultados = await asyncio.gather(*[_medir(f, r) for f, r in facturas])
+    duracion = time.perf_counter() - t0
+
+    despues = _estadisticas_mock()
+    latencias = [segundos for _, segundos in resultados]
+    n = len(casos)
+    return {
+        "ok": sum(ok for ok, _ in resultados),
+        "duracion": duracion,
+        "latencia_media": statistics.mean(latencias),
+        "latencia_p95": sorted(latencias)[int(0.95 * (n - 1))],
+        "tokens_entrada": (despues["tokens_entrada"] - antes["tokens_entrada"]) / n,
+        "llamadas": (despues["files"] + despues["files_borrados"] + despues["responses"]
+                     - antes["files"] - antes["files_borrados"] - antes["responses"]) / n,
+    }
+
+
+async def main(num_facturas: int, paginas_legales: int, modos: list[str]):
+    with tempfile.TemporaryDirectory() as carpeta:
+        casos = []
+        for datos in generar_facturas(num_facturas):
+            ruta = os.path.join(carpeta, f"{datos['cups']}_{datos['numero_factura']}.pdf")
+            with open(ruta, "wb") as f:
+                f.write(pdf_factura(datos, paginas_legales))
+            casos.append((datos, ruta))
+
+        print(f"Facturas: {num_facturas} | Páginas por PDF: {1 + paginas_legales}")
+        print(f"{'modo':<8} {'OK':>4} {'tiempo':>8} {'fact/min':>9} {'lat. media':>11} {'lat. p95':>9} {'tokens in':>10} {'llamadas':>9}")
+        for modo in modos:
+            r = await _ejecutar_modo(modo, casos, carpeta)
+            print(f"{modo:<8} {r['ok']:>4} {r['duracion']:>7.2f}s {num_facturas / r['duracion'] * 60:>9.1f} "
+                  f"{r['latencia_media']:>10.2f}s {r['latencia_p95']:>8.2f}s {r['tokens_entrada']:>10.0f} {r['llamadas']:>9.1f}")
+    print(obtener_extractor().estadisticas())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--facturas", type=int, default=20)
+    parser.add_argument("--paginas-legales", type=int, default=3, help="Páginas de condiciones generales por PDF.")
+    parser.add_argument("--modo", choices=["archivo", "texto", "ambos"], default="ambos")
+    args = parser.parse_args()
+    modos = ["archivo", "texto"] if args.modo == "ambos" else [args.modo]
+    asyncio.run(main(args.facturas, args.paginas_legales, modos))
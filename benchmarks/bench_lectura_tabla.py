@@ -0,0 +1,73 @@
+"""
+Compara la lectura de la tabla de facturas fila a fila (seis `inner_text()`
+por fila) con la lectura en bloque (un único `evaluate_all`), sobre una
+reproducción local de la tabla del portal.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_lectura_tabla.py --filas 200 --repeticiones 3
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from playwright.async_api import async_playwright
+from fixture_tabla import generar_filas, html_tabla
+from modelos_datos import FacturaEndesaDistribucion
+from robotEndesa import SELECTOR_FILAS_TABLA, _leer_celdas_bulk, _leer_celdas_fila, _asignar_celdas
+
+
+async def _lectura_fila_a_fila(page) -> list[FacturaEndesaDistribucion]:
+    filas = page.locator(SELECTOR_FILAS_TABLA)
+    facturas = []
+    for i in range(await filas.count()):
+        factura = FacturaEndesaDistribucion(cups="PENDIENTE", secuencial=str(i))
+        _asignar_celdas(factura, await _leer_celdas_fila(filas.nth(i)))
+        facturas.append(factura)
+    return facturas
+
+async def _lectura_bulk(page) -> list[FacturaEndesaDistribucion]:
+    facturas = []
+    for i, celdas in enumerate(await _leer_celdas_bulk(page)):
+        factura = FacturaEndesaDistribucion(cups="PENDIENTE", secuencial=str(i))
+        _asignar_celdas(factura, celdas)
+        facturas.append(factura)
+    return facturas
+
+
+async def main(num_filas: int, repeticiones: int):
+    html = html_tabla(generar_filas(num_filas))
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        page = await browser.new_page()
+        await page.set_content(html)
+
+        tiempos = {}
+        resultados = {}
+        for nombre, funcion in (("fila_a_fila", _lectura_fila_a_fila), ("bulk", _lectura_bulk)):
+            mediciones = []
+            for _ in range(repeticiones):
+                t0 = time.perf_counter()
+                resultados[nombre] = await funcion(page)
+                mediciones.append(time.perf_counter() - t0)
+            tiempos[nombre] = min(mediciones)
+
+        await browser.close()
+
+    iguales = [f.model_dump() for f in resultados["fila_a_fila"]] == [f.model_dump() for f in resultados["bulk"]]
+    print(f"Filas: {num_filas} | Resultados idénticos: {iguales}")
+    for nombre, segundos in tiempos.items():
+        print(f"  {nombre:<12} {segundos * 1000:9.1f} ms  ({segundos / num_filas * 1000:.2f} ms/fila)")
+    print(f"  Aceleración: x{tiempos['fila_a_fila'] / tiempos['bulk']:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filas", type=int, default=200)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.filas, args.repeticiones))
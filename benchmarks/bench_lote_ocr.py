@@ -0,0 +1,89 @@
+"""
+Recorre el flujo completo del OCR por lotes contra el servidor simulado de
+OpenAI: aparca N facturas sintéticas (PENDIENTE_OCR en el índice), envía el
+lote JSONL, lo sondea hasta que termina y concilia los resultados desde el
+índice, como hace el sondeo periódico de la API.
+
+Uso (desde la raíz del repositorio, con benchmarks/mock_openai.py en marcha):
+    python benchmarks/bench_lote_ocr.py --facturas 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import json
+import tempfile
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("OPENAI_BASE_URL", "http://127.0.0.1:8001/v1")
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+# Medimos el LLM: la extracción local resolvería las facturas sintéticas sin llamarlo
+os.environ["EDISTRIBUCION_OCR_LOCAL"] = "0"
+
+import cache_ocr
+import indice_facturas
+import lote_ocr
+from fixture_factura_pdf import generar_facturas, pdf_factura
+from modelos_datos import FacturaEndesaDistribucion
+from indice_facturas import ESTADO_PENDIENTE_OCR, ESTADO_COMPLETA, estado_proceso_de
+
+URL_STATS = os.environ["OPENAI_BASE_URL"].rsplit("/v1", 1)[0] + "/stats"
+
+
+def _estadisticas_mock() -> dict:
+    with urllib.request.urlopen(URL_STATS) as respuesta:
+        return json.load(respuesta)
+
+
+async def main(num_facturas: int, paginas_legales: int, intervalo_s: float):
+    with tempfile.TemporaryDirectory() as carpeta:
+        # Índice, caché OCR y lotes en una carpeta temporal
+        indice_facturas._indice = indice_facturas.IndiceFacturas(ruta=os.path.join(carpeta, "indice.sqlite3"))
+        cache_ocr._cache = cache_ocr.CacheExtracciones(ruta=os.path.join(carpeta, "cache.sqlite3"))
+        lote_ocr.DIR_LOTES = os.path.join(carpeta, "lotes")
+
+        facturas = []
+        for datos in generar_facturas(num_facturas):
+            ruta = os.path.join(carpeta, f"{datos['cups']}_{datos['numero_factura']}.pdf")
+            with open(ruta, "wb") as f:
+                f.write(pdf_factura(datos, paginas_legales))
+            facturas.append((FacturaEndesaDistribucion(cups=datos["cups"], numero_factura=datos["numero_factura"]), ruta))
+
+        antes = _estadisticas_mock()
+        lote = lote_ocr.LoteOCR()
+        t0 = time.perf_counter()
+        for factura, ruta in facturas:
+            await lote.encolar(factura, ruta)
+        await lote.cerrar()
+        t_envio = time.perf_counter() - t0
+        aparcadas = sum(estado_proceso_de(f) == ESTADO_PENDIENTE_OCR for f, _ in facturas)
+
+        # Conciliación desde el índice (sin las facturas en memoria), como el sondeo periódico de la API
+        resumenes = [await lote_ocr.esperar_lote(nombre, intervalo_s) for nombre in lote.nombres]
+        t_total = time.perf_counter() - t0
+        despues = _estadisticas_mock()
+
+        indice = indice_facturas.obtener_indice()
+        completas = sum(
+            indice.obtener(f.cups, f.numero_factura)["estado_proceso"] == ESTADO_COMPLETA for f, _ in facturas
+        )
+        llamadas = sum(despues[k] - antes[k] for k in ("files", "files_borrados", "responses", "batches"))
+
+    print(f"Facturas: {num_facturas} | Aparcadas PENDIENTE_OCR: {aparcadas} | Lotes: {len(resumenes)}")
+    print(f"Envío: {t_envio:.2f}s | Hasta conciliar: {t_total:.2f}s")
+    print(f"Llamadas a la API: {llamadas} | Peticiones en lote: {despues['batch_peticiones'] - antes['batch_peticiones']}")
+    print(f"Completas en el índice tras conciliar: {completas}/{num_facturas}")
+    for resumen in resumenes:
+        print(resumen)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--facturas", type=int, default=50)
+    parser.add_argument("--paginas-legales", type=int, default=3, help="Páginas de condiciones generales por PDF.")
+    parser.add_argument("--intervalo", type=float, default=1.0, help="Segundos entre consultas del estado del lote.")
+    args = parser.parse_args()
+    asyncio.run(main(args.facturas, args.paginas_legales, args.intervalo))
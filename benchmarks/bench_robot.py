@@ -0,0 +1,299 @@
+"""
+Ejecuta el robot completo (`ejecutar_robot_api`: login, roles, ventanas,
+tabla, descargas y OCR) contra el portal simulado y el servidor simulado de
+OpenAI, y muestra el tiempo total, las facturas por minuto, el tiempo por
+etapa y el pico de memoria (Python más los procesos de Chromium).
+
+Arranca por su cuenta benchmarks/portal_simulado.py y benchmarks/mock_openai.py
+con las latencias indicadas. El índice, la caché OCR, la sesión, los PDF y el
+log van a una carpeta temporal: no toca los datos reales.
+
+Uso (desde la raíz del repositorio, con los navegadores de Playwright instalados):
+    python benchmarks/bench_robot.py --roles 3 --filas 40 --workers 2
+    python benchmarks/bench_robot.py --etiqueta antes --salida resultados_bench.jsonl
+    python benchmarks/bench_robot.py --modo-rapido --etiqueta despues --salida resultados_bench.jsonl --comparar antes
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIR_BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, DIR_BENCH)
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _leer_json(url: str) -> dict:
+    with urllib.request.urlopen(url, timeout=5) as respuesta:
+        return json.load(respuesta)
+
+def _arrancar_servidor(script: str, entorno: dict, url_estado: str) -> subprocess.Popen:
+    """Lanza un servidor simulado y espera a que responda en `url_estado`."""
+    proceso = subprocess.Popen(
+        [sys.executable, os.path.join(DIR_BENCH, script)], env={**os.environ, **entorno},
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    limite = time.time() + 30
+    while time.time() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"{script} terminó al arrancar: {proceso.stderr.read().decode()[-500:]}")
+        try:
+            _leer_json(url_estado)
+            return proceso
+        except OSError:
+            time.sleep(0.2)
+    proceso.kill()
+    raise RuntimeError(f"{script} no respondió en 30 s")
+
+
+def _rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def _descendientes(pid: int) -> list[int]:
+    hijos: dict[int, list[int]] = {}
+    for nombre in os.listdir("/proc"):
+        if not nombre.isdigit():
+            continue
+        try:
+            with open(f"/proc/{nombre}/stat") as f:
+                # El nombre del proceso va entre paréntesis y puede contener espacios
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        hijos.setdefault(ppid, []).append(int(nombre))
+    resultado, pendientes = [], [pid]
+    while pendientes:
+        for hijo in hijos.get(pendientes.pop(), []):
+            resultado.append(hijo)
+            pendientes.append(hijo)
+    return resultado
+
+
+class MedidorMemoria(threading.Thread):
+    """
+    Muestrea la memoria residente de este proceso y de sus descendientes
+    (driver de Playwright y Chromium) y guarda el pico. Los servidores
+    simulados también son hijos: se excluyen por pid.
+    """
+    def __init__(self, excluir: set[int], intervalo_s: float = 0.5):
+        super().__init__(name="medidor-memoria", daemon=True)
+        self.excluir = excluir
+        self.intervalo_s = intervalo_s
+        self.pico_python_kb = 0
+        self.pico_total_kb = 0
+        self._parar = threading.Event()
+
+    def run(self):
+        if not os.path.isdir("/proc"):
+            return
+        while not self._parar.is_set():
+            propio = _rss_kb(os.getpid())
+            excluidos = set(self.excluir)
+            for pid in self.excluir:
+                excluidos.update(_descendientes(pid))
+            total = propio + sum(_rss_kb(p) for p in _descendientes(os.getpid()) if p not in excluidos)
+            self.pico_python_kb = max(self.pico_python_kb, propio)
+            self.pico_total_kb = max(self.pico_total_kb, total)
+            self._parar.wait(self.intervalo_s)
+
+    def detener(self):
+        self._parar.set()
+        self.join()
+
+
+async def _ejecutar(args, carpeta: str) -> dict:
+    # Importamos el robot después de fijar las URL y el entorno del extractor
+    import robotEndesa
+    import cache_ocr
+    import indice_facturas
+    import almacen_resultados
+    import almacen_pdf
+    from logs import obtener_tramos, obtener_escritor_log
+    from robotEndesa import ejecutar_robot_api, _sesion_valida, _login_con_reintentos
+    from pool_navegadores import PoolNavegadores
+
+    indice_facturas._indice = indice_facturas.IndiceFacturas(ruta=os.path.join(carpeta, "indice.sqlite3"))
+    cache_ocr._cache = cache_ocr.CacheExtracciones(ruta=os.path.join(carpeta, "cache_ocr.sqlite3"))
+    robotEndesa.DOWNLOAD_FOLDERS["PDF"] = os.path.join(carpeta, "pdfs")
+    os.makedirs(robotEndesa.DOWNLOAD_FOLDERS["PDF"], exist_ok=True)
+    almacen_resultados._almacen = almacen_resultados.AlmacenResultados(ruta=os.path.join(carpeta, "resultados.sqlite3"))
+    almacen_pdf._almacen_pdf = almacen_pdf.AlmacenPDF(directorio=os.path.join(carpeta, "almacen_pdf"),
+                                                      ruta_indice=os.path.join(carpeta, "indice_pdfs.sqlite3"))
+    obtener_tramos().reiniciar()
+
+    # Pool propio con la sesión en la carpeta temporal (no pisa la sesión guardada del portal real)
+    t0 = time.perf_counter()
+    pool = PoolNavegadores(validar_sesion=_sesion_valida, autenticar=_login_con_reintentos,
+                           max_sesiones=1, ruta_estado=os.path.join(carpeta, "sesion.json"),
+                           modo_rapido=args.modo_rapido)
+    try:
+        await pool.iniciar()
+        facturas = await ejecutar_robot_api(args.desde, args.hasta, num_workers=args.workers, pool=pool)
+    finally:
+        await pool.cerrar()
+    duracion = time.perf_counter() - t0
+
+    # Esperamos a que el hilo del log vacíe su cola antes de devolver la consola
+    escritor = obtener_escritor_log()
+    limite = time.time() + 5
+    while escritor.cola.qsize() and time.time() < limite:
+        await asyncio.sleep(0.05)
+    return {
+        "facturas": len(facturas),
+        "con_error": sum(f.error_RPA for f in facturas),
+        "duracion_s": round(duracion, 2),
+        "tramos": obtener_tramos().resumen(),
+    }
+
+
+def _buscar_medicion(ruta: str | None, etiqueta: str) -> dict | None:
+    """Última medición guardada con esa etiqueta en el archivo de resultados."""
+    if not ruta or not os.path.exists(ruta):
+        return None
+    encontrada = None
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            if linea.strip():
+                medicion = json.loads(linea)
+                if medicion.get("etiqueta") == etiqueta:
+                    encontrada = medicion
+    return encontrada
+
+def _imprimir_comparacion(antes: dict, despues: dict):
+    """Tiempo total y por etapa de dos mediciones, con la variación relativa."""
+    def fila(nombre: str, a: float, d: float, unidad: str):
+        variacion = f"{(d - a) / a * 100:+.1f}%" if a else "-"
+        print(f"{nombre:<14} {a:>10.1f}{unidad} {d:>10.1f}{unidad} {variacion:>9}")
+
+    print(f"\nComparación '{antes['etiqueta']}' -> '{despues['etiqueta']}'")
+    print(f"{'etapa':<14} {'antes':>12} {'después':>12} {'var.':>9}")
+    fila("total", antes["duracion_s"], despues["duracion_s"], "s ")
+    for nombre in sorted(set(antes["tramos"]) | set(despues["tramos"])):
+        fila(nombre, antes["tramos"].get(nombre, {}).get("media_ms", 0.0),
+             despues["tramos"].get(nombre, {}).get("media_ms", 0.0), "ms")
+
+
+def main(args):
+    puerto_portal, puerto_llm = _puerto_libre(), _puerto_libre()
+    url_portal = f"http://127.0.0.1:{puerto_portal}"
+    url_llm = f"http://127.0.0.1:{puerto_llm}"
+
+    portal = _arrancar_servidor("portal_simulado.py", {
+        "PORTAL_PUERTO": str(puerto_portal),
+        "PORTAL_ROLES": str(args.roles),
+        "PORTAL_FILAS_POR_ROL": str(args.filas),
+        "PORTAL_FILAS_BLOQUE": str(args.filas_bloque),
+        "PORTAL_LATENCIA_PAGINA_MS": str(args.latencia_pagina_ms),
+        "PORTAL_LATENCIA_TABLA_MS": str(args.latencia_tabla_ms),
+        "PORTAL_LATENCIA_PDF_MS": str(args.latencia_pdf_ms),
+        "PORTAL_IMAGENES": str(args.imagenes),
+        "PORTAL_LATENCIA_RECURSO_MS": str(args.latencia_recurso_ms),
+    }, f"{url_portal}/stats")
+    llm = _arrancar_servidor("mock_openai.py", {
+        "MOCK_PUERTO": str(puerto_llm),
+        "MOCK_LATENCIA_MS": str(args.latencia_llm_ms),
+    }, f"{url_llm}/stats")
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        os.environ.update({
+            "EDISTRIBUCION_URL_LOGIN": f"{url_portal}/login",
+            "EDISTRIBUCION_URL_FACTURAS": f"{url_portal}/facturas",
+            "EDISTRIBUCION_LOG": os.path.join(carpeta, "log.jsonl"),
+            "OPENAI_BASE_URL": f"{url_llm}/v1",
+            "OPENAI_API_KEY": "mock",
+            # Medimos el robot, no el bucket de tokens de la cuenta
+            "OPENAI_LIMITE_TPM": "10000000",
+            # Sin --ocr-local la extracción local resolvería las facturas sintéticas sin llamar al LLM
+            "EDISTRIBUCION_OCR_LOCAL": "1" if args.ocr_local else "0",
+        })
+        medidor = MedidorMemoria(excluir={portal.pid, llm.pid})
+        medidor.start()
+        consola = sys.stdout
+        try:
+            if not args.verbose:
+                # El robot escribe cada fila en la consola: durante la medición la silenciamos
+                sys.stdout = open(os.devnull, "w")
+            resultado = asyncio.run(_ejecutar(args, carpeta))
+        finally:
+            if sys.stdout is not consola:
+                sys.stdout.close()
+                sys.stdout = consola
+            medidor.detener()
+            estadisticas_portal = _leer_json(f"{url_portal}/stats")
+            estadisticas_llm = _leer_json(f"{url_llm}/stats")
+            portal.terminate()
+            llm.terminate()
+
+    resultado.update({
+        "etiqueta": args.etiqueta,
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("etiqueta", "salida", "verbose", "comparar")},
+        "facturas_min": round(resultado["facturas"] / resultado["duracion_s"] * 60, 1) if resultado["duracion_s"] else 0.0,
+        "pico_rss_python_mb": round(medidor.pico_python_kb / 1024, 1),
+        "pico_rss_total_mb": round(medidor.pico_total_kb / 1024, 1),
+        "portal": estadisticas_portal,
+        "llm_llamadas": estadisticas_llm["responses"] + estadisticas_llm["files"],
+    })
+
+    print(f"Roles: {args.roles} | Filas por rol: {args.filas} | Workers: {args.workers} | Rango: {args.desde} - {args.hasta} "
+          f"| Modo rápido: {'sí' if args.modo_rapido else 'no'}")
+    print(f"Facturas: {resultado['facturas']} ({resultado['con_error']} con error) | Tiempo: {resultado['duracion_s']:.2f}s "
+          f"| {resultado['facturas_min']:.1f} facturas/min")
+    print(f"Pico RSS: {resultado['pico_rss_python_mb']:.1f} MB Python, {resultado['pico_rss_total_mb']:.1f} MB con Chromium")
+    print(f"Portal: {estadisticas_portal} | Llamadas al LLM: {resultado['llm_llamadas']}")
+    print(f"{'etapa':<14} {'n':>6} {'total':>9} {'media':>10} {'máx':>10}")
+    for nombre, t in sorted(resultado["tramos"].items(), key=lambda e: -e[1]["total_s"]):
+        print(f"{nombre:<14} {t['n']:>6} {t['total_s']:>8.2f}s {t['media_ms']:>8.1f}ms {t['max_ms']:>8.1f}ms")
+
+    if args.comparar:
+        anterior = _buscar_medicion(args.salida, args.comparar)
+        if anterior is None:
+            print(f"No hay ninguna medición '{args.comparar}' en {args.salida} para comparar.")
+        else:
+            _imprimir_comparacion(anterior, resultado)
+
+    if args.salida:
+        with open(args.salida, "a", encoding="utf-8") as f:
+            f.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--roles", type=int, default=3)
+    parser.add_argument("--filas", type=int, default=40, help="Facturas de cada rol en el portal simulado.")
+    parser.add_argument("--filas-bloque", type=int, default=50, help="Filas por bloque de 'Cargar más'.")
+    parser.add_argument("--desde", default="01/01/2025")
+    parser.add_argument("--hasta", default="31/12/2025")
+    parser.add_argument("--workers", type=int, default=1, help="Contextos de navegador en paralelo.")
+    parser.add_argument("--latencia-pagina-ms", type=float, default=300)
+    parser.add_argument("--latencia-tabla-ms", type=float, default=800)
+    parser.add_argument("--latencia-pdf-ms", type=float, default=200)
+    parser.add_argument("--latencia-llm-ms", type=float, default=1500)
+    parser.add_argument("--latencia-recurso-ms", type=float, default=150, help="Latencia de imágenes, fuente y analítica.")
+    parser.add_argument("--imagenes", type=int, default=4, help="Imágenes de cada página del portal simulado.")
+    parser.add_argument("--ocr-local", action="store_true", help="Activa la extracción local previa al LLM.")
+    parser.add_argument("--modo-rapido", action="store_true", help="Sin imágenes, fuentes ni analítica y con esperas por condición.")
+    parser.add_argument("--etiqueta", default="", help="Nombre de la medición en el archivo de resultados.")
+    parser.add_argument("--salida", help="Añade el resultado como línea JSON a este archivo.")
+    parser.add_argument("--comparar", help="Etiqueta de una medición anterior de --salida con la que comparar cada etapa.")
+    parser.add_argument("--verbose", action="store_true", help="Muestra el log del robot en la consola.")
+    main(parser.parse_args())
@@ -0,0 +1,131 @@
+"""
+Genera PDFs de factura con la maquetación de e-distribución (capa de texto,
+sin imágenes) y los datos esperados de cada uno, para pruebas locales del
+extractor de texto.
+"""
+import random
+
+
+def generar_facturas(num_facturas: int, semilla: int = 7) -> list[dict]:
+    """Devuelve los datos de facturas simuladas (con importes coherentes entre sí)."""
+    rnd = random.Random(semilla)
+    facturas = []
+    for i in range(num_facturas):
+        mes = rnd.randint(1, 12)
+        conceptos = {
+            "termino_de_potencia_peaje": round(rnd.uniform(5, 400), 2),
+            "termino_de_potencia_cargos": round(rnd.uniform(1, 120), 2),
+            "termino_de_energia_peaje": round(rnd.uniform(5, 900), 2),
+            "termino_de_energia_cargos": round(rnd.uniform(1, 200), 2),
+            "importe_alquiler_equipos": round(rnd.uniform(0.5, 40), 2),
+        }
+        conceptos["importe_impuesto_electrico"] = round(sum(conceptos.values()) * 0.0511, 2)
+        if rnd.random() < 0.3:
+            conceptos["importe_reactiva"] = round(rnd.uniform(1, 60), 2)
+        base = round(sum(conceptos.values()), 2)
+        facturas.append({
+            "cups": f"ES0031{rnd.randint(10**11, 10**12 - 1)}AB0F",
+            "numero_factura": f"FE25{i:08d}",
+            "contrato": f"{rnd.randint(10**9, 10**10 - 1)}",
+            "fecha_inicio_periodo": f"01-{mes:02d}-2025",
+            "fecha_fin_periodo": f"28-{mes:02d}-2025",
+            "fecha_de_vencimiento": f"15-{(mes % 12) + 1:02d}-2025",
+            "fecha_de_cobro_en_banco": f"20-{(mes % 12) + 1:02d}-2025",
+            "direccion_suministro": f"CL MAYOR {rnd.randint(1, 200)}, SEVILLA",
+            "potencia_p1": round(rnd.uniform(3, 50), 3),
+            "potencia_p2": round(rnd.uniform(3, 50), 3),
+            "importe_base_imponible": base,
+            "importe_facturado": round(base * 1.21, 2),
+            **conceptos,
+        })
+    return facturas
+
+
+def _importe(valor: float) -> str:
+    entero, decimales = f"{valor:.2f}".split(".")
+    return f"{int(entero):,}".replace(",", ".") + f",{decimales} €"
+
+def _lineas_factura(f: dict) -> list[str]:
+    ini, fin = f["fecha_inicio_periodo"].replace("-", "/"), f["fecha_fin_periodo"].replace("-", "/")
+    lineas = [
+        "e-distribución Redes Digitales, S.L.U.",
+        f"Factura nº {f['numero_factura']}",
+        f"Periodo de facturación: del {ini} a {fin}",
+        f"Fecha de vencimiento: {f['fecha_de_vencimiento'].replace('-', '/')}",
+        "Datos del Punto de Suministro",
+        f"CUPS: {f['cups']}",
+        f"Nº de contrato: {f['contrato']}",
+        f"Dirección de suministro: {f['direccion_suministro']}",
+        f"Potencia contratada P1: {f['potencia_p1']:.3f} kW P2: {f['potencia_p2']:.3f} kW".replace(".", ","),
+        "Detalle de la factura",
+        f"Término de potencia peaje {_importe(f['termino_de_potencia_peaje'])}",
+        f"Término de potencia cargos {_importe(f['termino_de_potencia_cargos'])}",
+        f"Término de energía peaje {_importe(f['termino_de_energia_peaje'])}",
+        f"Término de energía cargos {_importe(f['termino_de_energia_cargos'])}",
+    ]
+    if "importe_reactiva" in f:
+        lineas.append(f"Energía reactiva {_importe(f['importe_reactiva'])}")
+    lineas += [
+        f"Impuesto eléctrico 5,11% {_importe(f['importe_impuesto_electrico'])}",
+        f"Alquiler de equipos de medida {_importe(f['importe_alquiler_equipos'])}",
+        f"Base imponible {_importe(f['importe_base_imponible'])}",
+        f"IVA 21% {_importe(round(f['importe_facturado'] - f['importe_base_imponible'], 2))}",
+        f"Total factura {_importe(f['importe_facturado'])}",
+        "Datos de pago",
+        f"El importe le será cargado en su cuenta el {f['fecha_de_cobro_en_banco'].replace('-', '/')}",
+    ]
+    return lineas
+
+# Texto de relleno de las páginas de condiciones generales (no contienen datos de la factura)
+_TEXTO_LEGAL = (
+    "Condiciones generales del contrato de acceso a la red. El distribuidor responderá de la continuidad "
+    "del suministro conforme a la normativa vigente. Las reclamaciones podrán presentarse ante el órgano "
+    "competente de la comunidad autónoma. Sus datos personales serán tratados conforme al Reglamento General "
+    "de Protección de Datos, pudiendo ejercer los derechos de acceso, rectificación y supresión."
+)
+
+def _flujo_pagina(lineas: list[str]) -> bytes:
+    contenido = ["BT", "/F1 10 Tf", "50 800 Td", "14 TL"]
+    for linea in lineas:
+        escapada = linea.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        contenido.append(f"({escapada}) Tj T*")
+    contenido.append("ET")
+    return "\n".join(contenido).encode("cp1252")
+
+def pdf_factura(f: dict, paginas_legales: int = 0) -> bytes:
+    """
+    PDF con una página de factura y `paginas_legales` páginas de condiciones
+    generales, con capa de texto (Helvetica, WinAnsi).
+    """
+    paginas = [_lineas_factura(f)]
+    for n in range(paginas_legales):
+        paginas.append([f"Condiciones generales ({n + 1})"] + [_TEXTO_LEGAL[i:i + 95] for i in range(0, len(_TEXTO_LEGAL), 95)] * 6)
+
+    # 1: catálogo, 2: árbol de páginas, 3: fuente, después (página, contenido) por cada página
+    objetos = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    hijos = []
+    for lineas in paginas:
+        numero_pagina = len(objetos) + 1
+        hijos.append(f"{numero_pagina} 0 R")
+        flujo = _flujo_pagina(lineas)
+        objetos.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {numero_pagina + 1} 0 R >>".encode()
+        )
+        objetos.append(b"<< /Length " + str(len(flujo)).encode() + b" >>\nstream\n" + flujo + b"\nendstream")
+    objetos[1] = f"<< /Type /Pages /Kids [{' '.join(hijos)}] /Count {len(hijos)} >>".encode()
+
+    salida = bytearray(b"%PDF-1.4\n")
+    posiciones = []
+    for numero, objeto in enumerate(objetos, start=1):
+        posiciones.append(len(salida))
+        salida += f"{numero} 0 obj\n".encode() + objeto + b"\nendobj\n"
+    inicio_xref = len(salida)
+    salida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    for posicion in posiciones:
+        salida += f"{posicion:010d} 00000 n \n".encode()
+    salida += f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n".encode()
+    return bytes(salida)
@@ -0,0 +1,57 @@
+"""
+Genera HTML que reproduce la tabla de facturas del portal e-distribución
+(lightning-datatable de Salesforce) para pruebas locales.
+"""
+import random
+
+ESTADOS = ["Pagada", "Pendiente", "Compensada"]
+TIPOS = ["Ordinaria", "Complementaria"]
+
+
+def generar_filas(num_filas: int, semilla: int = 42, prefijo_factura: str = "FE25") -> list[dict]:
+    """Devuelve registros de facturas simuladas con los datos de cada fila."""
+    rnd = random.Random(semilla)
+    filas = []
+    for i in range(num_filas):
+        importe = round(rnd.uniform(20, 3000), 2)
+        filas.append({
+            "cups": f"ES0031{rnd.randint(10**13, 10**14 - 1)}AB0F",
+            "numero_factura": f"{prefijo_factura}{i:08d}",
+            "fecha": f"{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/2025",
+            "total": f"{importe:.2f}€ / 0€",
+            "estado": rnd.choice(ESTADOS),
+            "tipo": rnd.choice(TIPOS),
+        })
+    return filas
+
+
+def html_filas(filas: list[dict]) -> str:
+    """Filas <tr> con la misma estructura y data-label que el portal."""
+    return "\n".join(
+        f"""<tr lwc-392cvb27u8q>
+  <th lwc-392cvb27u8q data-label="CUPS" scope="row"><lightning-primitive-cell-factory><span>{f["cups"]}</span></lightning-primitive-cell-factory></th>
+  <td lwc-392cvb27u8q data-label="FACTURA FISCAL"><lightning-primitive-cell-factory><span>{f["numero_factura"]}</span></lightning-primitive-cell-factory></td>
+  <td lwc-392cvb27u8q data-label="FECHA"><lightning-primitive-cell-factory><span>{f["fecha"]}</span></lightning-primitive-cell-factory></td>
+  <td lwc-392cvb27u8q data-label="TOTAL/PDTE"><lightning-primitive-cell-factory><span>{f["total"]}</span></lightning-primitive-cell-factory></td>
+  <td lwc-392cvb27u8q data-label="Estado"><lightning-primitive-cell-factory><span>{f["estado"]}</span></lightning-primitive-cell-factory></td>
+  <td lwc-392cvb27u8q data-label="Tipo"><lightning-primitive-cell-factory><span>{f["tipo"]}</span></lightning-primitive-cell-factory></td>
+  <td lwc-392cvb27u8q data-label="Descargas"><button name="PDF" data-factura="{f["numero_factura"]}">PDF</button></td>
+</tr>"""
+        for f in filas
+    )
+
+
+def html_tabla(filas: list[dict]) -> str:
+    """Página completa con la tabla de facturas."""
+    return f"""<!DOCTYPE html>
+<html lang="es"><head><meta charset="utf-8"><title>Facturas</title></head>
+<body>
+<div class="slds-scrollable_y" style="height: 600px; overflow-y: auto;">
+<table lwc-392cvb27u8q class="slds-table">
+  <thead><tr><th>CUPS</th><th>FACTURA FISCAL</th><th>FECHA</th><th>TOTAL/PDTE</th><th>Estado</th><th>Tipo</th><th>PDF</th></tr></thead>
+  <tbody>
+{html_filas(filas)}
+  </tbody>
+</table>
+</div>
+</body></html>"""
@@ -0,0 +1,263 @@
+"""
+Servidor local que simula la API de OpenAI (Files, Responses y Batches) para
+pruebas de rendimiento sin coste.
+
+Uso:
+    python benchmarks/mock_openai.py            # escucha en 127.0.0.1:8001
+    export OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+    export OPENAI_API_KEY=mock
+
+Variables de entorno:
+    MOCK_LATENCIA_MS   Latencia media de /v1/responses (por defecto 1500)
+    MOCK_JITTER_MS     Variación aleatoria de la latencia (por defecto 300)
+    MOCK_TASA_429      Probabilidad de responder 429 (por defecto 0.0)
+    MOCK_TOKENS_POR_PAGINA   Tokens de entrada por página de un PDF adjunto (por defecto 1100)
+    MOCK_MS_POR_1K_TOKENS    Latencia adicional por cada 1000 tokens de entrada (por defecto 40)
+    MOCK_LOTE_S        Segundos que tarda en completarse un lote (por defecto 3)
+    MOCK_TASA_FALLO_LOTE     Probabilidad de que una petición de un lote falle (por defecto 0.0)
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+LATENCIA_MS = float(os.environ.get("MOCK_LATENCIA_MS", "1500"))
+JITTER_MS = float(os.environ.get("MOCK_JITTER_MS", "300"))
+TASA_429 = float(os.environ.get("MOCK_TASA_429", "0.0"))
+# Un PDF adjunto se factura como texto + imagen de cada página
+TOKENS_POR_PAGINA = int(os.environ.get("MOCK_TOKENS_POR_PAGINA", "1100"))
+MS_POR_1K_TOKENS = float(os.environ.get("MOCK_MS_POR_1K_TOKENS", "40"))
+DURACION_LOTE_S = float(os.environ.get("MOCK_LOTE_S", "3"))
+TASA_FALLO_LOTE = float(os.environ.get("MOCK_TASA_FALLO_LOTE", "0.0"))
+
+app = FastAPI(title="Mock OpenAI API")
+
+# Contadores expuestos en /stats para verificar el comportamiento del cliente
+ESTADISTICAS = {"files": 0, "files_borrados": 0, "responses": 0, "rechazadas_429": 0, "en_vuelo": 0, "max_en_vuelo": 0, "tokens_entrada": 0,
+                "batches": 0, "batch_peticiones": 0}
+# Páginas de cada archivo subido, para calcular los tokens de las peticiones que lo referencian
+PAGINAS_ARCHIVO: dict[str, int] = {}
+# Contenido de los archivos JSONL (entradas y salidas de lotes)
+CONTENIDO_ARCHIVO: dict[str, bytes] = {}
+LOTES: dict[str, dict] = {}
+
+
+def _valor_simulado(nombre: str, definicion: dict):
+    """Genera un valor plausible para un campo del esquema JSON."""
+    tipos = [d.get("type") for d in definicion.get("anyOf", [definicion])]
+    if "number" in tipos:
+        return round(random.uniform(1, 500), 2)
+    if "integer" in tipos:
+        return 30
+    if "boolean" in tipos:
+        return False
+    if "string" in tipos:
+        if "fecha" in nombre:
+            return "01-12-2025" if "inicio" in nombre else "31-12-2025"
+        return None
+    return None
+
+
+async def _latencia(tokens_entrada: int = 0):
+    espera = max(0.0, random.gauss(LATENCIA_MS, JITTER_MS)) + tokens_entrada / 1000 * MS_POR_1K_TOKENS
+    await asyncio.sleep(espera / 1000.0)
+
+
+def _tokens_entrada(peticion: dict) -> int:
+    """Texto a ~4 caracteres por token; cada archivo adjunto, por páginas."""
+    tokens = 0
+    for mensaje in peticion.get("input", []):
+        for parte in mensaje.get("content", []):
+            if parte.get("type") == "input_file":
+                tokens += PAGINAS_ARCHIVO.get(parte.get("file_id"), 1) * TOKENS_POR_PAGINA
+            else:
+                tokens += len(parte.get("text", "")) // 4
+    return max(1, tokens)
+
+
+def _partes_multipart(cuerpo: bytes, content_type: str) -> dict[str, bytes]:
+    """Parseo mínimo de multipart/form-data (sin dependencias extra): nombre del campo -> contenido."""
+    limite = content_type.split("boundary=", 1)[-1].strip('"').encode()
+    partes = {}
+    for parte in cuerpo.split(b"--" + limite):
+        cabeceras, _, contenido = parte.partition(b"\r\n\r\n")
+        nombre = re.search(rb'name="([^"]+)"', cabeceras)
+        if nombre:
+            partes[nombre.group(1).decode()] = contenido[:-2] if contenido.endswith(b"\r\n") else contenido
+    return partes
+
+
+def _objeto_archivo(file_id: str, num_bytes: int, nombre: str, proposito: str) -> dict:
+    return {
+        "id": file_id,
+        "object": "file",
+        "bytes": num_bytes,
+        "created_at": int(time.time()),
+        "filename": nombre,
+        "purpose": proposito,
+        "status": "processed",
+    }
+
+
+@app.post("/v1/files")
+async def crear_archivo(request: Request):
+    cuerpo = await request.body()
+    ESTADISTICAS["files"] += 1
+    file_id = f"file-{uuid.uuid4().hex[:24]}"
+    partes = _partes_multipart(cuerpo, request.headers.get("content-type", ""))
+    proposito = partes.get("purpose", b"assistants").decode()
+    if proposito == "batch":
+        # La entrada de un lote se guarda para procesarla al crear el lote
+        CONTENIDO_ARCHIVO[file_id] = partes.get("file", b"")
+        return _objeto_archivo(file_id, len(CONTENIDO_ARCHIVO[file_id]), "lote.jsonl", proposito)
+    PAGINAS_ARCHIVO[file_id] = max(1, len(re.findall(rb"/Type\s*/Page\b", cuerpo)))
+    return _objeto_archivo(file_id, len(cuerpo), "factura.pdf", proposito)
+
+
+@app.get("/v1/files/{file_id}/content")
+async def contenido_archivo(file_id: str):
+    if file_id not in CONTENIDO_ARCHIVO:
+        return JSONResponse(status_code=404, content={"error": {"message": f"No such file: {file_id}", "type": "invalid_request_error"}})
+    return Response(content=CONTENIDO_ARCHIVO[file_id], media_type="application/octet-stream")
+
+
+@app.delete("/v1/files/{file_id}")
+async def borrar_archivo(file_id: str):
+    ESTADISTICAS["files_borrados"] += 1
+    PAGINAS_ARCHIVO.pop(file_id, None)
+    CONTENIDO_ARCHIVO.pop(file_id, None)
+    return {"id": file_id, "object": "file", "deleted": True}
+
+
+@app.post("/v1/responses")
+async def crear_respuesta(request: Request):
+    if TASA_429 and random.random() < TASA_429:
+        ESTADISTICAS["rechazadas_429"] += 1
+        return JSONResponse(
+            status_code=429,
+            headers={"retry-after": "1"},
+            content={"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+        )
+
+    peticion = await request.json()
+    tokens_entrada = _tokens_entrada(peticion)
+    ESTADISTICAS["responses"] += 1
+    ESTADISTICAS["tokens_entrada"] += tokens_entrada
+    ESTADISTICAS["en_vuelo"] += 1
+    ESTADISTICAS["max_en_vuelo"] = max(ESTADISTICAS["max_en_vuelo"], ESTADISTICAS["en_vuelo"])
+    try:
+        await _latencia(tokens_entrada)
+    finally:
+        ESTADISTICAS["en_vuelo"] -= 1
+
+    return _respuesta_simulada(peticion, tokens_entrada)
+
+
+def _respuesta_simulada(peticion: dict, tokens_entrada: int) -> dict:
+    esquema = peticion.get("text", {}).get("format", {}).get("schema", {})
+    datos = {nombre: _valor_simulado(nombre, definicion) for nombre, definicion in esquema.get("properties", {}).items()}
+    texto = json.dumps(datos)
+    tokens_salida = max(1, len(texto) // 4)
+
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": peticion.get("model", "gpt-4o"),
+        "status": "completed",
+        "output": [{
+            "type": "message",
+            "id": f"msg_{uuid.uuid4().hex}",
+            "status": "completed",
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": texto, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": tokens_entrada,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": tokens_salida,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": tokens_entrada + tokens_salida,
+        },
+    }
+
+
+def _objeto_lote(lote: dict) -> dict:
+    return {"object": "batch", "endpoint": "/v1/responses", "errors": None, **lote}
+
+
+async def _procesar_lote(id_lote: str):
+    """Resuelve todas las peticiones del lote tras DURACION_LOTE_S y publica la salida y los errores."""
+    lote = LOTES[id_lote]
+    lineas = [json.loads(l) for l in CONTENIDO_ARCHIVO.get(lote["input_file_id"], b"").decode().splitlines() if l.strip()]
+    lote.update(status="in_progress", in_progress_at=int(time.time()))
+    lote["request_counts"]["total"] = len(lineas)
+    await asyncio.sleep(DURACION_LOTE_S)
+
+    salida, errores = [], []
+    for linea in lineas:
+        ESTADISTICAS["batch_peticiones"] += 1
+        if TASA_FALLO_LOTE and random.random() < TASA_FALLO_LOTE:
+            errores.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": linea["custom_id"], "response": None,
+                            "error": {"code": "server_error", "message": "Fallo simulado en el lote (mock)"}})
+            continue
+        tokens_entrada = _tokens_entrada(linea["body"])
+        ESTADISTICAS["tokens_entrada"] += tokens_entrada
+        salida.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": linea["custom_id"], "error": None, "response": {
+            "status_code": 200, "request_id": uuid.uuid4().hex, "body": _respuesta_simulada(linea["body"], tokens_entrada),
+        }})
+
+    for clave, resultados in (("output_file_id", salida), ("error_file_id", errores)):
+        if resultados:
+            file_id = f"file-{uuid.uuid4().hex[:24]}"
+            CONTENIDO_ARCHIVO[file_id] = "".join(json.dumps(r) + "\n" for r in resultados).encode()
+            lote[clave] = file_id
+    lote["request_counts"].update(completed=len(salida), failed=len(errores))
+    lote.update(status="completed", completed_at=int(time.time()))
+
+
+@app.post("/v1/batches")
+async def crear_lote(request: Request):
+    peticion = await request.json()
+    ESTADISTICAS["batches"] += 1
+    id_lote = f"batch_{uuid.uuid4().hex}"
+    ahora = int(time.time())
+    LOTES[id_lote] = {
+        "id": id_lote,
+        "input_file_id": peticion["input_file_id"],
+        "completion_window": peticion.get("completion_window", "24h"),
+        "status": "validating",
+        "output_file_id": None,
+        "error_file_id": None,
+        "created_at": ahora,
+        "expires_at": ahora + 24 * 3600,
+        "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        "metadata": peticion.get("metadata"),
+    }
+    asyncio.create_task(_procesar_lote(id_lote))
+    return _objeto_lote(LOTES[id_lote])
+
+
+@app.get("/v1/batches/{id_lote}")
+async def obtener_lote(id_lote: str):
+    if id_lote not in LOTES:
+        return JSONResponse(status_code=404, content={"error": {"message": f"No such batch: {id_lote}", "type": "invalid_request_error"}})
+    return _objeto_lote(LOTES[id_lote])
+
+
+@app.get("/stats")
+async def estadisticas():
+    return ESTADISTICAS
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.environ.get("MOCK_PUERTO", "8001")), log_level="warning")
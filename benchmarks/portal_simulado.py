@@ -0,0 +1,287 @@
+"""
+Servidor local que simula el portal de e-distribución para medir el robot
+completo sin acceder al portal real: formulario de login, menú "Cambio de
+rol", filtro por rango de fechas, tabla lightning-datatable con "Cargar más"
+y descarga de PDF desde `button[name="PDF"]`.
+
+Uso:
+    python benchmarks/portal_simulado.py        # escucha en 127.0.0.1:8002
+    export EDISTRIBUCION_URL_LOGIN=http://127.0.0.1:8002/login
+    export EDISTRIBUCION_URL_FACTURAS=http://127.0.0.1:8002/facturas
+
+Variables de entorno:
+    PORTAL_ROLES             Número de roles (empresas) del usuario (por defecto 3)
+    PORTAL_FILAS_POR_ROL     Facturas de cada rol, repartidas a lo largo de 2025 (por defecto 40)
+    PORTAL_FILAS_BLOQUE      Filas que muestra la tabla antes de "Cargar más" (por defecto 50)
+    PORTAL_LATENCIA_PAGINA_MS  Latencia de cada navegación: login, facturas, cambio de rol (por defecto 300)
+    PORTAL_LATENCIA_TABLA_MS   Latencia de la consulta de la tabla al aplicar el filtro (por defecto 800)
+    PORTAL_LATENCIA_PDF_MS     Latencia de cada descarga de PDF (por defecto 200)
+    PORTAL_PAGINAS_LEGALES     Páginas de condiciones generales de cada PDF (por defecto 3)
+    PORTAL_IMAGENES            Imágenes de cada página, además de una fuente web y un script de analítica (por defecto 4)
+    PORTAL_LATENCIA_RECURSO_MS Latencia de cada imagen, fuente, script o baliza de analítica (por defecto 150)
+"""
+import os
+import sys
+import html
+import uuid
+import random
+import asyncio
+from datetime import datetime
+from urllib.parse import parse_qs, quote
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fixture_tabla import html_filas, ESTADOS, TIPOS
+from fixture_factura_pdf import generar_facturas, pdf_factura
+
+NUM_ROLES = int(os.environ.get("PORTAL_ROLES", "3"))
+FILAS_POR_ROL = int(os.environ.get("PORTAL_FILAS_POR_ROL", "40"))
+FILAS_BLOQUE = int(os.environ.get("PORTAL_FILAS_BLOQUE", "50"))
+LATENCIA_PAGINA_MS = float(os.environ.get("PORTAL_LATENCIA_PAGINA_MS", "300"))
+LATENCIA_TABLA_MS = float(os.environ.get("PORTAL_LATENCIA_TABLA_MS", "800"))
+LATENCIA_PDF_MS = float(os.environ.get("PORTAL_LATENCIA_PDF_MS", "200"))
+PAGINAS_LEGALES = int(os.environ.get("PORTAL_PAGINAS_LEGALES", "3"))
+NUM_IMAGENES = int(os.environ.get("PORTAL_IMAGENES", "4"))
+LATENCIA_RECURSO_MS = float(os.environ.get("PORTAL_LATENCIA_RECURSO_MS", "150"))
+
+app = FastAPI(title="Portal e-distribución simulado")
+
+# Contadores expuestos en /stats para comprobar lo que ha pedido el robot
+ESTADISTICAS = {"logins": 0, "paginas": 0, "cambios_rol": 0, "consultas_tabla": 0, "bloques_tabla": 0, "pdfs": 0, "sin_sesion": 0, "recursos": 0}
+SESIONES: set[str] = set()
+
+
+def _generar_roles(num_roles: int, filas_por_rol: int) -> dict[str, list[dict]]:
+    """Facturas de cada rol: datos del PDF más las columnas que muestra la tabla."""
+    roles = {}
+    for r in range(num_roles):
+        rnd = random.Random(1000 + r)
+        facturas = []
+        for i, datos in enumerate(generar_facturas(filas_por_rol, semilla=r + 1)):
+            datos["numero_factura"] = f"FE25{r:02d}{i:06d}"
+            _, mes, anio = datos["fecha_fin_periodo"].split("-")
+            datos.update({
+                "fecha": f"{rnd.randint(1, 28):02d}/{mes}/{anio}",
+                "total": f"{datos['importe_facturado']:.2f}€ / 0€",
+                "estado": rnd.choice(ESTADOS),
+                "tipo": rnd.choice(TIPOS),
+            })
+            facturas.append(datos)
+        roles[f"EMPRESA SIMULADA {r + 1:02d} S.L."] = facturas
+    return roles
+
+ROLES = _generar_roles(NUM_ROLES, FILAS_POR_ROL)
+FACTURAS = {f["numero_factura"]: f for facturas in ROLES.values() for f in facturas}
+PDFS: dict[str, bytes] = {}
+
+
+async def _latencia(ms: float):
+    if ms > 0:
+        await asyncio.sleep(random.uniform(0.8, 1.2) * ms / 1000)
+
+def _autenticado(request: Request) -> bool:
+    return request.cookies.get("sid") in SESIONES
+
+def _rol_actual(request: Request) -> str:
+    rol = request.cookies.get("rol")
+    return rol if rol in ROLES else next(iter(ROLES))
+
+def _fecha(texto: str):
+    try:
+        return datetime.strptime(texto.strip(), "%d/%m/%Y").date()
+    except ValueError:
+        return None
+
+
+# Recursos que el robot no necesita (como los del portal real): imágenes, fuente web y analítica
+RECURSOS_PAGINA = (
+    '<style>@font-face { font-family: "Portal"; src: url("/static/portal.woff2"); } body { font-family: "Portal", sans-serif; }</style>\n'
+    '<script async src="/analytics/collect.js"></script>\n'
+    + "".join(f'<img src="/static/imagen-{i}.png" alt="">' for i in range(NUM_IMAGENES))
+)
+
+PAGINA_LOGIN = """<!DOCTYPE html>
+<html lang="es"><head><meta charset="utf-8"><title>Acceso</title></head>
+<body>
+{recursos}
+<form method="post" action="/login">
+  <input name="username" type="text">
+  <input name="password" type="password">
+  <button type="submit">ENTRAR</button>
+</form>
+</body></html>"""
+
+PAGINA_FACTURAS = """<!DOCTYPE html>
+<html lang="es"><head><meta charset="utf-8"><title>Facturas</title></head>
+<body>
+{recursos}
+<button title="Cambio de rol" onclick="const m = document.getElementById('menu-roles'); m.hidden = !m.hidden;">Cambio de rol</button>
+<div id="menu-roles" hidden>
+{menu}
+</div>
+<div class="filtros">
+  <span class="slds-form-element__label" onclick="document.getElementById('rango').hidden = false;">Rango de fechas</span>
+  <div id="rango" hidden>
+    <div class="filter-date-from"><input type="text"></div>
+    <div class="filter-date-to"><input type="text"></div>
+    <button onclick="aplicar()">Aplicar</button>
+  </div>
+</div>
+<div id="resultado"></div>
+<script>
+let consulta = null;
+async function pedirBloque(desdeFila) {{
+  const params = new URLSearchParams({{...consulta, fila: desdeFila}});
+  const respuesta = await fetch('/api/facturas?' + params);
+  return await respuesta.json();
+}}
+async function aplicar() {{
+  consulta = {{
+    desde: document.querySelector('.filter-date-from input').value,
+    hasta: document.querySelector('.filter-date-to input').value,
+  }};
+  const resultado = document.getElementById('resultado');
+  resultado.innerHTML = '<lightning-spinner class="slds-spinner">Cargando</lightning-spinner>';
+  const bloque = await pedirBloque(0);
+  if (bloque.total === 0) {{
+    resultado.innerHTML = '<div>No se encuentran resultados</div>';
+    return;
+  }}
+  resultado.innerHTML = '<div class="slds-scrollable_y" style="height: 600px; overflow-y: auto;">'
+    + '<table lwc-392cvb27u8q class="slds-table"><tbody id="filas">' + bloque.filas + '</tbody></table></div>';
+  mostrarCargarMas(bloque.siguiente);
+}}
+function mostrarCargarMas(siguiente) {{
+  document.getElementById('cargar-mas')?.remove();
+  if (siguiente === null) return;
+  const boton = document.createElement('button');
+  boton.id = 'cargar-mas';
+  boton.textContent = 'Cargar más';
+  boton.onclick = async () => {{
+    boton.disabled = true;
+    const bloque = await pedirBloque(siguiente);
+    document.getElementById('filas').insertAdjacentHTML('beforeend', bloque.filas);
+    mostrarCargarMas(bloque.siguiente);
+  }};
+  document.getElementById('resultado').appendChild(boton);
+}}
+document.addEventListener('click', evento => {{
+  const boton = evento.target.closest('button[name="PDF"]');
+  if (boton) location.href = '/documentos/' + encodeURIComponent(boton.dataset.factura) + '.pdf';
+}});
+</script>
+</body></html>"""
+
+
+@app.get("/login", response_class=HTMLResponse)
+async def pagina_login():
+    await _latencia(LATENCIA_PAGINA_MS)
+    return PAGINA_LOGIN.format(recursos=RECURSOS_PAGINA)
+
+@app.post("/login")
+async def enviar_login(request: Request):
+    # El formulario llega como application/x-www-form-urlencoded (sin depender de python-multipart)
+    campos = parse_qs((await request.body()).decode())
+    await _latencia(LATENCIA_PAGINA_MS)
+    if not campos.get("username") or not campos.get("password"):
+        return RedirectResponse("/login", status_code=303)
+    ESTADISTICAS["logins"] += 1
+    sid = uuid.uuid4().hex
+    SESIONES.add(sid)
+    respuesta = RedirectResponse("/facturas", status_code=303)
+    respuesta.set_cookie("sid", sid)
+    return respuesta
+
+@app.get("/facturas", response_class=HTMLResponse)
+async def pagina_facturas(request: Request):
+    await _latencia(LATENCIA_PAGINA_MS)
+    if not _autenticado(request):
+        ESTADISTICAS["sin_sesion"] += 1
+        return RedirectResponse("/login", status_code=303)
+    ESTADISTICAS["paginas"] += 1
+    actual = _rol_actual(request)
+    seleccionado = ' class="wp-roleSelected"'
+    menu = "\n".join(
+        f'<a role="menuitem" title="{html.escape(rol)}" href="/rol?nombre={quote(rol)}"'
+        f'{seleccionado if rol == actual else ""}>{html.escape(rol)}</a>'
+        for rol in ROLES
+    )
+    return PAGINA_FACTURAS.format(menu=menu, recursos=RECURSOS_PAGINA)
+
+@app.get("/rol")
+async def cambiar_rol(request: Request, nombre: str):
+    await _latencia(LATENCIA_PAGINA_MS)
+    if not _autenticado(request):
+        return RedirectResponse("/login", status_code=303)
+    ESTADISTICAS["cambios_rol"] += 1
+    respuesta = RedirectResponse("/facturas", status_code=303)
+    respuesta.set_cookie("rol", nombre)
+    return respuesta
+
+@app.get("/api/facturas")
+async def consultar_facturas(request: Request, desde: str, hasta: str, fila: int = 0):
+    if not _autenticado(request):
+        return JSONResponse({"error": "sesión caducada"}, status_code=401)
+    await _latencia(LATENCIA_TABLA_MS)
+    ESTADISTICAS["consultas_tabla" if fila == 0 else "bloques_tabla"] += 1
+    f_desde, f_hasta = _fecha(desde), _fecha(hasta)
+    filas = [
+        f for f in ROLES[_rol_actual(request)]
+        if f_desde and f_hasta and f_desde <= _fecha(f["fecha"]) <= f_hasta
+    ]
+    bloque = filas[fila:fila + FILAS_BLOQUE]
+    siguiente = fila + FILAS_BLOQUE if fila + FILAS_BLOQUE < len(filas) else None
+    return {"total": len(filas), "filas": html_filas(bloque), "siguiente": siguiente}
+
+@app.get("/documentos/{numero_factura}.pdf")
+async def descargar_pdf(request: Request, numero_factura: str):
+    if not _autenticado(request):
+        return RedirectResponse("/login", status_code=303)
+    factura = FACTURAS.get(numero_factura)
+    if factura is None:
+        return Response(status_code=404)
+    await _latencia(LATENCIA_PDF_MS)
+    ESTADISTICAS["pdfs"] += 1
+    if numero_factura not in PDFS:
+        PDFS[numero_factura] = pdf_factura(factura, PAGINAS_LEGALES)
+    return Response(
+        PDFS[numero_factura], media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{numero_factura}.pdf"'},
+    )
+
+# PNG de 1x1 píxel
+PNG_VACIO = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000b49444154789c6360000200000500017a5eab3f0000000049454e44ae426082"
+)
+
+@app.get("/static/{nombre}")
+async def recurso_estatico(nombre: str):
+    await _latencia(LATENCIA_RECURSO_MS)
+    ESTADISTICAS["recursos"] += 1
+    if nombre.endswith(".png"):
+        return Response(PNG_VACIO, media_type="image/png")
+    return Response(b"", media_type="font/woff2")
+
+@app.get("/analytics/collect.js")
+async def script_analitica():
+    await _latencia(LATENCIA_RECURSO_MS)
+    ESTADISTICAS["recursos"] += 1
+    # Como la analítica real, envía una baliza al cargar (y retrasa el "networkidle")
+    return Response("fetch('/analytics/beacon', {method: 'POST'});", media_type="application/javascript")
+
+@app.post("/analytics/beacon")
+async def baliza_analitica():
+    await _latencia(LATENCIA_RECURSO_MS)
+    ESTADISTICAS["recursos"] += 1
+    return Response(status_code=204)
+
+@app.get("/stats")
+async def estadisticas():
+    return {**ESTADISTICAS, "roles": len(ROLES), "facturas": len(FACTURAS)}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.environ.get("PORTAL_PUERTO", "8002")), log_level="warning")
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from logs import escribir_log
+
+# --- CONFIGURACIÓN DE LA CACHÉ DE EXTRACCIONES ---
+CACHE_DIR = "cache"
+RUTA_CACHE_OCR = os.path.join(CACHE_DIR, "extracciones_ocr.sqlite3")
+# Tamaño máximo de la caché (se expulsan las entradas menos usadas recientemente)
+MAX_BYTES_CACHE_OCR = int(float(os.environ.get("EDISTRIBUCION_CACHE_OCR_MAX_MB", "256")) * 1024 * 1024)
+
+
+def hash_archivo(ruta: str) -> str:
+    """SHA-256 del contenido de un archivo, leído por bloques."""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def hash_texto(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+class CacheExtracciones:
+    """
+    Caché persistente (SQLite) de resultados de extracción direccionada por
+    contenido. La clave combina el hash del PDF con la huella de la extracción
+    (prompt + esquema + modo de envío), de modo que cambiar cualquiera invalida las entradas.
+    """
+    def __init__(self, ruta: str = RUTA_CACHE_OCR, max_bytes: int = MAX_BYTES_CACHE_OCR):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.escrituras = 0
+        self.expulsiones = 0
+
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS extracciones (
+                    clave TEXT PRIMARY KEY,
+                    datos_json TEXT NOT NULL,
+                    tamano INTEGER NOT NULL,
+                    creado REAL NOT NULL,
+                    ultimo_acceso REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_extracciones_acceso ON extracciones (ultimo_acceso)")
+
+    @contextmanager
+    def _conectar(self):
+        # Una conexión por operación: la caché se usa desde el event loop y desde hilos
+        conn = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def calcular_clave(ruta_pdf: str, huella_extraccion: str) -> str:
+        return f"{hash_archivo(ruta_pdf)}:{huella_extraccion}"
+
+    def obtener(self, clave: str) -> dict | None:
+        """Devuelve los datos cacheados o None si no existen."""
+        with self._lock, self._conectar() as conn:
+            fila = conn.execute("SELECT datos_json FROM extracciones WHERE clave = ?", (clave,)).fetchone()
+            if fila is None:
+                self.fallos += 1
+                return None
+            conn.execute("UPDATE extracciones SET ultimo_acceso = ? WHERE clave = ?", (time.time(), clave))
+        self.aciertos += 1
+        return json.loads(fila[0])
+
+    def guardar(self, clave: str, datos: dict):
+        """Guarda (o reemplaza) una extracción y aplica la expulsión por tamaño."""
+        datos_json = json.dumps(datos, ensure_ascii=False)
+        ahora = time.time()
+        with self._lock, self._conectar() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO extracciones (clave, datos_json, tamano, creado, ultimo_acceso) VALUES (?, ?, ?, ?, ?)",
+                (clave, datos_json, len(datos_json.encode("utf-8")), ahora, ahora),
+            )
+            self.escrituras += 1
+            self._expulsar(conn)
+
+    def _expulsar(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(tamano), 0) FROM extracciones").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Expulsión LRU: borramos las entradas con acceso más antiguo hasta bajar del límite
+        for clave, tamano in conn.execute("SELECT clave, tamano FROM extracciones ORDER BY ultimo_acceso ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM extracciones WHERE clave = ?", (clave,))
+            total -= tamano
+            self.expulsiones += 1
+
+    def estadisticas(self) -> dict:
+        with self._lock, self._conectar() as conn:
+            entradas, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM extracciones").fetchone()
+        consultas = self.aciertos + self.fallos
+        return {
+            "entradas": entradas,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else 0.0,
+            "escrituras": self.escrituras,
+            "expulsiones": self.expulsiones,
+        }
+
+
+# Instancia compartida por todo el proceso
+_cache: CacheExtracciones | None = None
+
+def obtener_cache() -> CacheExtracciones:
+    """Devuelve la caché compartida, creándola en el primer uso."""
+    global _cache
+    if _cache is None:
+        _cache = CacheExtracciones()
+        escribir_log(f"[CACHE OCR] Caché de extracciones en: {_cache.ruta}")
+    return _cache
@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+from datetime import date
+from typing import Awaitable, Callable
+from logs import escribir_log
+from modelos_datos import FacturaEndesaDistribucion
+from ventanas_fechas import a_fecha, rangos_cubren
+
+# --- CONFIGURACIÓN DE LA CACHÉ DE RESULTADOS ---
+# Segundos durante los que el resultado de un rango de fechas se sirve sin volver al portal
+TTL_CACHE_RESULTADOS_S = float(os.environ.get("EDISTRIBUCION_CACHE_RESULTADOS_TTL_S", "600"))
+# Rangos que se conservan como máximo (se expulsan los más antiguos)
+MAX_RANGOS_CACHE = int(os.environ.get("EDISTRIBUCION_CACHE_RESULTADOS_MAX", "64"))
+
+
+class _RangoCacheado:
+    def __init__(self, cuenta: str | None, desde: date, hasta: date, facturas: list[FacturaEndesaDistribucion], ttl_s: float):
+        self.cuenta = cuenta
+        self.desde = desde
+        self.hasta = hasta
+        self.facturas = facturas
+        self.expira = time.monotonic() + ttl_s
+
+    def vigente(self) -> bool:
+        return time.monotonic() < self.expira
+
+    def facturas_en(self, desde: date, hasta: date) -> list[FacturaEndesaDistribucion] | None:
+        """
+        Facturas del rango cacheado que caen en [desde, hasta] por fecha de emisión.
+        Devuelve None si el rango se sale de la petición y alguna factura no tiene
+        fecha legible (no se puede decidir si pertenece o no).
+        """
+        if desde <= self.desde and self.hasta <= hasta:
+            return self.facturas
+        seleccion = []
+        for factura in self.facturas:
+            emision = a_fecha(factura.fecha_emision)
+            if emision is None:
+                return None
+            if desde <= emision <= hasta:
+                seleccion.append(factura)
+        return seleccion
+
+
+class CacheResultados:
+    """
+    Agrupa peticiones idénticas en curso y cachea con TTL el resultado de
+    cada rango de fechas de cada cuenta. Una petición cuyo rango queda
+    cubierto por rangos cacheados de la misma cuenta se responde
+    fusionándolos, sin abrir el navegador.
+    """
+    def __init__(self, ttl_s: float = TTL_CACHE_RESULTADOS_S, max_rangos: int = MAX_RANGOS_CACHE):
+        self.ttl_s = ttl_s
+        self.max_rangos = max_rangos
+        self.rangos: list[_RangoCacheado] = []
+        self.en_curso: dict[tuple[str | None, date, date], asyncio.Task] = {}
+        self.aciertos = 0
+        self.fusiones = 0
+        self.agrupadas = 0
+        self.ejecuciones = 0
+
+    async def obtener(self, fecha_desde: str, fecha_hasta: str,
+                      ejecutar: Callable[[], Awaitable[list[FacturaEndesaDistribucion]]],
+                      cuenta: str | None = None) -> list[FacturaEndesaDistribucion]:
+        """
+        Devuelve las facturas del rango desde la caché, uniéndose a una ejecución
+        idéntica en curso, o lanzando `ejecutar()` si no queda otra opción.
+        """
+        desde, hasta = a_fecha(fecha_desde), a_fecha(fecha_hasta)
+        if desde is None or hasta is None or desde > hasta:
+            return await ejecutar()
+
+        cacheadas = self._desde_cache(cuenta, desde, hasta)
+        if cacheadas is not None:
+            return cacheadas
+
+        clave = (cuenta, desde, hasta)
+        tarea = self.en_curso.get(clave)
+        if tarea is not None:
+            self.agrupadas += 1
+            escribir_log(f"[CACHE RESULTADOS] Petición {fecha_desde}-{fecha_hasta} unida a la ejecución en curso.")
+        else:
+            self.ejecuciones += 1
+            tarea = asyncio.create_task(self._ejecutar_y_guardar(clave, ejecutar))
+            self.en_curso[clave] = tarea
+        # shield: si un cliente abandona, la ejecución sigue para los demás
+        facturas = await asyncio.shield(tarea)
+        return [f.model_copy() for f in facturas]
+
+    def invalidar(self):
+        self.rangos = []
+
+    def estadisticas(self) -> dict:
+        self._purgar()
+        return {
+            "rangos_cacheados": len(self.rangos),
+            "ejecuciones_en_curso": len(self.en_curso),
+            "ttl_s": self.ttl_s,
+            "aciertos": self.aciertos,
+            "fusiones": self.fusiones,
+            "agrupadas": self.agrupadas,
+            "ejecuciones": self.ejecuciones,
+        }
+
+    async def _ejecutar_y_guardar(self, clave: tuple[str | None, date, date], ejecutar) -> list[FacturaEndesaDistribucion]:
+        try:
+            facturas = await ejecutar()
+            self._purgar()
+            self.rangos.append(_RangoCacheado(*clave, facturas, self.ttl_s))
+            del self.rangos[:max(0, len(self.rangos) - self.max_rangos)]
+            return facturas
+        finally:
+            self.en_curso.pop(clave, None)
+
+    def _purgar(self):
+        self.rangos = [r for r in self.rangos if r.vigente()]
+
+    def _desde_cache(self, cuenta: str | None, desde: date, hasta: date) -> list[FacturaEndesaDistribucion] | None:
+        self._purgar()
+        utiles: list[tuple[_RangoCacheado, list[FacturaEndesaDistribucion]]] = []
+        for rango in self.rangos:
+            if rango.cuenta != cuenta or rango.hasta < desde or rango.desde > hasta:
+                continue
+            facturas = rango.facturas_en(desde, hasta)
+            if facturas is not None:
+                utiles.append((rango, facturas))
+
+        # ¿Cubren los rangos útiles todos los días pedidos?
+        if not rangos_cubren([(r.desde, r.hasta) for r, _ in utiles], desde, hasta):
+            return None
+
+        # Fusión sin duplicados (un mismo rango puede solaparse con otro)
+        fusionadas: dict[tuple[str, str], FacturaEndesaDistribucion] = {}
+        for _, facturas in utiles:
+            for factura in facturas:
+                fusionadas.setdefault((factura.cups, factura.numero_factura), factura)
+
+        if len(utiles) == 1:
+            self.aciertos += 1
+        else:
+            self.fusiones += 1
+        escribir_log(f"[CACHE RESULTADOS] Rango {desde:%d/%m/%Y}-{hasta:%d/%m/%Y} servido desde {len(utiles)} rango(s) en caché.")
+        return [f.model_copy() for f in fusionadas.values()]
+
+
+_cache_resultados: CacheResultados | None = None
+
+def obtener_cache_resultados() -> CacheResultados:
+    """Devuelve la caché de resultados compartida, creándola en el primer uso."""
+    global _cache_resultados
+    if _cache_resultados is None:
+        _cache_resultados = CacheResultados()
+    return _cache_resultados
@@ -0,0 +1,95 @@
+import os
+import json
+
+# --- CONFIGURACIÓN DE CUENTAS DEL PORTAL ---
+# Cuenta por defecto (la única antes del registro): credenciales del entorno
+CUENTA_POR_DEFECTO = os.environ.get("EDISTRIBUCION_CUENTA_POR_DEFECTO", "principal")
+USER = os.environ.get("DISTRIBUCION_USER", "27298340P")
+PASSWORD = os.environ.get("DISTRIBUCION_PASSWORD", "z5!tWZWzTDQ6rx9")
+# Resto de cuentas del grupo: lista JSON con nombre, usuario y password (o password_env)
+RUTA_CUENTAS = os.environ.get("EDISTRIBUCION_CUENTAS", os.path.join("datos", "cuentas.json"))
+# Sesiones simultáneas por cuenta si el registro no indica otra cosa (más sesiones = más riesgo de bloqueo)
+MAX_SESIONES_CUENTA = int(os.environ.get("EDISTRIBUCION_SESIONES_CUENTA", "1"))
+
+
+class Cuenta:
+    """
+    Cuenta del portal con sus credenciales y sus límites de concurrencia:
+    `max_sesiones` (sesiones y ejecuciones a la vez; None = el tope por defecto
+    del pool) y `max_workers` (contextos por ejecución; None = sin tope propio).
+    """
+    def __init__(self, nombre: str, usuario: str, password: str, max_sesiones: int | None = None,
+                 max_workers: int | None = None, activa: bool = True):
+        self.nombre = nombre
+        self.usuario = usuario
+        self.password = password
+        self.max_sesiones = max_sesiones
+        self.max_workers = max_workers
+        self.activa = activa
+
+    def a_dict(self) -> dict:
+        """Datos públicos de la cuenta (sin la contraseña)."""
+        return {
+            "nombre": self.nombre,
+            "usuario": self.usuario,
+            "max_sesiones": self.max_sesiones,
+            "max_workers": self.max_workers,
+            "activa": self.activa,
+        }
+
+
+def _cuenta_desde_json(datos: dict) -> Cuenta:
+    nombre = str(datos.get("nombre") or "").strip()
+    if not nombre or not datos.get("usuario"):
+        raise ValueError(f"Cuenta sin nombre o sin usuario en {RUTA_CUENTAS}: {datos.get('nombre')!r}")
+    # La contraseña puede venir de una variable de entorno para no guardarla en el archivo
+    password = datos.get("password")
+    if password is None and datos.get("password_env"):
+        password = os.environ.get(datos["password_env"])
+    if not password:
+        raise ValueError(f"Cuenta {nombre} sin contraseña (password o password_env) en {RUTA_CUENTAS}.")
+    return Cuenta(
+        nombre, str(datos["usuario"]), password,
+        max_sesiones=max(1, int(datos.get("max_sesiones") or MAX_SESIONES_CUENTA)),
+        max_workers=max(1, int(datos["max_workers"])) if datos.get("max_workers") else None,
+        activa=bool(datos.get("activa", True)),
+    )
+
+
+class RegistroCuentas:
+    """
+    Cuentas del portal que gestiona el servicio: la cuenta por defecto (credenciales
+    del entorno) más las del archivo RUTA_CUENTAS, que puede redefinirla.
+    """
+    def __init__(self, ruta: str = RUTA_CUENTAS):
+        self.ruta = ruta
+        self.cuentas: dict[str, Cuenta] = {CUENTA_POR_DEFECTO: Cuenta(CUENTA_POR_DEFECTO, USER, PASSWORD)}
+        if os.path.exists(ruta):
+            with open(ruta, "r", encoding="utf-8") as f:
+                for datos in json.load(f):
+                    cuenta = _cuenta_desde_json(datos)
+                    self.cuentas[cuenta.nombre] = cuenta
+
+    def obtener(self, nombre: str | None = None) -> Cuenta:
+        """Cuenta por nombre (la cuenta por defecto si no se indica)."""
+        cuenta = self.cuentas.get(nombre or CUENTA_POR_DEFECTO)
+        if cuenta is None:
+            raise ValueError(f"Cuenta {nombre} no registrada.")
+        return cuenta
+
+    def activas(self) -> list[Cuenta]:
+        return [c for c in self.cuentas.values() if c.activa]
+
+    def listar(self) -> list[dict]:
+        return [c.a_dict() for c in self.cuentas.values()]
+
+
+# Instancia compartida por todo el proceso
+_registro: RegistroCuentas | None = None
+
+def obtener_registro_cuentas() -> RegistroCuentas:
+    """Devuelve el registro de cuentas compartido, cargándolo en el primer uso."""
+    global _registro
+    if _registro is None:
+        _registro = RegistroCuentas()
+    return _registro
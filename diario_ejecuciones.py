@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from modelos_datos import FacturaEndesaDistribucion
+
+# --- CONFIGURACIÓN DEL DIARIO DE EJECUCIONES ---
+RUTA_DIARIO = os.path.join("datos", "diario_ejecuciones.sqlite3")
+
+# Etapas por las que pasa cada rol y cada factura de una ejecución, en orden
+ETAPA_LISTADA = "LISTADA"        # Rol detectado / fila leída de la tabla
+ETAPA_DESCARGADA = "DESCARGADA"  # Todas las ventanas del rol leídas / PDF en el almacén
+ETAPA_EXTRAIDA = "EXTRAIDA"      # OCR terminado sin errores técnicos
+ETAPA_EXPORTADA = "EXPORTADA"    # Guardada en el almacén de resultados
+ETAPAS = [ETAPA_LISTADA, ETAPA_DESCARGADA, ETAPA_EXTRAIDA, ETAPA_EXPORTADA]
+
+# Estados de la ejecución
+EJECUCION_EN_CURSO = "EN_CURSO"        # También las que murieron con el proceso
+EJECUCION_COMPLETADA = "COMPLETADA"
+EJECUCION_INTERRUMPIDA = "INTERRUMPIDA"
+
+
+def _clave_valida(factura: FacturaEndesaDistribucion) -> bool:
+    return bool(factura.numero_factura) and factura.numero_factura != "N/A" and factura.cups != "PENDIENTE"
+
+
+class DiarioEjecuciones:
+    """
+    Diario (SQLite) de cada ejecución del robot: parámetros, estado y la etapa
+    alcanzada por cada rol y cada factura. Las etapas solo avanzan, de modo
+    que una ejecución interrumpida puede retomarse desde su último punto de
+    control (ver robotEndesa.reanudar_ejecucion).
+    """
+    def __init__(self, ruta: str = RUTA_DIARIO):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ejecuciones (
+                    id TEXT PRIMARY KEY,
+                    fecha_desde TEXT NOT NULL,
+                    fecha_hasta TEXT NOT NULL,
+                    parametros_json TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    error TEXT,
+                    reanudaciones INTEGER NOT NULL DEFAULT 0,
+                    iniciada REAL NOT NULL,
+                    actualizada REAL NOT NULL
+                )
+            """)
+            # La etapa se guarda como su posición en ETAPAS para poder quedarnos con la mayor
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS roles_ejecucion (
+                    ejecucion TEXT NOT NULL,
+                    rol TEXT NOT NULL,
+                    posicion INTEGER NOT NULL,
+                    etapa INTEGER NOT NULL,
+                    actualizado REAL NOT NULL,
+                    PRIMARY KEY (ejecucion, rol)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS facturas_ejecucion (
+                    ejecucion TEXT NOT NULL,
+                    cups TEXT NOT NULL,
+                    numero_factura TEXT NOT NULL,
+                    rol TEXT NOT NULL,
+                    etapa INTEGER NOT NULL,
+                    actualizado REAL NOT NULL,
+                    PRIMARY KEY (ejecucion, cups, numero_factura)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_facturas_ejecucion_rol ON facturas_ejecucion (ejecucion, rol)")
+
+    @contextmanager
+    def _conectar(self):
+        conn = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # --- Escritura ---
+
+    def iniciar(self, id_ejecucion: str, fecha_desde: str, fecha_hasta: str, parametros: dict):
+        """Registra la ejecución, o la vuelve a poner EN_CURSO si se está retomando."""
+        ahora = time.time()
+        with self._lock, self._conectar() as conn:
+            conn.execute("""
+                INSERT INTO ejecuciones (id, fecha_desde, fecha_hasta, parametros_json, estado, iniciada, actualizada)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    estado = excluded.estado,
+                    error = NULL,
+                    reanudaciones = reanudaciones + 1,
+                    actualizada = excluded.actualizada
+            """, (id_ejecucion, fecha_desde, fecha_hasta, json.dumps(parametros), EJECUCION_EN_CURSO, ahora, ahora))
+
+    def finalizar(self, id_ejecucion: str, estado: str, error: str | None = None):
+        with self._lock, self._conectar() as conn:
+            conn.execute(
+                "UPDATE ejecuciones SET estado = ?, error = ?, actualizada = ? WHERE id = ?",
+                (estado, error, time.time(), id_ejecucion),
+            )
+
+    def registrar_roles(self, id_ejecucion: str, roles: list[str]):
+        """Anota los roles detectados (etapa LISTADA; los ya avanzados se conservan)."""
+        self.avanzar_roles(id_ejecucion, list(enumerate(roles)), ETAPA_LISTADA)
+
+    def avanzar_roles(self, id_ejecucion: str, roles: list[tuple[int, str]], etapa: str):
+        ahora = time.time()
+        filas = [(id_ejecucion, rol, posicion, ETAPAS.index(etapa), ahora) for posicion, rol in roles]
+        with self._lock, self._conectar() as conn:
+            conn.executemany("""
+                INSERT INTO roles_ejecucion (ejecucion, rol, posicion, etapa, actualizado) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (ejecucion, rol) DO UPDATE SET
+                    posicion = excluded.posicion,
+                    etapa = MAX(etapa, excluded.etapa),
+                    actualizado = excluded.actualizado
+            """, filas)
+
+    def avanzar_facturas(self, id_ejecucion: str, rol: str, facturas: list[tuple[FacturaEndesaDistribucion, str]]):
+        """Anota en una transacción la etapa alcanzada por cada (factura, etapa) del rol."""
+        ahora = time.time()
+        filas = [
+            (id_ejecucion, f.cups, f.numero_factura, rol, ETAPAS.index(etapa), ahora)
+            for f, etapa in facturas if _clave_valida(f)
+        ]
+        if not filas:
+            return
+        with self._lock, self._conectar() as conn:
+            conn.executemany("""
+                INSERT INTO facturas_ejecucion (ejecucion, cups, numero_factura, rol, etapa, actualizado) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (ejecucion, cups, numero_factura) DO UPDATE SET
+                    rol = excluded.rol,
+                    etapa = MAX(etapa, excluded.etapa),
+                    actualizado = excluded.actualizado
+            """, filas)
+
+    # --- Consulta ---
+
+    def obtener(self, id_ejecucion: str) -> dict | None:
+        """Datos de la ejecución (parámetros incluidos), o None si no existe."""
+        with self._lock, self._conectar() as conn:
+            conn.row_factory = sqlite3.Row
+            fila = conn.execute("SELECT * FROM ejecuciones WHERE id = ?", (id_ejecucion,)).fetchone()
+        if not fila:
+            return None
+        ejecucion = dict(fila)
+        ejecucion["parametros"] = json.loads(ejecucion.pop("parametros_json"))
+        return ejecucion
+
+    def roles_en_etapa(self, id_ejecucion: str, etapa: str) -> list[str]:
+        """Roles que han alcanzado (al menos) la etapa indicada."""
+        with self._lock, self._conectar() as conn:
+            filas = conn.execute(
+                "SELECT rol FROM roles_ejecucion WHERE ejecucion = ? AND etapa >= ? ORDER BY posicion",
+                (id_ejecucion, ETAPAS.index(etapa)),
+            ).fetchall()
+        return [rol for (rol,) in filas]
+
+    def facturas_en_etapa(self, id_ejecucion: str, etapa: str, rol: str | None = None) -> list[tuple[str, str]]:
+        """Claves (cups, numero_factura) que han alcanzado (al menos) la etapa, opcionalmente de un rol."""
+        sql = "SELECT cups, numero_factura FROM facturas_ejecucion WHERE ejecucion = ? AND etapa >= ?"
+        parametros = [id_ejecucion, ETAPAS.index(etapa)]
+        if rol is not None:
+            sql += " AND rol = ?"
+            parametros.append(rol)
+        with self._lock, self._conectar() as conn:
+            return [tuple(fila) for fila in conn.execute(sql, parametros).fetchall()]
+
+    def facturas_pendientes(self, id_ejecucion: str, etapa: str = ETAPA_EXTRAIDA) -> list[tuple[str, str, str]]:
+        """(cups, numero_factura, rol) de las facturas que no han alcanzado la etapa indicada."""
+        with self._lock, self._conectar() as conn:
+            return [tuple(fila) for fila in conn.execute(
+                "SELECT cups, numero_factura, rol FROM facturas_ejecucion WHERE ejecucion = ? AND etapa < ? ORDER BY rol",
+                (id_ejecucion, ETAPAS.index(etapa)),
+            ).fetchall()]
+
+    def resumen(self, id_ejecucion: str) -> dict | None:
+        """Estado de la ejecución con la etapa de cada rol y el número de facturas por etapa."""
+        ejecucion = self.obtener(id_ejecucion)
+        if ejecucion is None:
+            return None
+        with self._lock, self._conectar() as conn:
+            roles = conn.execute(
+                "SELECT rol, etapa FROM roles_ejecucion WHERE ejecucion = ? ORDER BY posicion", (id_ejecucion,)
+            ).fetchall()
+            por_etapa = conn.execute(
+                "SELECT rol, etapa, COUNT(*) FROM facturas_ejecucion WHERE ejecucion = ? GROUP BY rol, etapa", (id_ejecucion,)
+            ).fetchall()
+        facturas_rol: dict[str, dict[str, int]] = {}
+        totales = {etapa: 0 for etapa in ETAPAS}
+        for rol, etapa, n in por_etapa:
+            facturas_rol.setdefault(rol, {})[ETAPAS[etapa]] = n
+            totales[ETAPAS[etapa]] += n
+        ejecucion["roles"] = [
+            {"rol": rol, "etapa": ETAPAS[etapa], "facturas": facturas_rol.get(rol, {})} for rol, etapa in roles
+        ]
+        ejecucion["facturas"] = totales
+        return ejecucion
+
+    def listar(self, limite: int = 50) -> list[dict]:
+        """Últimas ejecuciones, de la más reciente a la más antigua."""
+        with self._lock, self._conectar() as conn:
+            conn.row_factory = sqlite3.Row
+            filas = conn.execute("""
+                SELECT e.id, e.fecha_desde, e.fecha_hasta, e.estado, e.error, e.reanudaciones, e.iniciada, e.actualizada,
+                       (SELECT COUNT(*) FROM roles_ejecucion r WHERE r.ejecucion = e.id) AS roles,
+                       (SELECT COUNT(*) FROM roles_ejecucion r WHERE r.ejecucion = e.id AND r.etapa = ?) AS roles_exportados
+                FROM ejecuciones e ORDER BY e.iniciada DESC LIMIT ?
+            """, (ETAPAS.index(ETAPA_EXPORTADA), limite)).fetchall()
+        return [dict(fila) for fila in filas]
+
+
+# Instancia compartida por todo el proceso
+_diario: DiarioEjecuciones | None = None
+
+def obtener_diario() -> DiarioEjecuciones:
+    """Devuelve el diario compartido, creándolo en el primer uso."""
+    global _diario
+    if _diario is None:
+        _diario = DiarioEjecuciones()
+    return _diario
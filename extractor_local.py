@@ -0,0 +1,277 @@
+import os
+import re
+from logs import escribir_log
+from modelos_datos import FacturaEndesaDistribucion
+
+# pypdf es opcional: sin él, todas las facturas pasan por el LLM
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# --- CONFIGURACIÓN DEL EXTRACTOR LOCAL ---
+# Extracción determinista del texto del PDF antes de recurrir al LLM (1) o solo LLM (0)
+EXTRACCION_LOCAL_ACTIVA = os.environ.get("EDISTRIBUCION_OCR_LOCAL", "1") == "1"
+# Confianza mínima para aceptar un campo sin confirmarlo con el LLM
+CONFIANZA_MINIMA = float(os.environ.get("EDISTRIBUCION_OCR_LOCAL_CONFIANZA", "0.8"))
+
+# Páginas que se envían al LLM: detalle de facturación, pago y datos del suministro
+# (el resto son condiciones legales e información genérica)
+_RE_PAGINA_RELEVANTE = re.compile(
+    r"t[ée]rmino\s+(?:de\s+)?(?:potencia|energ[íi]a)|base\s+imponible|total\s+(?:de\s+)?factura|"
+    r"impuesto\s+el[ée]ctrico|datos\s+de\s+pago|ser[áa]\s+cargad|periodo\s+de\s+facturaci[óo]n|\bCUPS\b|potencia\s+contratada",
+    re.IGNORECASE,
+)
+
+# Campos que deben quedar resueltos con confianza para omitir el LLM.
+# contrato y fraccionamiento no salen de la tabla del portal: solo los rellena la extracción.
+CAMPOS_OBLIGATORIOS = (
+    "cups",
+    "contrato",
+    "fecha_inicio_periodo",
+    "fecha_fin_periodo",
+    "termino_de_potencia_peaje",
+    "termino_de_potencia_cargos",
+    "termino_de_energia_peaje",
+    "termino_de_energia_cargos",
+    "importe_impuesto_electrico",
+    "importe_base_imponible",
+    "importe_facturado",
+    "fecha_de_vencimiento",
+)
+# Campos que no aparecen en todas las facturas: su ausencia no obliga a llamar al LLM
+CAMPOS_OPCIONALES = (
+    "direccion_suministro",
+    "potencia_p1", "potencia_p2", "potencia_p3", "potencia_p4", "potencia_p5", "potencia_p6",
+    "importe_alquiler_equipos",
+    "importe_otros_conceptos",
+    "importe_exceso_potencia",
+    "importe_reactiva",
+    "fecha_de_cobro_en_banco",
+    "fraccionamiento",
+)
+# Campos de detalle que cubre la extracción (local o LLM)
+CAMPOS_DETALLE = CAMPOS_OBLIGATORIOS + CAMPOS_OPCIONALES
+
+# Conceptos de la tabla de facturación: etiqueta -> campo (importe al final de la línea)
+ETIQUETAS_IMPORTES = {
+    "termino_de_potencia_peaje": r"t[ée]rmino\s+(?:de\s+)?potencia\s+peaje",
+    "termino_de_potencia_cargos": r"t[ée]rmino\s+(?:de\s+)?potencia\s+cargos",
+    "termino_de_energia_peaje": r"t[ée]rmino\s+(?:de\s+)?energ[íi]a\s+peaje",
+    "termino_de_energia_cargos": r"t[ée]rmino\s+(?:de\s+)?energ[íi]a\s+cargos",
+    "importe_impuesto_electrico": r"impuesto\s+(?:sobre\s+la\s+)?electricidad|impuesto\s+el[ée]ctrico",
+    "importe_alquiler_equipos": r"alquiler\s+(?:de\s+)?(?:los\s+)?equipos?",
+    "importe_otros_conceptos": r"otros\s+conceptos",
+    "importe_exceso_potencia": r"excesos?\s+(?:de\s+)?potencia",
+    "importe_reactiva": r"(?:energ[íi]a\s+)?reactiva",
+    "importe_base_imponible": r"base\s+imponible",
+    "importe_facturado": r"total\s+(?:de\s+)?factura",
+}
+# Conceptos que suman la base imponible (validación cruzada)
+CONCEPTOS_BASE = (
+    "termino_de_potencia_peaje", "termino_de_potencia_cargos",
+    "termino_de_energia_peaje", "termino_de_energia_cargos",
+    "importe_impuesto_electrico", "importe_alquiler_equipos",
+    "importe_otros_conceptos", "importe_exceso_potencia", "importe_reactiva",
+)
+
+_FECHA = r"(\d{2})[/-](\d{2})[/-](\d{4})"
+_IMPORTE = r"-?\d{1,3}(?:\.\d{3})*,\d{2}|-?\d+[.,]\d{2}"
+_RE_IMPORTE_FINAL = re.compile(rf"({_IMPORTE})\s*(€|EUR)?\s*$", re.IGNORECASE)
+_RE_CUPS = re.compile(r"\bES\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?[A-Z]{2}(?:\s?\d[A-Z])?\b")
+_RE_PERIODO = re.compile(rf"{_FECHA}\s*(?:a|al|-)\s*{_FECHA}", re.IGNORECASE)
+_RE_PERIODO_ETIQUETADO = re.compile(rf"periodo\s+de\s+facturaci[óo]n\s*:?\s*(?:del\s+)?{_FECHA}\s*(?:a|al|-)\s*{_FECHA}", re.IGNORECASE)
+_RE_VENCIMIENTO = re.compile(rf"(?:fecha\s+(?:de\s+)?vencimiento|vence\s+el)\D{{0,20}}{_FECHA}", re.IGNORECASE)
+_RE_COBRO = re.compile(rf"le\s+ser[áa]\s+cargad[oa]\D{{0,120}}?{_FECHA}", re.IGNORECASE | re.DOTALL)
+_RE_DIRECCION = re.compile(r"direcci[óo]n\s+(?:del?\s+)?suministro\s*:?\s*(.+)", re.IGNORECASE)
+_RE_CONTRATO = re.compile(
+    r"(?:n[º°o]\.?\s*(?:de\s+)?contrato|contrato(?:\s+n[º°o]\.?)?\s*:)\s*:?\s*([A-Z0-9][A-Z0-9/.-]{3,})", re.IGNORECASE
+)
+_RE_FRACCIONAMIENTO = re.compile(r"fraccionamiento\s*:\s*(\S.*)", re.IGNORECASE)
+_RE_POTENCIA = re.compile(r"\bP([1-6])\s*:?\s*(\d+(?:[.,]\d+)?)\s*kW\b(?!\s*h)", re.IGNORECASE)
+
+
+def disponible() -> bool:
+    """Indica si la extracción local puede usarse (activa y con pypdf instalado)."""
+    return EXTRACCION_LOCAL_ACTIVA and PdfReader is not None
+
+def extraer_texto_pdf(ruta_pdf: str) -> str:
+    """Texto de todas las páginas del PDF, en orden de lectura."""
+    lector = PdfReader(ruta_pdf)
+    return "\n".join((pagina.extract_text() or "") for pagina in lector.pages)
+
+def leer_paginas(ruta_pdf: str) -> list[str] | None:
+    """
+    Texto de cada página del PDF. None si pypdf no está instalado, el PDF no
+    se puede leer o no tiene capa de texto (escaneado).
+    """
+    if PdfReader is None:
+        return None
+    try:
+        paginas = [(pagina.extract_text() or "") for pagina in PdfReader(ruta_pdf).pages]
+    except Exception as e:
+        escribir_log(f"        -> [OCR LOCAL] No se pudo leer el texto de {os.path.basename(ruta_pdf)}: {e}")
+        return None
+    return paginas if any(p.strip() for p in paginas) else None
+
+def texto_relevante(paginas: list[str]) -> str:
+    """
+    Texto de las páginas con datos de facturación o de pago, marcando su
+    número. Si ninguna encaja con el formato esperado se envían todas.
+    """
+    seleccion = [(i, texto) for i, texto in enumerate(paginas, start=1) if _RE_PAGINA_RELEVANTE.search(texto)]
+    if not seleccion:
+        seleccion = list(enumerate(paginas, start=1))
+    return "\n\n".join(f"--- Página {i} de {len(paginas)} ---\n{texto.strip()}" for i, texto in seleccion)
+
+def _a_float(texto: str) -> float:
+    texto = texto.strip()
+    if "," in texto:
+        texto = texto.replace(".", "").replace(",", ".")
+    return float(texto)
+
+def _a_fecha(d: str, m: str, a: str) -> str:
+    # Mismo formato que pide el prompt al LLM (DD-MM-YYYY)
+    return f"{d}-{m}-{a}"
+
+
+class ResultadoExtraccionLocal:
+    """Valores y confianza (0-1) por campo obtenidos del texto del PDF."""
+    def __init__(self):
+        self.datos: dict = {}
+        self.confianza: dict[str, float] = {}
+
+    def fijar(self, campo: str, valor, confianza: float):
+        # Ante candidatos distintos nos quedamos con el de más confianza
+        if campo not in self.datos or confianza > self.confianza[campo]:
+            self.datos[campo] = valor
+            self.confianza[campo] = confianza
+
+    def ajustar(self, campo: str, confianza: float):
+        if campo in self.datos:
+            self.confianza[campo] = confianza
+
+    def fiables(self, umbral: float = CONFIANZA_MINIMA) -> dict:
+        """Campos cuya confianza alcanza el umbral."""
+        return {c: v for c, v in self.datos.items() if self.confianza[c] >= umbral}
+
+    def campos_pendientes(self, umbral: float = CONFIANZA_MINIMA) -> list[str]:
+        """
+        Campos que debe resolver el LLM. Vacío si la extracción local basta:
+        todos los obligatorios fiables y ningún opcional encontrado con dudas.
+        """
+        fiables = self.fiables(umbral)
+        faltan_obligatorios = [c for c in CAMPOS_OBLIGATORIOS if c not in fiables]
+        dudosos_opcionales = [c for c in CAMPOS_OPCIONALES if c in self.datos and c not in fiables]
+        if not faltan_obligatorios and not dudosos_opcionales:
+            return []
+        return [c for c in CAMPOS_DETALLE if c not in fiables]
+
+
+def _extraer_importes(resultado: ResultadoExtraccionLocal, lineas: list[str]):
+    for campo, etiqueta in ETIQUETAS_IMPORTES.items():
+        patron = re.compile(etiqueta, re.IGNORECASE)
+        candidatos = []
+        for linea in lineas:
+            if not patron.search(linea):
+                continue
+            coincidencia = _RE_IMPORTE_FINAL.search(linea)
+            if coincidencia:
+                candidatos.append((_a_float(coincidencia.group(1)), bool(coincidencia.group(2))))
+        if not candidatos:
+            continue
+        valores = {valor for valor, _ in candidatos}
+        valor, con_moneda = candidatos[0]
+        if len(valores) > 1:
+            # La etiqueta aparece con importes distintos (p. ej. resumen y detalle): dudoso
+            resultado.fijar(campo, valor, 0.5)
+        else:
+            resultado.fijar(campo, valor, 0.9 if con_moneda else 0.75)
+
+def _validar_importes(resultado: ResultadoExtraccionLocal, factura: FacturaEndesaDistribucion):
+    datos = resultado.datos
+    # El total del PDF debe coincidir con el de la tabla del portal
+    if "importe_facturado" in datos and factura.importe_total_tabla:
+        coincide = abs(abs(datos["importe_facturado"]) - abs(factura.importe_total_tabla)) < 0.011
+        resultado.ajustar("importe_facturado", 1.0 if coincide else 0.3)
+    # Los conceptos deben sumar la base imponible
+    if "importe_base_imponible" in datos:
+        suma = sum(datos.get(c, 0.0) for c in CONCEPTOS_BASE)
+        if abs(suma - datos["importe_base_imponible"]) < 0.011:
+            for campo in CONCEPTOS_BASE + ("importe_base_imponible",):
+                if campo in datos:
+                    resultado.ajustar(campo, max(resultado.confianza[campo], 0.95))
+
+def extraer_campos(texto: str, factura: FacturaEndesaDistribucion) -> ResultadoExtraccionLocal:
+    """
+    Aplica las reglas del formato de factura de e-distribución al texto del
+    PDF. La factura (datos de la tabla) se usa para validar CUPS e importe.
+    """
+    resultado = ResultadoExtraccionLocal()
+    lineas = [linea.strip() for linea in texto.splitlines() if linea.strip()]
+
+    # CUPS: debe coincidir con el de la tabla
+    cups_encontrados = list(dict.fromkeys(m.group(0).replace(" ", "") for m in _RE_CUPS.finditer(texto)))
+    if cups_encontrados:
+        if factura.cups in cups_encontrados:
+            resultado.fijar("cups", factura.cups, 1.0)
+        else:
+            resultado.fijar("cups", cups_encontrados[0], 0.9 if len(cups_encontrados) == 1 else 0.4)
+
+    # Periodo de facturación
+    periodo = _RE_PERIODO_ETIQUETADO.search(texto)
+    confianza_periodo = 0.95
+    if not periodo:
+        periodo = _RE_PERIODO.search(texto)
+        confianza_periodo = 0.6
+    if periodo:
+        resultado.fijar("fecha_inicio_periodo", _a_fecha(*periodo.group(1, 2, 3)), confianza_periodo)
+        resultado.fijar("fecha_fin_periodo", _a_fecha(*periodo.group(4, 5, 6)), confianza_periodo)
+
+    vencimiento = _RE_VENCIMIENTO.search(texto)
+    if vencimiento:
+        resultado.fijar("fecha_de_vencimiento", _a_fecha(*vencimiento.group(1, 2, 3)), 0.9)
+
+    cobro = _RE_COBRO.search(texto)
+    if cobro:
+        resultado.fijar("fecha_de_cobro_en_banco", _a_fecha(*cobro.group(1, 2, 3)), 0.85)
+
+    for linea in lineas:
+        direccion = _RE_DIRECCION.search(linea)
+        if direccion and direccion.group(1).strip():
+            resultado.fijar("direccion_suministro", direccion.group(1).strip(), 0.8)
+            break
+
+    contratos = list(dict.fromkeys(m.group(1).rstrip(".") for m in _RE_CONTRATO.finditer(texto)))
+    if contratos:
+        resultado.fijar("contrato", contratos[0], 0.9 if len(contratos) == 1 else 0.4)
+
+    if re.search(r"fraccionamiento", texto, re.IGNORECASE):
+        for linea in lineas:
+            fraccionamiento = _RE_FRACCIONAMIENTO.search(linea)
+            if fraccionamiento:
+                resultado.fijar("fraccionamiento", fraccionamiento.group(1).strip(), 0.8)
+                break
+        else:
+            # Se menciona pero no con el formato esperado: que lo resuelva el LLM
+            resultado.fijar("fraccionamiento", None, 0.0)
+
+    potencias = {}
+    for coincidencia in _RE_POTENCIA.finditer(texto):
+        potencias.setdefault(int(coincidencia.group(1)), _a_float(coincidencia.group(2)))
+    for periodo_p, valor in potencias.items():
+        resultado.fijar(f"potencia_p{periodo_p}", valor, 0.85)
+
+    _extraer_importes(resultado, lineas)
+    _validar_importes(resultado, factura)
+    return resultado
+
+def extraer_local(factura: FacturaEndesaDistribucion, paginas: list[str] | None) -> ResultadoExtraccionLocal | None:
+    """
+    Extracción determinista a partir del texto de las páginas del PDF.
+    Devuelve None si no está activa o el PDF no tiene capa de texto
+    (escaneado), en cuyo caso decide el LLM.
+    """
+    if not disponible() or not paginas:
+        return None
+    return extraer_campos("\n".join(paginas), factura)
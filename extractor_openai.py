@@ -0,0 +1,263 @@
+import os
+import time
+import random
+import asyncio
+from openai import AsyncOpenAI, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError, APIStatusError
+from logs import escribir_log
+from metricas import registrar_indicador
+
+# --- CONFIGURACIÓN DEL EXTRACTOR ---
+# Límites de la cuenta de OpenAI (peticiones y tokens por minuto)
+LIMITE_RPM = int(os.environ.get("OPENAI_LIMITE_RPM", "500"))
+LIMITE_TPM = int(os.environ.get("OPENAI_LIMITE_TPM", "30000"))
+# Máximo de llamadas simultáneas en vuelo
+MAX_EN_VUELO = int(os.environ.get("OPENAI_MAX_EN_VUELO", "8"))
+# Reintentos ante errores transitorios (429, timeouts, 5xx)
+MAX_REINTENTOS = int(os.environ.get("OPENAI_MAX_REINTENTOS", "5"))
+BACKOFF_BASE_S = float(os.environ.get("OPENAI_BACKOFF_BASE_S", "1.0"))
+BACKOFF_MAX_S = float(os.environ.get("OPENAI_BACKOFF_MAX_S", "60.0"))
+# Tokens reservados por factura antes de conocer el consumo real
+TOKENS_ESTIMADOS_FACTURA = int(os.environ.get("OPENAI_TOKENS_ESTIMADOS", "8000"))
+
+# Códigos HTTP que se consideran transitorios
+CODIGOS_TRANSITORIOS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Cubo de fichas que se recarga de forma continua hasta `capacidad_por_minuto`.
+    Las esperas se atienden en orden de llegada. `pausar` bloquea las
+    adquisiciones de todos los clientes hasta un instante dado (p. ej. tras un 429).
+    """
+    def __init__(self, capacidad_por_minuto: int):
+        self.capacidad = float(max(1, capacidad_por_minuto))
+        self.tasa_por_segundo = self.capacidad / 60.0
+        self.disponibles = self.capacidad
+        self.ultima_recarga = time.monotonic()
+        # Instante (monotonic) antes del cual no se entregan fichas
+        self.no_antes_de = 0.0
+        self._lock = asyncio.Lock()
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        transcurrido = ahora - self.ultima_recarga
+        self.disponibles = min(self.capacidad, self.disponibles + transcurrido * self.tasa_por_segundo)
+        self.ultima_recarga = ahora
+
+    async def adquirir(self, cantidad: float = 1.0):
+        """Espera hasta disponer de `cantidad` fichas y las consume."""
+        cantidad = min(float(cantidad), self.capacidad)
+        async with self._lock:
+            while True:
+                pausa = self.no_antes_de - time.monotonic()
+                if pausa > 0:
+                    await asyncio.sleep(pausa)
+                    continue
+                self._recargar()
+                if self.disponibles >= cantidad:
+                    self.disponibles -= cantidad
+                    return
+                await asyncio.sleep((cantidad - self.disponibles) / self.tasa_por_segundo)
+
+    def ajustar(self, diferencia: float):
+        """
+        Corrige la reserva con el consumo real (positivo = se consumió más de lo
+        estimado). El saldo puede quedar negativo, lo que retrasa las siguientes.
+        """
+        self._recargar()
+        self.disponibles = min(self.capacidad, self.disponibles - diferencia)
+
+    def pausar(self, segundos: float):
+        """Retrasa todas las adquisiciones al menos `segundos` desde ahora."""
+        self.no_antes_de = max(self.no_antes_de, time.monotonic() + segundos)
+
+
+class ExtractorOpenAI:
+    """
+    Servicio asíncrono compartido para las llamadas a OpenAI.
+    Reutiliza un único cliente AsyncOpenAI, limita peticiones y tokens por
+    minuto, acota las llamadas en vuelo y reintenta errores transitorios con
+    backoff exponencial con jitter.
+    """
+    def __init__(self, api_key: str | None = None, base_url: str | None = None,
+                 limite_rpm: int | None = None, limite_tpm: int | None = None,
+                 max_en_vuelo: int | None = None, max_reintentos: int | None = None):
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("No se encontró la variable de entorno OPENAI_API_KEY")
+
+        # base_url permite apuntar a un servidor local que simule la API (OPENAI_BASE_URL)
+        # Los reintentos los gestiona el extractor, no el SDK
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url or os.getenv("OPENAI_BASE_URL") or None,
+            max_retries=0,
+        )
+        self.bucket_peticiones = TokenBucket(limite_rpm or LIMITE_RPM)
+        self.bucket_tokens = TokenBucket(limite_tpm or LIMITE_TPM)
+        self.semaforo = asyncio.Semaphore(max(1, max_en_vuelo or MAX_EN_VUELO))
+        self.max_reintentos = MAX_REINTENTOS if max_reintentos is None else max_reintentos
+
+        # Contadores de rendimiento
+        self.inicio = time.monotonic()
+        self.en_espera = 0
+        self.en_vuelo = 0
+        self.completadas = 0
+        self.fallidas = 0
+        self.reintentos = 0
+        self.errores_429 = 0
+        self.tokens_consumidos = 0
+        self.segundos_en_api = 0.0
+
+    # --- Reintentos ---
+
+    @staticmethod
+    def _es_transitorio(error: Exception) -> bool:
+        if isinstance(error, (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)):
+            return True
+        if isinstance(error, APIStatusError):
+            return error.status_code in CODIGOS_TRANSITORIOS
+        return False
+
+    @staticmethod
+    def _espera_reintento(error: Exception, intento: int) -> float:
+        """Respeta Retry-After si el servidor lo envía; si no, backoff exponencial con jitter completo."""
+        respuesta = getattr(error, "response", None)
+        if respuesta is not None:
+            retry_after = respuesta.headers.get("retry-after")
+            try:
+                if retry_after is not None:
+                    return min(BACKOFF_MAX_S, float(retry_after))
+            except ValueError:
+                pass
+        techo = min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** intento))
+        return random.uniform(0, techo)
+
+    async def _con_reintentos(self, descripcion: str, operacion):
+        intento = 0
+        while True:
+            try:
+                return await operacion()
+            except Exception as e:
+                if not self._es_transitorio(e) or intento >= self.max_reintentos:
+                    raise
+                espera = self._espera_reintento(e, intento)
+                if isinstance(e, RateLimitError) or getattr(e, "status_code", None) == 429:
+                    # El límite es de la cuenta: pausamos los cubos compartidos, no solo esta tarea
+                    self.errores_429 += 1
+                    self.bucket_peticiones.pausar(espera)
+                    self.bucket_tokens.pausar(espera)
+                intento += 1
+                self.reintentos += 1
+                escribir_log(f"        -> [OPENAI] {descripcion}: error transitorio ({type(e).__name__}). Reintento {intento}/{self.max_reintentos} en {espera:.1f}s")
+                await asyncio.sleep(espera)
+
+    # --- Operaciones ---
+
+    async def subir_archivo(self, ruta_pdf: str, proposito: str = "assistants") -> str:
+        """Sube el PDF (o la entrada JSONL de un lote, con proposito="batch") y devuelve su file_id."""
+        async def _subir():
+            with open(ruta_pdf, "rb") as f:
+                return await self.client.files.create(file=f, purpose=proposito)
+        archivo = await self._con_reintentos("files.create", _subir)
+        return archivo.id
+
+    async def borrar_archivo(self, file_id: str):
+        try:
+            await self._con_reintentos("files.delete", lambda: self.client.files.delete(file_id))
+        except Exception as e:
+            escribir_log(f"        -> [OPENAI] No se pudo borrar el archivo {file_id}: {e}")
+
+    async def descargar_archivo(self, file_id: str) -> bytes:
+        """Devuelve el contenido de un archivo (p. ej. la salida de un lote)."""
+        contenido = await self._con_reintentos("files.content", lambda: self.client.files.content(file_id))
+        return contenido.content
+
+    async def crear_lote(self, input_file_id: str, ventana: str = "24h"):
+        """Crea un lote de `responses.create` sobre un JSONL ya subido. No consume la cuota por minuto."""
+        return await self._con_reintentos("batches.create", lambda: self.client.batches.create(
+            input_file_id=input_file_id, endpoint="/v1/responses", completion_window=ventana
+        ))
+
+    async def consultar_lote(self, id_lote: str):
+        return await self._con_reintentos("batches.retrieve", lambda: self.client.batches.retrieve(id_lote))
+
+    async def crear_respuesta(self, peticion: dict, tokens_estimados: int | None = None):
+        """
+        Ejecuta `responses.create` respetando los límites de ritmo y de
+        concurrencia. Devuelve la respuesta del SDK. Cada intento (también los
+        reintentos) consume fichas de RPM/TPM y ocupa una plaza en vuelo; las
+        esperas entre intentos no retienen la plaza.
+        """
+        tokens_estimados = tokens_estimados or TOKENS_ESTIMADOS_FACTURA
+
+        async def _intento():
+            self.en_espera += 1
+            try:
+                await self.bucket_peticiones.adquirir(1)
+                await self.bucket_tokens.adquirir(tokens_estimados)
+                await self.semaforo.acquire()
+            finally:
+                self.en_espera -= 1
+
+            self.en_vuelo += 1
+            t0 = time.monotonic()
+            try:
+                return await self.client.responses.create(**peticion)
+            finally:
+                self.segundos_en_api += time.monotonic() - t0
+                self.en_vuelo -= 1
+                self.semaforo.release()
+
+        try:
+            respuesta = await self._con_reintentos("responses.create", _intento)
+            self.completadas += 1
+
+            # Conciliamos la reserva de tokens con el uso real
+            uso = getattr(respuesta, "usage", None)
+            tokens_reales = getattr(uso, "total_tokens", None) if uso else None
+            if tokens_reales:
+                self.tokens_consumidos += tokens_reales
+                self.bucket_tokens.ajustar(tokens_reales - tokens_estimados)
+            return respuesta
+        except Exception:
+            self.fallidas += 1
+            raise
+
+    def estadisticas(self) -> dict:
+        """Contadores de rendimiento y profundidad de cola del extractor."""
+        minutos = max((time.monotonic() - self.inicio) / 60.0, 1e-9)
+        terminadas = self.completadas + self.fallidas
+        return {
+            "en_espera": self.en_espera,
+            "en_vuelo": self.en_vuelo,
+            "completadas": self.completadas,
+            "fallidas": self.fallidas,
+            "reintentos": self.reintentos,
+            "errores_429": self.errores_429,
+            "tokens_consumidos": self.tokens_consumidos,
+            "completadas_por_minuto": round(self.completadas / minutos, 2),
+            "tokens_por_minuto": round(self.tokens_consumidos / minutos, 2),
+            "latencia_media_s": round(self.segundos_en_api / terminadas, 3) if terminadas else 0.0,
+        }
+
+
+# Instancia compartida por todo el proceso
+_extractor: ExtractorOpenAI | None = None
+
+def obtener_extractor() -> ExtractorOpenAI:
+    """Devuelve el extractor compartido, creándolo en el primer uso."""
+    global _extractor
+    if _extractor is None:
+        _extractor = ExtractorOpenAI()
+    return _extractor
+
+
+registrar_indicador(
+    "edistribucion_llm_en_vuelo", "Llamadas al LLM en curso.",
+    lambda: _extractor.en_vuelo if _extractor else 0,
+)
+registrar_indicador(
+    "edistribucion_llm_en_espera", "Llamadas al LLM esperando turno (límite de concurrencia o de RPM/TPM).",
+    lambda: _extractor.en_espera if _extractor else 0,
+)
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import date
+from contextlib import contextmanager
+from modelos_datos import FacturaEndesaDistribucion
+
+# --- CONFIGURACIÓN DEL ÍNDICE DE FACTURAS ---
+DATOS_DIR = "datos"
+RUTA_INDICE = os.path.join(DATOS_DIR, "indice_facturas.sqlite3")
+
+# Estados de procesamiento
+ESTADO_COMPLETA = "COMPLETA"   # Datos de tabla + PDF + OCR correctos
+ESTADO_ERROR = "ERROR"         # Fallo de descarga, OCR o estructura: se reintenta en la próxima pasada
+ESTADO_PENDIENTE_OCR = "PENDIENTE_OCR"  # PDF descargado, extracción en un lote OCR aún sin conciliar
+
+
+def estado_proceso_de(factura: FacturaEndesaDistribucion) -> str:
+    """
+    Deduce el estado de procesamiento de una factura.
+    Las notificaciones de negocio (p. ej. importe negativo) marcan error_RPA
+    pero no requieren reprocesado; solo los errores técnicos (ERROR_*) sí.
+    """
+    if ESTADO_PENDIENTE_OCR in (factura.direccion_suministro or ""):
+        return ESTADO_PENDIENTE_OCR
+    if not factura.error_RPA:
+        return ESTADO_COMPLETA
+    if "ERROR_" in (factura.direccion_suministro or ""):
+        return ESTADO_ERROR
+    return ESTADO_COMPLETA
+
+
+class IndiceFacturas:
+    """
+    Índice local (SQLite) de facturas ya procesadas, con clave (cups, numero_factura).
+    Guarda el registro completo, la ruta del PDF y el estado de procesamiento
+    para que las sincronizaciones incrementales omitan lo ya resuelto.
+    """
+    def __init__(self, ruta: str = RUTA_INDICE):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS facturas (
+                    cups TEXT NOT NULL,
+                    numero_factura TEXT NOT NULL,
+                    estado_factura TEXT,
+                    importe_total_tabla REAL,
+                    estado_proceso TEXT NOT NULL,
+                    ruta_pdf TEXT,
+                    datos_json TEXT NOT NULL,
+                    actualizado REAL NOT NULL,
+                    PRIMARY KEY (cups, numero_factura)
+                )
+            """)
+            # Ventanas (rol, rango de fechas) ya completadas, para reanudar backfills
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ventanas (
+                    rol TEXT NOT NULL,
+                    desde TEXT NOT NULL,
+                    hasta TEXT NOT NULL,
+                    claves_json TEXT NOT NULL,
+                    completada REAL NOT NULL,
+                    PRIMARY KEY (rol, desde, hasta)
+                )
+            """)
+
+    @contextmanager
+    def _conectar(self):
+        conn = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def obtener(self, cups: str, numero_factura: str) -> dict | None:
+        """Devuelve el registro indexado como diccionario, o None."""
+        with self._lock, self._conectar() as conn:
+            conn.row_factory = sqlite3.Row
+            fila = conn.execute(
+                "SELECT * FROM facturas WHERE cups = ? AND numero_factura = ?",
+                (cups, numero_factura),
+            ).fetchone()
+        return dict(fila) if fila else None
+
+    def factura_reutilizable(self, factura_tabla: FacturaEndesaDistribucion) -> FacturaEndesaDistribucion | None:
+        """
+        Si la factura leída de la tabla ya está COMPLETA en el índice (o aparcada
+        en un lote OCR en curso) y no ha cambiado su estado ni su importe,
+        devuelve el registro almacenado.
+        """
+        registro = self.obtener(factura_tabla.cups, factura_tabla.numero_factura)
+        if not registro or registro["estado_proceso"] not in (ESTADO_COMPLETA, ESTADO_PENDIENTE_OCR):
+            return None
+        if registro["estado_factura"] != factura_tabla.estado_factura:
+            return None
+        if round(registro["importe_total_tabla"] or 0.0, 2) != round(factura_tabla.importe_total_tabla or 0.0, 2):
+            return None
+        if registro["ruta_pdf"] and not os.path.exists(registro["ruta_pdf"]):
+            return None
+        return FacturaEndesaDistribucion.model_validate_json(registro["datos_json"])
+
+    def registrar_lote(self, facturas: list[tuple[FacturaEndesaDistribucion, str | None]]):
+        """Inserta o actualiza un lote de (factura, ruta_pdf) en una sola transacción."""
+        ahora = time.time()
+        filas = [
+            (
+                f.cups, f.numero_factura, f.estado_factura, f.importe_total_tabla,
+                estado_proceso_de(f), ruta_pdf, f.model_dump_json(), ahora,
+            )
+            for f, ruta_pdf in facturas
+            # Las filas que no pudieron leerse no tienen clave útil
+            if f.numero_factura and f.numero_factura != "N/A" and f.cups != "PENDIENTE"
+        ]
+        if not filas:
+            return
+        with self._lock, self._conectar() as conn:
+            conn.executemany("""
+                INSERT INTO facturas (cups, numero_factura, estado_factura, importe_total_tabla, estado_proceso, ruta_pdf, datos_json, actualizado)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (cups, numero_factura) DO UPDATE SET
+                    estado_factura = excluded.estado_factura,
+                    importe_total_tabla = excluded.importe_total_tabla,
+                    estado_proceso = excluded.estado_proceso,
+                    ruta_pdf = excluded.ruta_pdf,
+                    datos_json = excluded.datos_json,
+                    actualizado = excluded.actualizado
+            """, filas)
+
+
+    def registrar_ventana(self, rol: str, desde: date, hasta: date, facturas: list[FacturaEndesaDistribucion]):
+        """Marca una ventana como completada junto con las claves de sus facturas."""
+        claves = [[f.cups, f.numero_factura] for f in facturas if f.numero_factura and f.numero_factura != "N/A" and f.cups != "PENDIENTE"]
+        with self._lock, self._conectar() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO ventanas (rol, desde, hasta, claves_json, completada)
+                VALUES (?, ?, ?, ?, ?)
+            """, (rol, desde.isoformat(), hasta.isoformat(), json.dumps(claves), time.time()))
+
+    def ventanas_completadas(self, rol: str, desde: date, hasta: date) -> list[tuple[date, date, list[tuple[str, str]]]]:
+        """Ventanas completadas del rol contenidas en [desde, hasta], con sus claves."""
+        with self._lock, self._conectar() as conn:
+            filas = conn.execute(
+                "SELECT desde, hasta, claves_json FROM ventanas WHERE rol = ? AND desde >= ? AND hasta <= ?",
+                (rol, desde.isoformat(), hasta.isoformat()),
+            ).fetchall()
+        return [
+            (date.fromisoformat(d), date.fromisoformat(h), [tuple(c) for c in json.loads(claves)])
+            for d, h, claves in filas
+        ]
+
+    def cargar_facturas(self, claves: list[tuple[str, str]]) -> list[FacturaEndesaDistribucion]:
+        """Recupera del índice las facturas de las claves dadas (las ausentes se omiten)."""
+        facturas = []
+        for cups, numero_factura in claves:
+            registro = self.obtener(cups, numero_factura)
+            if registro:
+                facturas.append(FacturaEndesaDistribucion.model_validate_json(registro["datos_json"]))
+        return facturas
+
+
+# Instancia compartida por todo el proceso
+_indice: IndiceFacturas | None = None
+
+def obtener_indice() -> IndiceFacturas:
+    """Devuelve el índice compartido, creándolo en el primer uso."""
+    global _indice
+    if _indice is None:
+        _indice = IndiceFacturas()
+    return _indice
@@ -1,15 +1,293 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+import contextvars
+from contextlib import contextmanager
 from datetime import datetime
 
-def escribir_log(mensaje, mostrar_en_consola=True, mostrar_tiempo=True, pretexto="\t"):
+# --- CONFIGURACIÓN DEL REGISTRO ---
+# Archivo de log en líneas JSON (una por mensaje o tramo medido)
+RUTA_LOG = os.environ.get("EDISTRIBUCION_LOG", os.path.join("logs", "log.jsonl"))
+# Rotación por tamaño (MB) y por antigüedad (horas); copias rotadas que se conservan
+LOG_MAX_MB = float(os.environ.get("EDISTRIBUCION_LOG_MAX_MB", "20"))
+LOG_ROTACION_H = float(os.environ.get("EDISTRIBUCION_LOG_ROTACION_H", "24"))
+LOG_COPIAS = int(os.environ.get("EDISTRIBUCION_LOG_COPIAS", "5"))
+# Mensajes en espera del hilo escritor; si se llena, los nuevos se descartan (y se cuentan)
+LOG_TAMANO_COLA = int(os.environ.get("EDISTRIBUCION_LOG_COLA", "50000"))
+# Mensajes como máximo por escritura en disco
+LOG_LOTE = 500
+
+# Contexto que se añade a cada línea (ejecución, rol, cups, factura).
+# Las tareas asyncio heredan el contexto vigente al crearse.
+_contexto: contextvars.ContextVar[dict] = contextvars.ContextVar("contexto_log", default={})
+
+# Mensajes de control del hilo escritor
+_VACIAR = object()
+_DETENER = object()
+
+
+@contextmanager
+def contexto_log(**campos):
+    """Añade campos al contexto de las líneas de log dentro del bloque."""
+    token = _contexto.set({**_contexto.get(), **{c: v for c, v in campos.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _contexto.reset(token)
+
+def anotar_contexto(**campos) -> contextvars.Token:
+    """Añade campos al contexto actual sin bloque; devuelve el token para `restaurar_contexto`."""
+    return _contexto.set({**_contexto.get(), **{c: v for c, v in campos.items() if v is not None}})
+
+def restaurar_contexto(token: contextvars.Token):
+    _contexto.reset(token)
+
+
+def _nivel(mensaje: str) -> str:
+    if "ERROR" in mensaje or "CRÍTICO" in mensaje or "Fallo crítico" in mensaje:
+        return "ERROR"
+    if "[!]" in mensaje or "ADVERTENCIA" in mensaje:
+        return "AVISO"
+    return "INFO"
+
+
+class EscritorLog(threading.Thread):
+    """
+    Hilo que vacía la cola de mensajes en disco por lotes (una escritura y un
+    flush por lote) y rota el archivo por tamaño y antigüedad. Quien registra
+    solo encola: nunca espera al disco ni a la consola.
+    """
+    def __init__(self, ruta: str = RUTA_LOG, max_bytes: int | None = None, rotacion_s: float | None = None,
+                 copias: int = LOG_COPIAS, tamano_cola: int = LOG_TAMANO_COLA):
+        super().__init__(name="escritor-log", daemon=True)
+        self.ruta = ruta
+        self.max_bytes = int(LOG_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.rotacion_s = LOG_ROTACION_H * 3600 if rotacion_s is None else rotacion_s
+        self.copias = copias
+        self.cola: queue.Queue = queue.Queue(maxsize=max(1, tamano_cola))
+        self.escritas = 0
+        self.descartadas = 0
+        self.lotes = 0
+        self.rotaciones = 0
+        self._archivo = None
+        self._abierto_en = 0.0
+
+    def encolar(self, registro: dict | None, linea_consola: str | None):
+        try:
+            self.cola.put_nowait((registro, linea_consola))
+        except queue.Full:
+            self.descartadas += 1
+
+    def vaciar(self):
+        """Trunca el archivo de log actual (lo hace el propio hilo, sin carreras con la escritura)."""
+        self.cola.put((_VACIAR, None))
+
+    def detener(self, timeout_s: float = 5.0):
+        """Escribe lo pendiente y termina el hilo."""
+        if self.is_alive():
+            self.cola.put((_DETENER, None))
+            self.join(timeout_s)
+
+    def run(self):
+        while True:
+            lote = [self.cola.get()]
+            while len(lote) < LOG_LOTE:
+                try:
+                    lote.append(self.cola.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                detener = self._escribir(lote)
+            except Exception as e:
+                # Un lote fallido no puede matar el hilo: el resto de la aplicación seguiría encolando sin escritor
+                sys.stderr.write(f"[LOG] Lote de log descartado: {e}\n")
+                detener = any(registro is _DETENER for registro, _ in lote)
+            if detener:
+                self._cerrar_archivo()
+                return
+
+    def _escribir(self, lote: list) -> bool:
+        lineas, consola = [], []
+        detener = False
+        for registro, linea_consola in lote:
+            if registro is _DETENER:
+                detener = True
+                continue
+            if registro is _VACIAR:
+                self._volcar(lineas, consola)
+                lineas, consola = [], []
+                self._truncar()
+                continue
+            if registro is not None:
+                lineas.append(json.dumps(registro, ensure_ascii=False, default=str))
+            if linea_consola is not None:
+                consola.append(linea_consola)
+        self._volcar(lineas, consola)
+        return detener
+
+    def _volcar(self, lineas: list[str], consola: list[str]):
+        try:
+            if lineas:
+                self._rotar_si_toca()
+                archivo = self._abrir()
+                archivo.write("\n".join(lineas) + "\n")
+                archivo.flush()
+                self.escritas += len(lineas)
+                self.lotes += 1
+            if consola:
+                sys.stdout.write("".join(consola))
+                sys.stdout.flush()
+        except Exception as e:
+            # El log nunca debe tumbar la aplicación
+            sys.stderr.write(f"[LOG] No se pudo escribir el log: {e}\n")
+
+    def _truncar(self):
+        try:
+            self._cerrar_archivo()
+            os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+            open(self.ruta, "w").close()
+        except Exception as e:
+            sys.stderr.write(f"[LOG] No se pudo vaciar el log: {e}\n")
+
+    def _abrir(self):
+        if self._archivo is None:
+            os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+            self._archivo = open(self.ruta, "a", encoding="utf-8")
+            self._abierto_en = time.time()
+        return self._archivo
+
+    def _cerrar_archivo(self):
+        if self._archivo is not None:
+            archivo, self._archivo = self._archivo, None
+            archivo.close()
+
+    def _rotar_si_toca(self):
+        if self._archivo is None:
+            return
+        if self._archivo.tell() < self.max_bytes and time.time() - self._abierto_en < self.rotacion_s:
+            return
+        self._cerrar_archivo()
+        os.replace(self.ruta, f"{self.ruta}.{datetime.now():%Y%m%d_%H%M%S_%f}")
+        self.rotaciones += 1
+        # Solo se conservan las `copias` rotaciones más recientes
+        carpeta = os.path.dirname(self.ruta) or "."
+        base = os.path.basename(self.ruta) + "."
+        rotados = sorted(n for n in os.listdir(carpeta) if n.startswith(base))
+        for nombre in rotados[:max(0, len(rotados) - self.copias)]:
+            os.remove(os.path.join(carpeta, nombre))
+
+    def estadisticas(self) -> dict:
+        return {
+            "ruta": self.ruta,
+            "en_cola": self.cola.qsize(),
+            "escritas": self.escritas,
+            "descartadas": self.descartadas,
+            "lotes": self.lotes,
+            "rotaciones": self.rotaciones,
+        }
+
+
+class EstadisticasTramos:
+    """Acumula duración total, número y máximo de cada tramo medido."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tramos: dict[str, list[float]] = {}
+
+    def registrar(self, nombre: str, segundos: float):
+        with self._lock:
+            acumulado = self.tramos.setdefault(nombre, [0, 0.0, 0.0])
+            acumulado[0] += 1
+            acumulado[1] += segundos
+            acumulado[2] = max(acumulado[2], segundos)
+
+    def resumen(self) -> dict:
+        with self._lock:
+            return {
+                nombre: {"n": n, "total_s": round(total, 3), "media_ms": round(total / n * 1000, 1), "max_ms": round(maximo * 1000, 1)}
+                for nombre, (n, total, maximo) in self.tramos.items()
+            }
+
+    def reiniciar(self):
+        with self._lock:
+            self.tramos = {}
+
+
+_escritor: EscritorLog | None = None
+_escritor_lock = threading.Lock()
+_tramos = EstadisticasTramos()
+# Funciones (nombre, segundos) avisadas al cerrar cada tramo, p. ej. los histogramas de metricas.py
+_suscriptores_tramos: list = []
+
+def obtener_escritor_log() -> EscritorLog:
+    """Devuelve el escritor compartido, arrancando su hilo en el primer uso."""
+    global _escritor
+    if _escritor is None:
+        with _escritor_lock:
+            if _escritor is None:
+                escritor = EscritorLog()
+                escritor.start()
+                atexit.register(escritor.detener)
+                _escritor = escritor
+    return _escritor
+
+def obtener_tramos() -> EstadisticasTramos:
+    return _tramos
+
+def suscribir_tramos(funcion):
+    """Registra `funcion(nombre, segundos)` para que reciba la duración de cada tramo cerrado."""
+    if funcion not in _suscriptores_tramos:
+        _suscriptores_tramos.append(funcion)
+
+
+def _registro(mensaje: str | None = None, **campos) -> dict:
+    registro = {"ts": datetime.now().isoformat(timespec="milliseconds")}
+    if mensaje is not None:
+        registro["nivel"] = _nivel(mensaje)
+        registro["mensaje"] = mensaje
+    registro.update(_contexto.get())
+    registro.update(campos)
+    return registro
+
+
+@contextmanager
+def tramo(nombre: str, **campos):
+    """
+    Mide la duración de una etapa (login, cambio de rol, filtro, lectura,
+    descarga, OCR) y la registra como línea JSON con evento "tramo". El bloque
+    recibe el diccionario de campos para añadir datos del resultado.
+    """
+    inicio = time.perf_counter()
+    try:
+        yield campos
+    except BaseException as e:
+        campos["error"] = type(e).__name__
+        raise
+    finally:
+        segundos = time.perf_counter() - inicio
+        _tramos.registrar(nombre, segundos)
+        for funcion in _suscriptores_tramos:
+            funcion(nombre, segundos)
+        obtener_escritor_log().encolar(_registro(evento="tramo", tramo=nombre, duracion_ms=round(segundos * 1000, 1), **campos), None)
+
+
+def escribir_log(mensaje, mostrar_en_consola=True, mostrar_tiempo=True, pretexto="\t", **campos):
         '''
-        Registra un mensaje en el archivo de log y opcionalmente lo muestra en la consola.
+        Registra un mensaje en el archivo de log (línea JSON con el contexto de
+        la ejecución) y opcionalmente lo muestra en la consola. No bloquea: la
+        escritura la hace el hilo escritor en segundo plano.
         '''
-        timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-        if mostrar_tiempo:
-            linea = f"{pretexto}{timestamp} {mensaje}\n"
-        else:
-            linea = f"{pretexto} {mensaje}\n"
-        with open("logs/log.txt", "a", encoding="utf-8") as log_file:
-            log_file.write(linea)
+        consola = None
         if mostrar_en_consola:
-            print(linea, end="")
\ No newline at end of file
+            timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
+            if mostrar_tiempo:
+                consola = f"{pretexto}{timestamp} {mensaje}\n"
+            else:
+                consola = f"{pretexto} {mensaje}\n"
+        # Los separadores decorativos solo van a la consola
+        texto = str(mensaje).strip()
+        registro = _registro(texto, **campos) if texto.strip("=- ") else None
+        obtener_escritor_log().encolar(registro, consola)
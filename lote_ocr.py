@@ -0,0 +1,361 @@
+import os
+import json
+import uuid
+import asyncio
+from datetime import datetime
+from logs import escribir_log, tramo
+from modelos_datos import FacturaEndesaDistribucion, ProgresoEjecucion
+from extractor_openai import obtener_extractor
+from indice_facturas import DATOS_DIR, ESTADO_PENDIENTE_OCR, obtener_indice
+from pdf_parser import preparar_extraccion, construir_peticion, aplicar_respuesta, procesar_pdf_local_async
+from pipeline_ocr import marcar_error_ocr
+from cache_resultados import obtener_cache_resultados
+
+# --- CONFIGURACIÓN DEL MODO LOTE (Batch API) ---
+DIR_LOTES = os.path.join(DATOS_DIR, "lotes_ocr")
+# OCR por lotes por defecto en las ejecuciones (0: OCR en línea con el pipeline)
+OCR_LOTE = os.environ.get("EDISTRIBUCION_OCR_LOTE", "0") == "1"
+# Segundos entre consultas del estado de los lotes enviados
+INTERVALO_SONDEO_LOTE_S = float(os.environ.get("EDISTRIBUCION_LOTE_SONDEO_S", "60"))
+# Plazo de finalización solicitado a la Batch API
+VENTANA_LOTE = os.environ.get("EDISTRIBUCION_LOTE_VENTANA", "24h")
+# Peticiones por lote (límite de la Batch API: 50.000)
+MAX_PETICIONES_LOTE = int(os.environ.get("EDISTRIBUCION_LOTE_MAX_PETICIONES", "50000"))
+
+# Estados de un lote en disco
+LOTE_ENVIADO = "ENVIADO"      # Enviado a la Batch API, sin conciliar
+LOTE_APLICADO = "APLICADO"    # Resultados aplicados a las facturas
+LOTE_FALLIDO = "FALLIDO"      # El lote terminó sin completarse (fallido, expirado o cancelado)
+# Estados terminales de la Batch API
+ESTADOS_FINALES_API = ("completed", "failed", "expired", "cancelled")
+
+
+def id_peticion(factura: FacturaEndesaDistribucion) -> str | None:
+    """custom_id de la factura en el lote; None si la fila no tiene clave utilizable."""
+    if not factura.numero_factura or factura.numero_factura == "N/A" or factura.cups == "PENDIENTE":
+        return None
+    return f"{factura.cups}|{factura.numero_factura}"
+
+def marcar_pendiente_ocr(factura: FacturaEndesaDistribucion, nombre_lote: str | None = None):
+    """Aparca la factura a la espera del lote OCR, concatenándolo a los mensajes previos."""
+    prefijo = (factura.direccion_suministro + " | ") if factura.direccion_suministro else ""
+    detalle = f"lote {nombre_lote}" if nombre_lote else "en espera de envío por lotes"
+    factura.direccion_suministro = f"{prefijo}{ESTADO_PENDIENTE_OCR}: {detalle}"
+
+def quitar_marca_pendiente(factura: FacturaEndesaDistribucion):
+    """Retira la marca de lote pendiente, conservando los demás mensajes."""
+    partes = [p for p in (factura.direccion_suministro or "").split(" | ") if p and not p.startswith(ESTADO_PENDIENTE_OCR)]
+    factura.direccion_suministro = " | ".join(partes) or FacturaEndesaDistribucion.model_fields["direccion_suministro"].default
+
+
+class LoteOCR:
+    """
+    Alternativa al PipelineOCR para backfills: en lugar de una llamada a
+    `responses.create` por PDF, reúne las facturas de la ejecución que aún
+    necesitan el LLM (tras la caché y la extracción local) y al cerrar las
+    envía a la Batch API. Mientras el lote no se concilia, las facturas quedan
+    en estado PENDIENTE_OCR en el resultado y en el índice.
+    """
+    def __init__(self, progreso: ProgresoEjecucion | None = None):
+        self.progreso = progreso
+        # custom_id -> factura y datos para construir su petición
+        self.facturas: dict[str, FacturaEndesaDistribucion] = {}
+        self.peticiones: dict[str, dict] = {}
+        self.procesadas = 0
+        self.fallidas = 0
+        # Nombres de los lotes enviados (uno por cada MAX_PETICIONES_LOTE facturas) y sus custom_id
+        self.nombres: list[str] = []
+        self.enviadas: set[str] = set()
+
+    # --- Interfaz compartida con PipelineOCR ---
+
+    def iniciar(self):
+        return self
+
+    async def encolar(self, factura: FacturaEndesaDistribucion, ruta_pdf: str):
+        """Resuelve la factura sin LLM si es posible; si no, la aparca para el lote."""
+        try:
+            # La lectura del PDF es CPU: se hace fuera del event loop
+            with tramo("ocr", modo="lote") as t:
+                preparacion = await asyncio.to_thread(preparar_extraccion, factura, ruta_pdf)
+                t["resuelta"] = preparacion is None
+        except Exception as e:
+            self.fallidas += 1
+            marcar_error_ocr(factura, str(e))
+            escribir_log(f"        -> [ERROR] [LOTE OCR] Fallo al preparar {factura.numero_factura}: {e}")
+            self._actualizar_progreso()
+            return
+
+        custom_id = id_peticion(factura)
+        if preparacion is None:
+            self.procesadas += 1
+        elif custom_id is None:
+            # Sin clave no podríamos conciliar el resultado: OCR en línea
+            if await procesar_pdf_local_async(factura, ruta_pdf):
+                self.procesadas += 1
+            else:
+                self.fallidas += 1
+                marcar_error_ocr(factura)
+        elif custom_id not in self.peticiones:
+            clave_cache, campos, texto = preparacion
+            self.peticiones[custom_id] = {"ruta_pdf": ruta_pdf, "clave_cache": clave_cache, "campos": campos, "texto": texto}
+            self.facturas[custom_id] = factura
+            marcar_pendiente_ocr(factura)
+        self._actualizar_progreso()
+
+    def profundidad(self) -> int:
+        """Número de facturas aparcadas para el lote."""
+        return len(self.peticiones)
+
+    def pendiente(self, factura: FacturaEndesaDistribucion) -> bool:
+        # Las facturas aparcadas no bloquean el cierre de ventanas: se registran como PENDIENTE_OCR
+        return False
+
+    async def esperar(self, facturas: list[FacturaEndesaDistribucion]):
+        return
+
+    async def cerrar(self, esperar: bool = True):
+        """
+        Con esperar=True envía las facturas aparcadas. Si el envío falla, se
+        marcan con error de OCR (y se actualiza el índice) para reintentarlas.
+        """
+        if not esperar or not self.peticiones or self.nombres:
+            return
+        try:
+            await self.enviar()
+        except Exception as e:
+            escribir_log(f"[ERROR] [LOTE OCR] No se pudo enviar el lote: {e}")
+            # Las facturas de los lotes ya enviados siguen pendientes de conciliar
+            sin_enviar = [f for custom_id, f in self.facturas.items() if custom_id not in self.enviadas]
+            for factura in sin_enviar:
+                quitar_marca_pendiente(factura)
+                marcar_error_ocr(factura, f"Fallo al enviar el lote OCR: {e}")
+            self.fallidas += len(sin_enviar)
+        # El índice refleja el lote asignado a cada factura aparcada (o el error de envío)
+        obtener_indice().registrar_lote([(f, self.peticiones[custom_id]["ruta_pdf"]) for custom_id, f in self.facturas.items()])
+        self._actualizar_progreso()
+
+    def _actualizar_progreso(self):
+        if self.progreso is not None:
+            self.progreso.cola_ocr = len(self.peticiones)
+            self.progreso.ocr_completados = self.procesadas
+            self.progreso.ocr_fallidos = self.fallidas
+
+    # --- Envío y espera ---
+
+    async def enviar(self) -> list[str]:
+        """Escribe el JSONL de peticiones, lo sube y crea los lotes. Devuelve sus nombres."""
+        ids = list(self.peticiones)
+        for inicio in range(0, len(ids), MAX_PETICIONES_LOTE):
+            bloque = ids[inicio:inicio + MAX_PETICIONES_LOTE]
+            nombre = await self._enviar_bloque(bloque)
+            self.nombres.append(nombre)
+            self.enviadas.update(bloque)
+            for custom_id in bloque:
+                quitar_marca_pendiente(self.facturas[custom_id])
+                marcar_pendiente_ocr(self.facturas[custom_id], nombre)
+        return self.nombres
+
+    async def _enviar_bloque(self, ids: list[str]) -> str:
+        extractor = obtener_extractor()
+        nombre = f"lote_{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}"
+        os.makedirs(DIR_LOTES, exist_ok=True)
+        ruta_entrada = os.path.join(DIR_LOTES, f"{nombre}.jsonl")
+
+        archivos_pdf = []
+        try:
+            with open(ruta_entrada, "w", encoding="utf-8") as f:
+                for custom_id in ids:
+                    peticion = self.peticiones[custom_id]
+                    file_id = None
+                    if peticion["texto"] is None:
+                        # PDF sin capa de texto: se sube y la petición lo referencia por file_id
+                        file_id = await extractor.subir_archivo(peticion["ruta_pdf"])
+                        archivos_pdf.append(file_id)
+                    linea = {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": "/v1/responses",
+                        "body": construir_peticion(file_id, peticion["campos"], peticion["texto"]),
+                    }
+                    f.write(json.dumps(linea, ensure_ascii=False) + "\n")
+
+            id_entrada = await extractor.subir_archivo(ruta_entrada, proposito="batch")
+            lote = await extractor.crear_lote(id_entrada, VENTANA_LOTE)
+        except Exception:
+            for file_id in archivos_pdf:
+                await extractor.borrar_archivo(file_id)
+            raise
+
+        _guardar_estado({
+            "nombre": nombre,
+            "id_lote": lote.id,
+            "estado": LOTE_ENVIADO,
+            "estado_api": lote.status,
+            "creado_en": datetime.now().isoformat(timespec="seconds"),
+            "archivo_entrada": id_entrada,
+            "archivos_pdf": archivos_pdf,
+            "peticiones": {
+                custom_id: {
+                    "cups": self.facturas[custom_id].cups,
+                    "numero_factura": self.facturas[custom_id].numero_factura,
+                    "ruta_pdf": self.peticiones[custom_id]["ruta_pdf"],
+                    "clave_cache": self.peticiones[custom_id]["clave_cache"],
+                }
+                for custom_id in ids
+            },
+        })
+        escribir_log(f"[LOTE OCR] {nombre} enviado ({len(ids)} facturas, lote {lote.id}).")
+        return nombre
+
+    async def esperar_resultados(self, intervalo_s: float | None = None) -> list[dict]:
+        """Espera a que terminen los lotes enviados y aplica sus resultados a estas mismas facturas."""
+        return [await esperar_lote(nombre, intervalo_s, self.facturas) for nombre in self.nombres]
+
+
+# --- Estado de los lotes en disco ---
+
+def _ruta_estado(nombre: str) -> str:
+    return os.path.join(DIR_LOTES, f"{nombre}.json")
+
+def _cargar_estado(nombre: str) -> dict | None:
+    try:
+        with open(_ruta_estado(nombre), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _guardar_estado(estado: dict):
+    os.makedirs(DIR_LOTES, exist_ok=True)
+    temporal = _ruta_estado(estado["nombre"]) + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False)
+    os.replace(temporal, _ruta_estado(estado["nombre"]))
+
+def _resumen(estado: dict) -> dict:
+    return {clave: valor for clave, valor in estado.items() if clave not in ("peticiones", "archivos_pdf")} | {"facturas": len(estado["peticiones"])}
+
+def listar_lotes() -> list[dict]:
+    """Resumen de los lotes conocidos, del más reciente al más antiguo."""
+    if not os.path.isdir(DIR_LOTES):
+        return []
+    nombres = sorted((n[:-5] for n in os.listdir(DIR_LOTES) if n.endswith(".json")), reverse=True)
+    return [_resumen(estado) for estado in map(_cargar_estado, nombres) if estado is not None]
+
+
+# --- Conciliación ---
+
+# Evita aplicar dos veces un lote si el sondeo periódico y una consulta coinciden
+_lock_conciliacion = asyncio.Lock()
+
+def _texto_salida(cuerpo: dict) -> str:
+    """Equivalente a `output_text` del SDK sobre el cuerpo JSON de una respuesta."""
+    return "".join(
+        parte.get("text", "")
+        for elemento in cuerpo.get("output", []) if elemento.get("type") == "message"
+        for parte in elemento.get("content", []) if parte.get("type") == "output_text"
+    )
+
+def _resultado_linea(linea: dict) -> tuple[str | None, str | None]:
+    """(texto de salida, error) de una línea del archivo de salida o de errores del lote."""
+    respuesta = linea.get("response") or {}
+    if linea.get("error") or respuesta.get("status_code") != 200:
+        error = linea.get("error") or (respuesta.get("body") or {}).get("error") or f"HTTP {respuesta.get('status_code')}"
+        return None, str(error.get("message", error) if isinstance(error, dict) else error)
+    return _texto_salida(respuesta.get("body") or {}), None
+
+def _factura_del_indice(datos: dict) -> FacturaEndesaDistribucion | None:
+    """Factura aparcada en el índice; None si ya no está pendiente (p. ej. se reprocesó)."""
+    registro = obtener_indice().obtener(datos["cups"], datos["numero_factura"])
+    if not registro or registro["estado_proceso"] != ESTADO_PENDIENTE_OCR:
+        return None
+    return FacturaEndesaDistribucion.model_validate_json(registro["datos_json"])
+
+async def _conciliar(estado: dict, lote, facturas: dict[str, FacturaEndesaDistribucion] | None):
+    """Aplica los resultados del lote terminado a cada factura (por custom_id) y actualiza el índice."""
+    extractor = obtener_extractor()
+    resultados: dict[str, tuple[str | None, str | None]] = {}
+    for file_id in (lote.output_file_id, lote.error_file_id):
+        if not file_id:
+            continue
+        contenido = await extractor.descargar_archivo(file_id)
+        for linea in contenido.decode("utf-8").splitlines():
+            if linea.strip():
+                datos_linea = json.loads(linea)
+                resultados[datos_linea["custom_id"]] = _resultado_linea(datos_linea)
+
+    registros = []
+    aplicadas = fallidas = 0
+    for custom_id, datos in estado["peticiones"].items():
+        factura = (facturas or {}).get(custom_id) or _factura_del_indice(datos)
+        if factura is None:
+            continue
+        quitar_marca_pendiente(factura)
+        texto, error = resultados.get(custom_id, (None, f"Sin resultado en el lote ({lote.status})."))
+        try:
+            if error:
+                raise RuntimeError(error)
+            aplicar_respuesta(factura, texto, datos["clave_cache"])
+            aplicadas += 1
+        except Exception as e:
+            fallidas += 1
+            marcar_error_ocr(factura, str(e))
+        ruta_pdf = datos["ruta_pdf"]
+        registros.append((factura, ruta_pdf if os.path.exists(ruta_pdf) else None))
+
+    obtener_indice().registrar_lote(registros)
+    for file_id in estado["archivos_pdf"]:
+        await extractor.borrar_archivo(file_id)
+    # Los resultados cacheados por rango aún contienen las facturas aparcadas
+    obtener_cache_resultados().invalidar()
+
+    estado.update(
+        estado=LOTE_APLICADO if lote.status == "completed" else LOTE_FALLIDO,
+        aplicadas=aplicadas,
+        fallidas=fallidas,
+        conciliado_en=datetime.now().isoformat(timespec="seconds"),
+    )
+    escribir_log(f"[LOTE OCR] {estado['nombre']} conciliado ({lote.status}): {aplicadas} aplicadas, {fallidas} con error.")
+
+async def sondear_lote(nombre: str, facturas: dict[str, FacturaEndesaDistribucion] | None = None) -> dict | None:
+    """
+    Consulta una vez el estado del lote y, si ha terminado, concilia sus
+    resultados. Devuelve el resumen del lote, o None si no existe.
+    """
+    async with _lock_conciliacion:
+        estado = _cargar_estado(nombre)
+        if estado is None or estado["estado"] != LOTE_ENVIADO:
+            return _resumen(estado) if estado else None
+
+        lote = await obtener_extractor().consultar_lote(estado["id_lote"])
+        estado["estado_api"] = lote.status
+        conteo = getattr(lote, "request_counts", None)
+        if conteo is not None:
+            estado["progreso_api"] = {"total": conteo.total, "completadas": conteo.completed, "fallidas": conteo.failed}
+        if lote.status in ESTADOS_FINALES_API:
+            await _conciliar(estado, lote, facturas)
+        _guardar_estado(estado)
+        return _resumen(estado)
+
+async def esperar_lote(nombre: str, intervalo_s: float | None = None,
+                       facturas: dict[str, FacturaEndesaDistribucion] | None = None) -> dict | None:
+    """Sondea el lote hasta que termina y queda conciliado."""
+    intervalo_s = INTERVALO_SONDEO_LOTE_S if intervalo_s is None else intervalo_s
+    while True:
+        resumen = await sondear_lote(nombre, facturas)
+        if resumen is None or resumen["estado"] != LOTE_ENVIADO:
+            return resumen
+        await asyncio.sleep(intervalo_s)
+
+async def sondeo_periodico(intervalo_s: float | None = None):
+    """Tarea de fondo de la API: concilia los lotes enviados según van terminando."""
+    intervalo_s = INTERVALO_SONDEO_LOTE_S if intervalo_s is None else intervalo_s
+    while True:
+        for resumen in listar_lotes():
+            if resumen["estado"] != LOTE_ENVIADO:
+                continue
+            try:
+                await sondear_lote(resumen["nombre"])
+            except Exception as e:
+                escribir_log(f"[LOTE OCR] No se pudo consultar {resumen['nombre']}: {e}")
+        await asyncio.sleep(intervalo_s)
@@ -0,0 +1,168 @@
+import bisect
+import threading
+from typing import Callable
+from logs import suscribir_tramos
+
+# --- CONFIGURACIÓN DE LAS MÉTRICAS ---
+# Cubetas (segundos) de los histogramas de duración por etapa
+CUBETAS_ETAPAS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Causas de error_RPA (prefijo del mensaje anotado en la factura)
+CAUSAS_ERROR = ("TIMEOUT", "FALLO_DESCARGA", "NO_DISPONIBLE", "ERROR_ESTRUCTURA_TABLA", "OCR")
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _etiquetas(nombres: tuple[str, ...], valores: tuple, extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+def _numero(valor: float) -> str:
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._lock = threading.Lock()
+
+    def _clave(self, valores: dict) -> tuple:
+        return tuple(valores.get(e, "") for e in self.etiquetas)
+
+    def exportar(self) -> list[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"] + self._muestras()
+
+    def _muestras(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Contador(_Metrica):
+    """Contador monótono, opcionalmente con etiquetas."""
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = ()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.valores: dict[tuple, float] = {}
+
+    def inc(self, cantidad: float = 1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self.valores[clave] = self.valores.get(clave, 0) + cantidad
+
+    def _muestras(self) -> list[str]:
+        with self._lock:
+            valores = dict(self.valores)
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(v)}" for clave, v in sorted(valores.items())]
+
+
+class Histograma(_Metrica):
+    """Histograma de cubetas fijas: observar solo busca la cubeta y suma."""
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, cubetas: tuple[float, ...], etiquetas: tuple[str, ...] = ()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.cubetas = tuple(sorted(cubetas))
+        # Por serie: [conteo por cubeta (no acumulado, la última es +Inf), suma]
+        self.series: dict[tuple, list] = {}
+
+    def observar(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        posicion = bisect.bisect_left(self.cubetas, valor)
+        with self._lock:
+            serie = self.series.get(clave)
+            if serie is None:
+                serie = self.series[clave] = [[0] * (len(self.cubetas) + 1), 0.0]
+            serie[0][posicion] += 1
+            serie[1] += valor
+
+    def _muestras(self) -> list[str]:
+        with self._lock:
+            series = {clave: (list(conteos), suma) for clave, (conteos, suma) in self.series.items()}
+        lineas = []
+        for clave, (conteos, suma) in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.cubetas + (float("inf"),), conteos):
+                acumulado += conteo
+                le = 'le="+Inf"' if limite == float("inf") else f'le="{_numero(limite)}"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_numero(round(suma, 6))}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {acumulado}")
+        return lineas
+
+
+class Indicador(_Metrica):
+    """Gauge calculado al exportar: no cuesta nada mientras nadie consulta /metrics."""
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, funcion: Callable[[], float]):
+        super().__init__(nombre, ayuda)
+        self.funcion = funcion
+
+    def _muestras(self) -> list[str]:
+        try:
+            return [f"{self.nombre} {_numero(self.funcion())}"]
+        except Exception:
+            # Un indicador que falla no debe romper el resto de la exportación
+            return []
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self.metricas: dict[str, _Metrica] = {}
+
+    def registrar(self, metrica: _Metrica) -> _Metrica:
+        # Idempotente: al recargar un módulo se reutiliza la métrica ya registrada
+        return self.metricas.setdefault(metrica.nombre, metrica)
+
+    def exportar(self) -> str:
+        """Todas las métricas en el formato de texto de Prometheus (0.0.4)."""
+        lineas = []
+        for metrica in self.metricas.values():
+            lineas.extend(metrica.exportar())
+        return "\n".join(lineas) + "\n"
+
+
+_registro = RegistroMetricas()
+
+def obtener_registro_metricas() -> RegistroMetricas:
+    return _registro
+
+def registrar_indicador(nombre: str, ayuda: str, funcion: Callable[[], float]) -> Indicador:
+    return _registro.registrar(Indicador(nombre, ayuda, funcion))
+
+
+# --- Métricas del robot y del pipeline OCR ---
+
+DURACION_ETAPAS: Histograma = _registro.registrar(Histograma(
+    "edistribucion_etapa_duracion_segundos",
+    "Duración de cada etapa: login, cambio_rol, filtro, lectura_tabla, lectura_fila, descarga, ocr.",
+    CUBETAS_ETAPAS, ("etapa",),
+))
+FACTURAS_PROCESADAS: Contador = _registro.registrar(Contador(
+    "edistribucion_facturas_procesadas_total", "Facturas registradas al cerrar su ventana, por estado de proceso.", ("estado",)
+))
+ERRORES_RPA: Contador = _registro.registrar(Contador(
+    "edistribucion_errores_rpa_total", "Facturas marcadas con error_RPA, por causa.", ("causa",)
+))
+INTENTOS_LOGIN: Contador = _registro.registrar(Contador(
+    "edistribucion_intentos_login_total", "Intentos de login en el portal, por resultado.", ("resultado",)
+))
+
+
+def contar_error_rpa(mensaje: str):
+    """Cuenta un error_RPA por la causa que encabeza su mensaje (OTRO si no se reconoce)."""
+    causa = next((c for c in CAUSAS_ERROR if str(mensaje).startswith(c)), "OTRO")
+    ERRORES_RPA.inc(causa=causa)
+
+def _observar_tramo(nombre: str, segundos: float):
+    DURACION_ETAPAS.observar(segundos, etapa=nombre)
+
+# Los tramos medidos en logs.tramo alimentan los histogramas
+suscribir_tramos(_observar_tramo)
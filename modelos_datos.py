@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional # Usamos Optional para los campos que pueden ser None
+from typing import Optional, List # Usamos Optional para los campos que pueden ser None
 
 # Reemplazamos @dataclass por herencia de BaseModel
 class FacturaEndesaDistribucion(BaseModel):
@@ -69,4 +69,50 @@ class FacturaEndesaDistribucion(BaseModel):
 
     fecha_de_cobro_en_banco: Optional[str] = None
     
-   
\ No newline at end of file
+   
+
+class ProgresoEjecucion(BaseModel):
+    """
+    Progreso de una ejecución del robot. Se actualiza en vivo durante el
+    proceso RPA y se expone en la API de trabajos.
+    """
+    # Identificador en el diario de ejecuciones (para retomarla si se interrumpe)
+    id_ejecucion: Optional[str] = None
+    roles_totales: int = 0
+    roles_completados: int = 0
+    ventanas_totales: int = 0
+    ventanas_completadas: int = 0
+    filas_procesadas: int = 0
+    cola_ocr: int = 0
+    ocr_completados: int = 0
+    ocr_fallidos: int = 0
+    # Facturas de los roles ya leídos (los datos OCR se completan a medida que termina la cola)
+    facturas: List[FacturaEndesaDistribucion] = []
+
+
+class EstadoTrabajo(BaseModel):
+    """Estado de un trabajo asíncrono de extracción (POST /jobs)."""
+    id: str
+    estado: str
+    fecha_desde: str
+    fecha_hasta: str
+    incremental: bool = False
+    # Cuenta del portal (None = la cuenta por defecto)
+    cuenta: Optional[str] = None
+    creado_en: str
+    iniciado_en: Optional[str] = None
+    finalizado_en: Optional[str] = None
+    error: Optional[str] = None
+    progreso: ProgresoEjecucion
+
+
+class ClaveFactura(BaseModel):
+    """Identifica una factura por su CUPS y su número."""
+    cups: str
+    numero_factura: str
+
+
+class PeticionReintento(BaseModel):
+    """Facturas a reintentar (POST /facturas/retry): las de una ejecución, una lista explícita o ambas."""
+    id_ejecucion: Optional[str] = None
+    facturas: List[ClaveFactura] = []
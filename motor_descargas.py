@@ -0,0 +1,219 @@
+import os
+import asyncio
+import random
+import hashlib
+from urllib.parse import quote, unquote, urlsplit, urlunsplit
+from playwright.async_api import Page, Locator, Response, TimeoutError
+from modelos_datos import FacturaEndesaDistribucion
+from logs import escribir_log
+
+# --- CONFIGURACIÓN DEL MOTOR DE DESCARGAS ---
+DESCARGAS_CONCURRENTES = int(os.environ.get("EDISTRIBUCION_DESCARGAS_CONCURRENTES", "6"))
+REINTENTOS_DESCARGA = int(os.environ.get("EDISTRIBUCION_DESCARGA_REINTENTOS", "3"))
+TIMEOUT_DESCARGA_MS = 30000
+TIMEOUT_CLIC_MS = 5000
+
+
+def _escribir_archivo(ruta: str, contenido: bytes):
+    # Escritura atómica: el PDF nunca queda a medias si el proceso se interrumpe
+    ruta_tmp = f"{ruta}.part"
+    with open(ruta_tmp, "wb") as f:
+        f.write(contenido)
+    os.replace(ruta_tmp, ruta)
+
+
+def _marcar(partes: list[str], separador: str, valor: str, marcador: str) -> tuple[str, int]:
+    """
+    Sustituye por `marcador` las partes (segmentos de ruta o pares clave=valor)
+    cuyo valor decodificado es exactamente `valor`. Devuelve el texto y cuántas cambió.
+    """
+    cambiadas = 0
+    resultado = []
+    for parte in partes:
+        clave, igual, contenido = parte.partition("=") if separador == "&" else ("", "", parte)
+        if unquote(contenido) == valor:
+            parte = f"{clave}{igual}{marcador}"
+            cambiadas += 1
+        resultado.append(parte)
+    return separador.join(resultado), cambiadas
+
+def _plantilla_desde_url(url: str, factura: FacturaEndesaDistribucion) -> str | None:
+    """
+    Plantilla de la URL del documento con {numero_factura} (y {cups}, si
+    aparece) en lugar de los valores de la factura. Solo se aceptan como
+    marcadores un segmento completo de la ruta o un valor completo de la
+    query, y el número debe aparecer una única vez: una coincidencia parcial
+    (host, ids de registro, otros parámetros) haría pedir el PDF de otra factura.
+    """
+    partes = urlsplit(url)
+    # Las llaves propias de la URL se escapan antes de insertar los marcadores de format()
+    ruta = partes.path.replace("{", "{{").replace("}", "}}")
+    query = partes.query.replace("{", "{{").replace("}", "}}")
+    marcadas = {}
+    for campo, valor in (("numero_factura", factura.numero_factura), ("cups", factura.cups)):
+        if not valor or valor in ("N/A", "PENDIENTE"):
+            continue
+        ruta, en_ruta = _marcar(ruta.split("/"), "/", valor, f"{{{campo}}}")
+        query, en_query = _marcar(query.split("&"), "&", valor, f"{{{campo}}}") if query else (query, 0)
+        marcadas[campo] = en_ruta + en_query
+    if marcadas.get("numero_factura") != 1 or marcadas.get("cups", 0) > 1:
+        return None
+    base = urlunsplit((partes.scheme, partes.netloc, "", "", "")).replace("{", "{{").replace("}", "}}")
+    return base + ruta + (f"?{query}" if query else "")
+
+def _rellenar_plantilla(plantilla: str, factura: FacturaEndesaDistribucion) -> str:
+    return plantilla.format(
+        numero_factura=quote(factura.numero_factura, safe=""),
+        cups=quote(factura.cups, safe=""),
+    )
+
+
+class MotorDescargas:
+    """
+    Descarga los PDF de las facturas de una página.
+
+    La primera descarga se hace con el clic en `button[name="PDF"]` para
+    descubrir la petición real del documento. Si el número de factura es
+    exactamente un segmento de la ruta o un valor de la query de su URL, esta
+    se convierte en plantilla candidata. La plantilla solo se activa si, para
+    esa misma factura, la petición directa devuelve un PDF idéntico (sha256)
+    al descargado por clic. Entonces el resto de PDF se piden directamente
+    con el APIRequestContext del contexto (mismas cookies de sesión), en
+    paralelo y con reintentos. Si no hay plantilla, o la petición directa
+    falla, se vuelve al clic.
+    """
+    def __init__(self, page: Page, concurrencia: int | None = None, reintentos: int | None = None):
+        self.page = page
+        self.semaforo = asyncio.Semaphore(max(1, concurrencia or DESCARGAS_CONCURRENTES))
+        self.reintentos = REINTENTOS_DESCARGA if reintentos is None else reintentos
+        # Los clics comparten la página: se serializan para no mezclar descargas
+        self._lock_clic = asyncio.Lock()
+        self.descubierto = False
+        self.plantilla_url: str | None = None
+        self.directas = 0
+        self.por_clic = 0
+
+    @property
+    def modo_directo(self) -> bool:
+        return self.plantilla_url is not None
+
+    # --- Descarga por clic (vía clásica) ---
+
+    async def descargar_con_clic(self, fila: Locator, factura: FacturaEndesaDistribucion, ruta_destino: str) -> str | None:
+        """
+        Descarga el PDF haciendo clic en el botón de la fila.
+        Devuelve None si la fila no tiene botón PDF.
+        """
+        # En Edistribución el botón se identifica por name="PDF"
+        button_locator = fila.locator('button[name="PDF"]')
+        
+        if await button_locator.count() == 0:
+            return None
+
+        respuestas_pdf: list[Response] = []
+        def _capturar(respuesta: Response):
+            cabeceras = respuesta.headers
+            if "application/pdf" in cabeceras.get("content-type", "") or "attachment" in cabeceras.get("content-disposition", ""):
+                respuestas_pdf.append(respuesta)
+
+        try:
+            async with self._lock_clic:
+                if not self.descubierto:
+                    self.page.on("response", _capturar)
+                try:
+                    async with self.page.expect_download(timeout=TIMEOUT_CLIC_MS) as download_info:
+                        await button_locator.click(timeout=TIMEOUT_CLIC_MS)
+                    download = await download_info.value
+                    await download.save_as(ruta_destino)
+                finally:
+                    if not self.descubierto:
+                        self.page.remove_listener("response", _capturar)
+
+                self.por_clic += 1
+                if not self.descubierto:
+                    url = download.url
+                    if not url.startswith("http") and respuestas_pdf:
+                        # blob:/data: -> usamos la petición HTTP que sirvió el documento
+                        url = respuestas_pdf[-1].url
+                    # Bajo el lock: ningún otro clic vuelve a intentar el descubrimiento mientras se valida
+                    await self._descubrir_plantilla(url, factura, ruta_destino)
+
+            escribir_log(f"    -> [OK] [DESCARGA PDF] Guardado en: {ruta_destino}")
+            return ruta_destino
+        
+        except TimeoutError:
+            raise Exception("TIMEOUT: El botón PDF no respondió o no es visible.")
+            
+        except Exception as e:
+            escribir_log(f"   -> [ERROR PDF] Fallo inesperado en la descarga")
+            error_limpio = str(e).split('\n')[0]
+            raise Exception(f"FALLO_DESCARGA: {error_limpio}")
+
+    async def _descubrir_plantilla(self, url: str, factura: FacturaEndesaDistribucion, ruta_pdf: str):
+        """
+        Convierte la URL del primer documento en plantilla, si identifica la
+        factura, y la activa solo si reproduce exactamente el PDF descargado.
+        """
+        self.descubierto = True
+        plantilla = _plantilla_desde_url(url, factura) if url.startswith("http") else None
+        if plantilla is None:
+            escribir_log(f"    -> [DESCARGA] No se pudo deducir la URL directa del PDF. Se mantiene la descarga por clic.")
+            return
+        try:
+            respuesta = await self.page.context.request.get(_rellenar_plantilla(plantilla, factura), timeout=TIMEOUT_DESCARGA_MS)
+            cuerpo = await respuesta.body()
+            with open(ruta_pdf, "rb") as f:
+                esperado = hashlib.sha256(f.read()).hexdigest()
+            valida = respuesta.ok and hashlib.sha256(cuerpo).hexdigest() == esperado
+        except Exception as e:
+            escribir_log(f"    -> [DESCARGA] No se pudo validar la URL directa del PDF ({str(e).splitlines()[0]}). Se mantiene la descarga por clic.")
+            return
+        if not valida:
+            # Otra factura, otra sesión o un PDF regenerado en cada petición: no nos fiamos de la plantilla
+            escribir_log(f"    -> [DESCARGA] La URL directa no devuelve el mismo PDF que el clic. Se mantiene la descarga por clic.")
+            return
+        self.plantilla_url = plantilla
+        escribir_log(f"    -> [DESCARGA] Petición directa del documento validada. Descargas en paralelo activadas.")
+
+    # --- Descarga directa por HTTP ---
+
+    async def _descargar_directo(self, factura: FacturaEndesaDistribucion, ruta_destino: str) -> str:
+        url = _rellenar_plantilla(self.plantilla_url, factura)
+        ultimo_error = None
+        for intento in range(self.reintentos + 1):
+            try:
+                respuesta = await self.page.context.request.get(url, timeout=TIMEOUT_DESCARGA_MS)
+                cuerpo = await respuesta.body()
+                if not respuesta.ok:
+                    raise Exception(f"HTTP {respuesta.status}")
+                if not cuerpo.startswith(b"%PDF"):
+                    raise Exception("La respuesta no es un PDF (¿sesión caducada?)")
+                await asyncio.to_thread(_escribir_archivo, ruta_destino, cuerpo)
+                self.directas += 1
+                return ruta_destino
+            except Exception as e:
+                ultimo_error = e
+                if intento < self.reintentos:
+                    await asyncio.sleep(random.uniform(0, 0.5 * (2 ** intento)))
+        raise Exception(f"FALLO_DESCARGA: {str(ultimo_error).splitlines()[0]}")
+
+    async def descargar(self, fila: Locator, factura: FacturaEndesaDistribucion, ruta_destino: str) -> str | None:
+        """
+        Descarga el PDF de la factura por la vía más rápida disponible.
+        Lanza excepción (TIMEOUT / FALLO_DESCARGA) si no se pudo descargar.
+        """
+        if not self.modo_directo:
+            return await self.descargar_con_clic(fila, factura, ruta_destino)
+
+        async with self.semaforo:
+            try:
+                ruta = await self._descargar_directo(factura, ruta_destino)
+                escribir_log(f"    -> [OK] [DESCARGA PDF] Guardado en: {ruta}")
+                return ruta
+            except Exception as e:
+                error_directo = e
+                escribir_log(f"    -> [!] [DESCARGA] Descarga directa fallida para {factura.numero_factura} ({e}). Reintentando por clic.")
+        if await fila.count() == 0:
+            # La fila ya no está en la tabla (cambió de página): no hay clic posible, es un fallo de descarga y no NO_DISPONIBLE
+            raise Exception(str(error_directo) if str(error_directo).startswith("FALLO_DESCARGA") else f"FALLO_DESCARGA: {error_directo}")
+        return await self.descargar_con_clic(fila, factura, ruta_destino)
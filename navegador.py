@@ -1,24 +1,62 @@
 from playwright.async_api import async_playwright, Playwright, Browser, Page, BrowserContext # Importamos las clases para mejor tipado
 import asyncio # Necesario para ejecutar funciones asíncronas
 import os # Necesario para gestionar directorios
+import weakref
+from playwright.async_api import Route
 
 # Directorio raíz donde Playwright guardará temporalmente los archivos.
 TEMP_DOWNLOAD_ROOT = "temp_endesa_downloads" 
 
+# --- MODO RÁPIDO ---
+# Sin imágenes, fuentes ni analítica, y esperas por condiciones concretas en lugar de "networkidle"
+MODO_RAPIDO = os.environ.get("EDISTRIBUCION_MODO_RAPIDO", "0") == "1"
+# Tipos de recurso que el robot nunca necesita (las hojas de estilo se mantienen: la visibilidad depende de ellas)
+RECURSOS_BLOQUEADOS = {"image", "media", "font"}
+# Fragmentos de URL de scripts de analítica y publicidad
+PATRONES_ANALITICA = ("google-analytics", "googletagmanager", "doubleclick", "hotjar", "/analytics")
+
+# Contextos creados en modo rápido: los helpers del flujo consultan el modo a partir de la página
+_contextos_rapidos: weakref.WeakSet = weakref.WeakSet()
+
+def es_modo_rapido(page: Page) -> bool:
+    """True si la página pertenece a un contexto abierto en modo rápido."""
+    return page.context in _contextos_rapidos
+
+async def _filtrar_recurso(route: Route):
+    peticion = route.request
+    if peticion.resource_type in RECURSOS_BLOQUEADOS or any(p in peticion.url for p in PATRONES_ANALITICA):
+        await route.abort()
+    else:
+        await route.continue_()
+
 class NavegadorAsync:
     """
     Clase que encapsula la inicialización, uso y cierre de una sesión 
     de Playwright Asíncrona.
+    Con modo_rapido=True sus contextos descartan imágenes, fuentes y
+    analítica, y los helpers del flujo esperan por condiciones concretas.
     """
-    def __init__(self):
+    def __init__(self, modo_rapido: bool | None = None):
+        self.modo_rapido = MODO_RAPIDO if modo_rapido is None else modo_rapido
         self.playwright: Playwright | None = None
         self.browser: Browser | None = None
         self.page: Page | None = None
         self.context: BrowserContext | None = None
+        # Contextos adicionales entregados a los trabajadores en paralelo
+        self.contextos_extra: list[BrowserContext] = []
+        # False si el navegador pertenece a un pool y no debe cerrarse aquí
+        self.propietario = True
         
         # Aseguramos que el directorio exista
         os.makedirs(TEMP_DOWNLOAD_ROOT, exist_ok=True)
 
+    async def _preparar_contexto(self, contexto: BrowserContext) -> BrowserContext:
+        """Aplica el modo rápido (si está activo) a un contexto recién creado."""
+        if self.modo_rapido:
+            await contexto.route("**/*", _filtrar_recurso)
+            _contextos_rapidos.add(contexto)
+        return contexto
+
     async def iniciar(self):
         """Inicializa la sesión de Playwright y lanza el navegador."""
         self.playwright = await async_playwright().start()
@@ -32,10 +70,43 @@ class NavegadorAsync:
             # Nota: Playwright usará su propia ubicación temporal, pero al usar save_as, 
             # podemos definir la ruta absoluta localmente.
         )
+        await self._preparar_contexto(self.context)
         self.page = await self.context.new_page()
         
         return self 
 
+    async def iniciar_en_navegador(self, browser: Browser, storage_state: dict | None = None):
+        """
+        Abre un contexto y una página sobre un navegador ya lanzado (p. ej. por
+        un pool), opcionalmente restaurando una sesión guardada.
+        """
+        self.browser = browser
+        self.propietario = False
+        self.context = await browser.new_context(
+            accept_downloads=True,
+            storage_state=storage_state,
+        )
+        await self._preparar_contexto(self.context)
+        self.page = await self.context.new_page()
+        return self
+
+    async def nuevo_contexto(self) -> BrowserContext:
+        """
+        Crea un contexto adicional en el mismo navegador que comparte el estado
+        de sesión (cookies y localStorage) del contexto principal ya autenticado.
+        """
+        if not self.browser or not self.context:
+            raise RuntimeError("El navegador no ha sido inicializado. Ejecute 'iniciar()' primero.")
+
+        estado_sesion = await self.context.storage_state()
+        contexto = await self.browser.new_context(
+            accept_downloads=True,
+            storage_state=estado_sesion,
+        )
+        await self._preparar_contexto(contexto)
+        self.contextos_extra.append(contexto)
+        return contexto
+
     async def goto_url(self, url: str, timeout_ms: int = 60000) -> Page:
         """
         Navega a la URL especificada. 
@@ -48,8 +119,26 @@ class NavegadorAsync:
         ) 
         return self.page
 
+    async def cerrar_contextos_extra(self):
+        """Cierra los contextos adicionales entregados a los trabajadores."""
+        for contexto in self.contextos_extra:
+            try:
+                await contexto.close()
+            except Exception:
+                pass
+        self.contextos_extra = []
+
     async def cerrar(self):
         """Cierra el navegador y detiene el contexto de Playwright de forma segura."""
+        await self.cerrar_contextos_extra()
+        if not self.propietario:
+            # El navegador es compartido: solo cerramos nuestro contexto
+            if self.context:
+                try:
+                    await self.context.close()
+                except Exception:
+                    pass
+            return
         if self.browser:
             await self.browser.close()
         if self.playwright:
@@ -60,4 +149,4 @@ class NavegadorAsync:
         """Devuelve el objeto Page actual para su uso por el robot."""
         if not self.page:
             raise RuntimeError("El navegador no ha sido inicializado. Ejecute 'iniciar()' primero.")
-        return self.page
\ No newline at end of file
+        return self.page
@@ -1,137 +1,300 @@
 import os
 import json
+import asyncio
 from logs import escribir_log
 from openai import OpenAI
 from modelos_datos import FacturaEndesaDistribucion
+from extractor_openai import obtener_extractor
+from cache_ocr import obtener_cache, hash_texto
+from extractor_local import extraer_local, leer_paginas, texto_relevante
 from datetime import datetime
+from functools import lru_cache
 
-def procesar_pdf_local(factura_obj: FacturaEndesaDistribucion, ruta_pdf: str) -> bool:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        print("[ERROR] No se encontró la variable de entorno OPENAI_API_KEY")
-        return False
+# --- CONFIGURACIÓN DEL MODELO ---
+MODELO_OCR = "gpt-4o"
+RUTA_PROMPT = "prompt_distribucion.txt"
+# Envío en línea del texto de las páginas relevantes (1) o subida del PDF completo (0).
+# Los PDF sin capa de texto se suben siempre como archivo.
+ENVIO_TEXTO = os.environ.get("EDISTRIBUCION_OCR_TEXTO", "1") == "1"
 
-    client = OpenAI(api_key=api_key)
-    file_id = None
 
+@lru_cache(maxsize=None)
+def _esquema_estricto_json(campos: tuple[str, ...] | None = None) -> str:
+    """Esquema estricto serializado: se cachea como texto para que nadie pueda modificar la copia compartida."""
+    return json.dumps(_generar_esquema_estricto(campos))
+
+def _construir_esquema_estricto(campos: tuple[str, ...] | None = None) -> dict:
+    """Esquema estricto como un dict nuevo en cada llamada (se incrusta en el cuerpo de cada petición)."""
+    return json.loads(_esquema_estricto_json(campos))
+
+def _generar_esquema_estricto(campos: tuple[str, ...] | None = None) -> dict:
+    """
+    Genera el esquema JSON del modelo compatible con Strict Mode de OpenAI.
+    Con `campos`, el esquema se limita a esos campos (los que la extracción
+    local no pudo resolver).
+    """
+    esquema_pydantic = FacturaEndesaDistribucion.model_json_schema()
+    if campos:
+        esquema_pydantic["properties"] = {c: esquema_pydantic["properties"][c] for c in campos}
+
+    # SOLUCIÓN AL ERROR: 
+    # 1. Forzar additionalProperties a False
+    # 2. Poner TODOS los campos de 'properties' dentro de 'required'
+    esquema_pydantic["additionalProperties"] = False
+    esquema_pydantic["required"] = list(esquema_pydantic["properties"].keys())
+    return esquema_pydantic
+
+@lru_cache(maxsize=1)
+def _cargar_prompt() -> str:
+    with open(RUTA_PROMPT, "r", encoding="utf-8") as f:
+        return f.read()
+
+def huella_extraccion(campos: tuple[str, ...] | None = None) -> str:
+    """
+    Huella de la configuración de extracción (prompt, esquema, modelo y modo de envío).
+    Forma parte de la clave de caché: si cambia, las entradas antiguas dejan de usarse.
+    """
+    # ENVIO_TEXTO se lee en cada llamada: los benchmarks lo cambian en caliente
+    return _huella(campos, ENVIO_TEXTO)
+
+@lru_cache(maxsize=None)
+def _huella(campos: tuple[str, ...] | None, envio_texto: bool) -> str:
+    esquema = json.dumps(FacturaEndesaDistribucion.model_json_schema(), sort_keys=True)
+    # Las extracciones parciales (solo algunos campos) no se mezclan con las completas
+    sufijo = f"\n{','.join(campos)}" if campos else ""
+    # Ni las hechas con el texto en línea con las del PDF completo
+    modo = "texto" if envio_texto else "archivo"
+    return hash_texto(f"{MODELO_OCR}\n{modo}\n{_cargar_prompt()}\n{esquema}{sufijo}")
+
+def _consultar_cache(factura_obj: FacturaEndesaDistribucion, ruta_pdf: str, campos: tuple[str, ...] | None = None) -> tuple[str | None, bool]:
+    """
+    Busca la extracción del PDF en la caché. Si existe, la aplica a la factura.
+    Devuelve (clave, acierto); la clave es None si no se pudo calcular.
+    """
     try:
-        # 1. Preparar esquema dinámico compatible con Strict Mode
-        esquema_pydantic = FacturaEndesaDistribucion.model_json_schema()
-        
-        # SOLUCIÓN AL ERROR: 
-        # 1. Forzar additionalProperties a False
-        # 2. Poner TODOS los campos de 'properties' dentro de 'required'
-        esquema_pydantic["additionalProperties"] = False
-        esquema_pydantic["required"] = list(esquema_pydantic["properties"].keys())
-
-        # 2. Cargar prompt y subir archivo (se asume que existen)
-        with open("prompt_distribucion.txt", "r", encoding="utf-8") as f:
-            prompt_text = f.read()
-
-        with open(ruta_pdf, "rb") as f:
-            file_upload = client.files.create(file=f, purpose="assistants")
-            file_id = file_upload.id
-
-        # 3. Llamada a la API
-        response = client.responses.create(
-            model="gpt-4o",
-            input=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "input_file", "file_id": file_id},
-                        {"type": "input_text", "text": prompt_text}
-                    ]
-                }
-            ],
-            text={
-                "format": {
-                    "type": "json_schema",
-                    "name": "extraccion_factura_electrica",
-                    "strict": True,
-                    "schema": esquema_pydantic
-                }
+        cache = obtener_cache()
+        clave = cache.calcular_clave(ruta_pdf, huella_extraccion(campos))
+        datos_cacheados = cache.obtener(clave)
+    except Exception as e:
+        escribir_log(f"[CACHE OCR] No se pudo consultar la caché: {e}")
+        return None, False
+
+    if datos_cacheados is None:
+        return clave, False
+
+    aplicar_datos_extraidos(factura_obj, datos_cacheados)
+    escribir_log(f"        -> [CACHE OCR] Extracción reutilizada para {factura_obj.numero_factura}")
+    return clave, True
+
+def _guardar_en_cache(clave: str | None, datos_extraidos: dict):
+    if not clave:
+        return
+    try:
+        obtener_cache().guardar(clave, datos_extraidos)
+    except Exception as e:
+        escribir_log(f"[CACHE OCR] No se pudo guardar en la caché: {e}")
+
+def _extraccion_local(factura_obj: FacturaEndesaDistribucion, paginas: list[str] | None) -> tuple[str, ...] | None:
+    """
+    Extrae localmente los campos del texto del PDF y aplica los fiables.
+    Devuelve los campos que aún debe resolver el LLM: () si no hace falta
+    llamarlo, o None si no hubo extracción local (el LLM extrae todo).
+    """
+    resultado = extraer_local(factura_obj, paginas)
+    if resultado is None:
+        return None
+    pendientes = tuple(resultado.campos_pendientes())
+    if not pendientes:
+        aplicar_datos_extraidos(factura_obj, resultado.datos)
+        escribir_log(f"        -> [OCR LOCAL] Extracción local completa para {factura_obj.numero_factura}. Se omite el LLM.")
+        return ()
+    aplicar_datos_extraidos(factura_obj, resultado.fiables())
+    escribir_log(f"        -> [OCR LOCAL] {factura_obj.numero_factura}: {len(pendientes)} campos pendientes para el LLM.")
+    return pendientes
+
+def construir_peticion(file_id: str | None = None, campos: tuple[str, ...] | None = None, texto: str | None = None) -> dict:
+    """
+    Construye los argumentos de `responses.create`: con el texto de las
+    páginas relevantes en línea o, si no lo hay, con un PDF ya subido.
+    Se comparte entre el cliente síncrono y el extractor asíncrono.
+    """
+    if texto is not None:
+        # Instrucciones primero: prefijo estable entre facturas
+        contenido = [
+            {"type": "input_text", "text": _cargar_prompt()},
+            {"type": "input_text", "text": f"TEXTO EXTRAÍDO DE LA FACTURA (páginas con datos de facturación y pago):\n\n{texto}"},
+        ]
+    else:
+        contenido = [
+            {"type": "input_file", "file_id": file_id},
+            {"type": "input_text", "text": _cargar_prompt()},
+        ]
+    return {
+        "model": MODELO_OCR,
+        "input": [
+            {
+                "role": "user",
+                "content": contenido
+            }
+        ],
+        "text": {
+            "format": {
+                "type": "json_schema",
+                "name": "extraccion_factura_electrica",
+                "strict": True,
+                "schema": _construir_esquema_estricto(campos)
             }
-        )
+        }
+    }
 
-        # 4. Mezcla inteligente de datos
-        datos_extraidos = json.loads(response.output_text)
+def estimar_tokens(texto: str, campos: tuple[str, ...] | None = None) -> int:
+    """Estimación (~4 caracteres por token) para reservar cuota antes de la llamada."""
+    esquema = _esquema_estricto_json(campos)
+    return (len(_cargar_prompt()) + len(texto) + len(esquema)) // 4 + 1000
 
-        for campo, valor_ocr in datos_extraidos.items():
-            # Saltamos si el OCR no devolvió nada útil
-            if valor_ocr is None or str(valor_ocr).lower() == "null" or valor_ocr == "":
-                # escribir_log(
-                #         f"\t->[!] Valor no extraido {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
-                #         f"Valor: '{valor_ocr}'"
-                #     )
-                continue
+def _texto_para_llm(paginas: list[str] | None) -> str | None:
+    if not ENVIO_TEXTO or not paginas:
+        return None
+    return texto_relevante(paginas)
 
-            # Obtenemos el valor que tiene el objeto actualmente
-            valor_actual = getattr(factura_obj, campo)
-            
-            # Obtenemos el valor por defecto definido en el modelo Pydantic para ese campo
-            valor_por_defecto = FacturaEndesaDistribucion.model_fields[campo].default
+def aplicar_datos_extraidos(factura_obj: FacturaEndesaDistribucion, datos_extraidos: dict):
+    """
+    Mezcla los datos devueltos por el modelo con la factura y aplica el
+    post-procesamiento (mes facturado, número de días e importes agregados).
+    """
+    # 4. Mezcla inteligente de datos
+    for campo, valor_ocr in datos_extraidos.items():
+        # Saltamos si el OCR no devolvió nada útil
+        if valor_ocr is None or str(valor_ocr).lower() == "null" or valor_ocr == "":
+            # escribir_log(
+            #         f"\t->[!] Valor no extraido {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
+            #         f"Valor: '{valor_ocr}'"
+            #     )
+            continue
 
-            # CASO A: El objeto tiene el valor por defecto (no ha sido registrado aún)
-            if valor_actual == valor_por_defecto:
-                setattr(factura_obj, campo, valor_ocr)
-                # escribir_log(
-                #         f"\t->[OK] Valor incluido {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
-                #         f"Valor Incluido: '{valor_ocr}'"
-                #     )
-            
-            # CASO B: El objeto YA tiene un valor distinto al por defecto
-            else:
-                # Comparamos si el valor extraído coincide con el que ya teníamos
-                if valor_actual != valor_ocr:
-                    # escribir_log(
-                    #     f"\t->[!] Discrepancia en Factura {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
-                    #     f"Valor en Objeto: '{valor_actual}' VS Valor OCR: '{valor_ocr}'"
-                    # )
-                    # Opcional: Aquí podrías decidir si sobreescribir o no. 
-                    # Por ahora, mantenemos el valor del objeto y solo avisamos.
-                    pass
+        # Obtenemos el valor que tiene el objeto actualmente
+        valor_actual = getattr(factura_obj, campo)
         
-        # === 5. POST-PROCESAMIENTO Y CÁLCULOS AUTOMÁTICOS ===
+        # Obtenemos el valor por defecto definido en el modelo Pydantic para ese campo
+        valor_por_defecto = FacturaEndesaDistribucion.model_fields[campo].default
+
+        # CASO A: El objeto tiene el valor por defecto (no ha sido registrado aún)
+        if valor_actual == valor_por_defecto:
+            setattr(factura_obj, campo, valor_ocr)
+            # escribir_log(
+            #         f"\t->[OK] Valor incluido {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
+            #         f"Valor Incluido: '{valor_ocr}'"
+            #     )
         
-        # A. Cálculo del Mes Facturado y Número de Días
-        if factura_obj.fecha_fin_periodo and factura_obj.fecha_fin_periodo != "N/A":
-            try:
-                nombres_meses = {
-                    1: "ENERO", 2: "FEBRERO", 3: "MARZO", 4: "ABRIL",
-                    5: "MAYO", 6: "JUNIO", 7: "JULIO", 8: "AGOSTO",
-                    9: "SEPTIEMBRE", 10: "OCTUBRE", 11: "NOVIEMBRE", 12: "DICIEMBRE"
-                }
+        # CASO B: El objeto YA tiene un valor distinto al por defecto
+        else:
+            # Comparamos si el valor extraído coincide con el que ya teníamos
+            if valor_actual != valor_ocr:
+                # escribir_log(
+                #     f"\t->[!] Discrepancia en Factura {factura_obj.numero_factura} \n\t\t\t\t\t\t\t| Campo: '{campo}' | "
+                #     f"Valor en Objeto: '{valor_actual}' VS Valor OCR: '{valor_ocr}'"
+                # )
+                # Opcional: Aquí podrías decidir si sobreescribir o no. 
+                # Por ahora, mantenemos el valor del objeto y solo avisamos.
+                pass
+    
+    # === 5. POST-PROCESAMIENTO Y CÁLCULOS AUTOMÁTICOS ===
+    
+    # A. Cálculo del Mes Facturado y Número de Días
+    if factura_obj.fecha_fin_periodo and factura_obj.fecha_fin_periodo != "N/A":
+        try:
+            nombres_meses = {
+                1: "ENERO", 2: "FEBRERO", 3: "MARZO", 4: "ABRIL",
+                5: "MAYO", 6: "JUNIO", 7: "JULIO", 8: "AGOSTO",
+                9: "SEPTIEMBRE", 10: "OCTUBRE", 11: "NOVIEMBRE", 12: "DICIEMBRE"
+            }
+            
+            # Normalizamos formatos de fecha (DD-MM-YYYY)
+            f_fin_str = factura_obj.fecha_fin_periodo.replace("/", "-")
+            dt_fin = datetime.strptime(f_fin_str, '%d-%m-%Y')
+            
+            # Asignar nombre del mes 
+            factura_obj.mes_facturado = nombres_meses.get(dt_fin.month, "DESCONOCIDO")
+
+            # Calcular num_dias si existe fecha de inicio 
+            if factura_obj.fecha_inicio_periodo and factura_obj.fecha_inicio_periodo != "N/A":
+                f_ini_str = factura_obj.fecha_inicio_periodo.replace("/", "-")
+                dt_ini = datetime.strptime(f_ini_str, '%d-%m-%Y')
                 
-                # Normalizamos formatos de fecha (DD-MM-YYYY)
-                f_fin_str = factura_obj.fecha_fin_periodo.replace("/", "-")
-                dt_fin = datetime.strptime(f_fin_str, '%d-%m-%Y')
+                # Diferencia de días (valor absoluto) 
+                diferencia = abs((dt_fin - dt_ini).days)
+                factura_obj.num_dias = diferencia
                 
-                # Asignar nombre del mes 
-                factura_obj.mes_facturado = nombres_meses.get(dt_fin.month, "DESCONOCIDO")
-
-                # Calcular num_dias si existe fecha de inicio 
-                if factura_obj.fecha_inicio_periodo and factura_obj.fecha_inicio_periodo != "N/A":
-                    f_ini_str = factura_obj.fecha_inicio_periodo.replace("/", "-")
-                    dt_ini = datetime.strptime(f_ini_str, '%d-%m-%Y')
-                    
-                    # Diferencia de días (valor absoluto) 
-                    diferencia = abs((dt_fin - dt_ini).days)
-                    factura_obj.num_dias = diferencia
-                    
-            except Exception as e:
-                escribir_log(f"Error en cálculos de fechas/días: {e}")
-
-        # B. Cálculo de Importe de Potencia (Peaje + Cargos) 
-        p_peaje = factura_obj.termino_de_potencia_peaje or 0.0
-        p_cargos = factura_obj.termino_de_potencia_cargos or 0.0
-        factura_obj.importe_de_potencia = round(p_peaje + p_cargos, 2)
-
-        # C. Cálculo de Importe ATR (Energía Peaje + Energía Cargos) 
-        e_peaje = factura_obj.termino_de_energia_peaje or 0.0
-        e_cargos = factura_obj.termino_de_energia_cargos or 0.0
-        factura_obj.importe_atr = round(e_peaje + e_cargos, 2)
+        except Exception as e:
+            escribir_log(f"Error en cálculos de fechas/días: {e}")
 
+    # B. Cálculo de Importe de Potencia (Peaje + Cargos) 
+    p_peaje = factura_obj.termino_de_potencia_peaje or 0.0
+    p_cargos = factura_obj.termino_de_potencia_cargos or 0.0
+    factura_obj.importe_de_potencia = round(p_peaje + p_cargos, 2)
+
+    # C. Cálculo de Importe ATR (Energía Peaje + Energía Cargos) 
+    e_peaje = factura_obj.termino_de_energia_peaje or 0.0
+    e_cargos = factura_obj.termino_de_energia_cargos or 0.0
+    factura_obj.importe_atr = round(e_peaje + e_cargos, 2)
+
+
+def preparar_extraccion(factura_obj: FacturaEndesaDistribucion, ruta_pdf: str) -> tuple[str | None, tuple[str, ...] | None, str | None] | None:
+    """
+    Pasos previos al LLM: caché de extracciones y extracción local.
+    Devuelve None si la factura ya quedó resuelta; si no, (clave de caché,
+    campos pendientes o None para todos, texto en línea o None para subir el PDF).
+    Lee el PDF: en código asíncrono debe llamarse fuera del event loop.
+    """
+    # 0. Caché de extracciones: si el PDF ya se procesó con el mismo prompt y esquema, no llamamos a la API
+    clave_cache, acierto = _consultar_cache(factura_obj, ruta_pdf)
+    if acierto:
+        return None
+
+    # 0.b Extracción local determinista: el LLM solo resuelve lo que falte
+    paginas = leer_paginas(ruta_pdf)
+    campos = _extraccion_local(factura_obj, paginas)
+    if campos == ():
+        return None
+    if campos:
+        clave_cache, acierto = _consultar_cache(factura_obj, ruta_pdf, campos)
+        if acierto:
+            return None
+    return clave_cache, campos, _texto_para_llm(paginas)
+
+def aplicar_respuesta(factura_obj: FacturaEndesaDistribucion, texto_respuesta: str, clave_cache: str | None):
+    """Aplica a la factura el JSON devuelto por el modelo y lo guarda en la caché."""
+    datos_extraidos = json.loads(texto_respuesta)
+    aplicar_datos_extraidos(factura_obj, datos_extraidos)
+    _guardar_en_cache(clave_cache, datos_extraidos)
+
+
+def procesar_pdf_local(factura_obj: FacturaEndesaDistribucion, ruta_pdf: str) -> bool:
+    preparacion = preparar_extraccion(factura_obj, ruta_pdf)
+    if preparacion is None:
+        return True
+    clave_cache, campos, texto = preparacion
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("[ERROR] No se encontró la variable de entorno OPENAI_API_KEY")
+        return False
+
+    client = OpenAI(api_key=api_key)
+    file_id = None
+
+    try:
+        # 1. Subir archivo solo si no podemos enviar el texto en línea
+        if texto is None:
+            with open(ruta_pdf, "rb") as f:
+                file_upload = client.files.create(file=f, purpose="assistants")
+                file_id = file_upload.id
+
+        # 2. Llamada a la API (esquema estricto + prompt)
+        response = client.responses.create(**construir_peticion(file_id, campos, texto))
+
+        # 3. Mezcla de datos y post-procesamiento
+        aplicar_respuesta(factura_obj, response.output_text, clave_cache)
         
         return True
 
@@ -140,4 +303,37 @@ def procesar_pdf_local(factura_obj: FacturaEndesaDistribucion, ruta_pdf: str) ->
         return False
     finally:
         if file_id:
-            client.files.delete(file_id)
\ No newline at end of file
+            client.files.delete(file_id)
+
+
+async def procesar_pdf_local_async(factura_obj: FacturaEndesaDistribucion, ruta_pdf: str) -> bool:
+    """
+    Variante asíncrona de `procesar_pdf_local` sobre el extractor compartido
+    (cliente AsyncOpenAI único, limitación de ritmo y reintentos).
+    """
+    # La lectura del PDF es CPU: se hace fuera del event loop
+    preparacion = await asyncio.to_thread(preparar_extraccion, factura_obj, ruta_pdf)
+    if preparacion is None:
+        return True
+    clave_cache, campos, texto = preparacion
+
+    file_id = None
+    extractor = None
+    try:
+        extractor = obtener_extractor()
+        if texto is not None:
+            # Sin subida ni borrado de archivo: una sola llamada por factura
+            response = await extractor.crear_respuesta(construir_peticion(campos=campos, texto=texto), estimar_tokens(texto, campos))
+        else:
+            file_id = await extractor.subir_archivo(ruta_pdf)
+            response = await extractor.crear_respuesta(construir_peticion(file_id, campos))
+
+        aplicar_respuesta(factura_obj, response.output_text, clave_cache)
+        return True
+
+    except Exception as e:
+        escribir_log(f"[ERROR] Fallo en procesar_pdf_local_async ({factura_obj.numero_factura}): {str(e)}")
+        return False
+    finally:
+        if file_id and extractor:
+            await extractor.borrar_archivo(file_id)
@@ -0,0 +1,145 @@
+import os
+import asyncio
+import weakref
+from typing import Callable
+from logs import escribir_log, contexto_log, tramo
+from metricas import registrar_indicador, contar_error_rpa
+from modelos_datos import FacturaEndesaDistribucion, ProgresoEjecucion
+from pdf_parser import procesar_pdf_local_async
+
+# --- CONFIGURACIÓN DEL PIPELINE OCR ---
+# Tamaño máximo de la cola (contrapresión: el scraping espera si el OCR se queda atrás)
+TAMANO_COLA_OCR = int(os.environ.get("EDISTRIBUCION_COLA_OCR", "20"))
+# Número de workers OCR que consumen la cola en paralelo
+NUM_WORKERS_OCR = int(os.environ.get("EDISTRIBUCION_WORKERS_OCR", "4"))
+# OCR simultáneos en todo el proceso, sumando los pipelines de ejecuciones (y cuentas) en paralelo
+MAX_OCR_GLOBAL = int(os.environ.get("EDISTRIBUCION_OCR_GLOBAL", str(NUM_WORKERS_OCR)))
+
+# Pipelines vivos del proceso, para la profundidad de cola de /metrics
+_pipelines: weakref.WeakSet = weakref.WeakSet()
+
+
+_limite_ocr: asyncio.Semaphore | None = None
+
+def obtener_limite_ocr() -> asyncio.Semaphore:
+    """Semáforo compartido que limita los OCR en curso a MAX_OCR_GLOBAL, creado en el primer uso."""
+    global _limite_ocr
+    if _limite_ocr is None:
+        _limite_ocr = asyncio.Semaphore(max(1, MAX_OCR_GLOBAL))
+    return _limite_ocr
+
+
+def marcar_error_ocr(factura: FacturaEndesaDistribucion, detalle: str = "No se pudieron extraer datos del PDF."):
+    """Marca la factura con error de OCR, concatenándolo a los mensajes previos."""
+    factura.error_RPA = True
+    prefijo = (factura.direccion_suministro + " | ") if factura.direccion_suministro else ""
+    factura.direccion_suministro = f"{prefijo}ERROR_OCR: {detalle}"
+    contar_error_rpa("OCR")
+
+
+class PipelineOCR:
+    """
+    Etapa productor/consumidor para el OCR de facturas.
+    El scraping encola (factura, ruta_pdf) y un grupo de workers los procesa
+    en paralelo, de modo que el tiempo de navegador y el del LLM se solapan.
+    """
+    def __init__(self, num_workers: int | None = None, tamano_cola: int | None = None, progreso: ProgresoEjecucion | None = None,
+                 al_completar: Callable[[FacturaEndesaDistribucion], None] | None = None):
+        self.num_workers = max(1, num_workers or NUM_WORKERS_OCR)
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=max(1, tamano_cola or TAMANO_COLA_OCR))
+        self.workers: list[asyncio.Task] = []
+        self.procesadas = 0
+        self.fallidas = 0
+        self.progreso = progreso
+        # Se invoca con cada factura al terminar su OCR (con o sin éxito)
+        self.al_completar = al_completar
+        # Facturas encoladas cuyo OCR aún no ha terminado
+        self.pendientes: set[int] = set()
+        self._terminada = asyncio.Condition()
+        _pipelines.add(self)
+
+    def iniciar(self):
+        """Lanza los workers OCR sobre el event loop actual."""
+        self.workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.num_workers)
+        ]
+        return self
+
+    async def encolar(self, factura: FacturaEndesaDistribucion, ruta_pdf: str):
+        """Añade una factura a la cola. Bloquea si la cola está llena."""
+        self.pendientes.add(id(factura))
+        await self.cola.put((factura, ruta_pdf))
+        self._actualizar_progreso()
+
+    def profundidad(self) -> int:
+        """Número de facturas esperando OCR."""
+        return self.cola.qsize()
+
+    def pendiente(self, factura: FacturaEndesaDistribucion) -> bool:
+        """Indica si la factura está encolada o en proceso de OCR."""
+        return id(factura) in self.pendientes
+
+    async def esperar(self, facturas: list[FacturaEndesaDistribucion]):
+        """Espera a que terminen el OCR de las facturas dadas (no de toda la cola)."""
+        async with self._terminada:
+            await self._terminada.wait_for(lambda: not any(self.pendiente(f) for f in facturas))
+
+    def _actualizar_progreso(self):
+        if self.progreso is not None:
+            self.progreso.cola_ocr = self.cola.qsize()
+            self.progreso.ocr_completados = self.procesadas
+            self.progreso.ocr_fallidos = self.fallidas
+
+    async def _worker(self, id_worker: int):
+        while True:
+            factura, ruta_pdf = await self.cola.get()
+            try:
+                # El extractor compartido limita el ritmo contra OpenAI; el semáforo global, los OCR entre pipelines
+                async with obtener_limite_ocr():
+                    with contexto_log(cups=factura.cups, factura=factura.numero_factura), tramo("ocr") as t:
+                        exito_ocr = await procesar_pdf_local_async(factura, ruta_pdf)
+                        t["ok"] = exito_ocr
+                if exito_ocr:
+                    self.procesadas += 1
+                    escribir_log(f"        -> [OK] [OCR {id_worker}] OCR completado para {factura.numero_factura}")
+                else:
+                    self.fallidas += 1
+                    marcar_error_ocr(factura)
+                    escribir_log(f"        -> [!] [OCR {id_worker}] No se pudieron extraer datos adicionales de {factura.numero_factura}.")
+            except Exception as e:
+                self.fallidas += 1
+                marcar_error_ocr(factura, str(e))
+                escribir_log(f"        -> [ERROR] [OCR {id_worker}] Fallo inesperado en {factura.numero_factura}: {e}")
+            finally:
+                self.pendientes.discard(id(factura))
+                self._actualizar_progreso()
+                if self.al_completar is not None:
+                    # Un fallo del aviso no puede tumbar el worker: cerrar() esperaría para siempre en cola.join()
+                    try:
+                        self.al_completar(factura)
+                    except Exception as e:
+                        escribir_log(f"        -> [ERROR] [OCR {id_worker}] Fallo al notificar {factura.numero_factura}: {e}")
+                async with self._terminada:
+                    self._terminada.notify_all()
+                self.cola.task_done()
+
+    async def cerrar(self, esperar: bool = True):
+        """
+        Espera a que se vacíe la cola (si esperar=True) y detiene los workers.
+        """
+        if esperar:
+            await self.cola.join()
+        for tarea in self.workers:
+            tarea.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+
+registrar_indicador(
+    "edistribucion_cola_ocr_profundidad", "Facturas esperando OCR en las colas de los pipelines activos.",
+    lambda: sum(p.profundidad() for p in list(_pipelines)),
+)
+registrar_indicador(
+    "edistribucion_ocr_pendientes", "Facturas encoladas cuyo OCR aún no ha terminado (en cola o en proceso).",
+    lambda: sum(len(p.pendientes) for p in list(_pipelines)),
+)
@@ -0,0 +1,87 @@
+import os
+import asyncio
+from typing import Any, Awaitable, Callable
+from cuentas import Cuenta, RegistroCuentas, obtener_registro_cuentas
+from pool_navegadores import PoolNavegadores, LanzadorChromium, MAX_SESIONES_POOL
+from logs import escribir_log
+
+# --- CONFIGURACIÓN DEL PLANIFICADOR DE CUENTAS ---
+# Sesiones de navegador abiertas a la vez entre todas las cuentas (tope global)
+MAX_SESIONES_GLOBAL = int(os.environ.get("EDISTRIBUCION_SESIONES_GLOBAL", "4"))
+
+# (cuenta, lanzador compartido, límite global) -> pool de la cuenta, sin iniciar
+CreadorPool = Callable[[Cuenta, LanzadorChromium, asyncio.Semaphore], PoolNavegadores]
+
+
+class PlanificadorCuentas:
+    """
+    Reparte el trabajo entre las cuentas del registro. Todas comparten un
+    único Chromium, pero cada cuenta tiene su propio pool: contextos aislados,
+    login y estado de sesión propios, y como mucho `max_sesiones` sesiones a
+    la vez (para no provocar bloqueos en el portal). Además, todas las
+    sesiones ocupan una plaza del tope global MAX_SESIONES_GLOBAL.
+    Los pools se crean en el primer uso de cada cuenta.
+    """
+    def __init__(self, crear_pool: CreadorPool, registro: RegistroCuentas | None = None,
+                 max_sesiones_global: int | None = None):
+        self.crear_pool = crear_pool
+        self.registro = registro or obtener_registro_cuentas()
+        self.max_sesiones_global = max(1, max_sesiones_global or MAX_SESIONES_GLOBAL)
+        self.limite_global = asyncio.Semaphore(self.max_sesiones_global)
+        self.lanzador = LanzadorChromium()
+        self.pools: dict[str, PoolNavegadores] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def limite_cuenta(self, nombre: str | None) -> int:
+        """Ejecuciones simultáneas permitidas para la cuenta (las mismas que sus sesiones)."""
+        return self.registro.obtener(nombre).max_sesiones or MAX_SESIONES_POOL
+
+    async def pool(self, nombre: str | None = None) -> PoolNavegadores:
+        """Pool de la cuenta, creado e iniciado la primera vez que se pide."""
+        cuenta = self.registro.obtener(nombre)
+        async with self._locks.setdefault(cuenta.nombre, asyncio.Lock()):
+            if cuenta.nombre not in self.pools:
+                self.pools[cuenta.nombre] = await self.crear_pool(cuenta, self.lanzador, self.limite_global).iniciar()
+                escribir_log(f"[CUENTAS] Pool de la cuenta {cuenta.nombre} iniciado.")
+        return self.pools[cuenta.nombre]
+
+    async def ejecutar_todas(self, funcion: Callable[[Cuenta, PoolNavegadores], Awaitable[Any]],
+                             nombres: list[str] | None = None) -> dict[str, Any]:
+        """
+        Ejecuta `funcion(cuenta, pool)` para cada cuenta (las activas si no se
+        indican) en paralelo; los pools limitan la concurrencia. Devuelve el
+        resultado de cada cuenta, o la excepción si falló.
+        """
+        cuentas = [self.registro.obtener(n) for n in nombres] if nombres else self.registro.activas()
+
+        async def _ejecutar(cuenta: Cuenta):
+            return await funcion(cuenta, await self.pool(cuenta.nombre))
+
+        resultados = await asyncio.gather(*(_ejecutar(c) for c in cuentas), return_exceptions=True)
+        for cuenta, resultado in zip(cuentas, resultados):
+            if isinstance(resultado, asyncio.CancelledError):
+                raise resultado
+            if isinstance(resultado, Exception):
+                escribir_log(f"[CUENTAS] La cuenta {cuenta.nombre} falló: {resultado}")
+        return {c.nombre: r for c, r in zip(cuentas, resultados)}
+
+    async def cerrar(self):
+        for pool in self.pools.values():
+            await pool.cerrar()
+        self.pools = {}
+        await self.lanzador.cerrar()
+        escribir_log("[CUENTAS] Navegador compartido cerrado.")
+
+    def estadisticas(self) -> dict:
+        return {
+            "navegador_activo": self.lanzador.activo(),
+            "relanzamientos": self.lanzador.relanzamientos,
+            "max_sesiones_global": self.max_sesiones_global,
+            "sesiones_en_uso": sum(p.en_uso for p in self.pools.values()),
+            # También ocupan plaza del tope global
+            "contextos_extra_en_uso": sum(sum(p._plazas_extra.values()) for p in self.pools.values()),
+            "cuentas": {
+                c.nombre: {**c.a_dict(), "pool": self.pools[c.nombre].estadisticas() if c.nombre in self.pools else None}
+                for c in self.registro.cuentas.values()
+            },
+        }
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import asyncio
+import weakref
+from contextlib import asynccontextmanager, nullcontext
+from typing import Awaitable, Callable
+from playwright.async_api import async_playwright, Playwright, Browser, BrowserContext, Page
+from navegador import NavegadorAsync, MODO_RAPIDO
+from logs import escribir_log
+from metricas import registrar_indicador
+
+# --- CONFIGURACIÓN DEL POOL ---
+# Sesiones autenticadas que pueden usarse a la vez (cada una es un contexto de navegador)
+MAX_SESIONES_POOL = int(os.environ.get("EDISTRIBUCION_POOL_SESIONES", "2"))
+# Una sesión usada hace menos de este tiempo se reutiliza sin volver a validarla
+REVALIDAR_TRAS_S = int(os.environ.get("EDISTRIBUCION_POOL_REVALIDAR_S", "300"))
+# Estado de sesión (cookies + localStorage) persistido entre reinicios del servicio
+RUTA_ESTADO_SESION = os.path.join("datos", "sesion_edistribucion.json")
+
+# Pools vivos del proceso (los de la API y los propios de cada ejecución), para las métricas
+_pools: weakref.WeakSet = weakref.WeakSet()
+
+
+class LanzadorChromium:
+    """
+    Playwright y Chromium lanzados una sola vez y relanzados si el navegador
+    se cae. Varios pools (uno por cuenta) pueden compartirlo: cada uno abre
+    sus propios contextos, aislados entre sí, sobre el mismo proceso.
+    """
+    def __init__(self):
+        self.playwright: Playwright | None = None
+        self.browser: Browser | None = None
+        self._lock = asyncio.Lock()
+        self.relanzamientos = 0
+
+    def activo(self) -> bool:
+        return bool(self.browser and self.browser.is_connected())
+
+    async def asegurar(self) -> Browser:
+        """Lanza Chromium si no está activo (o si se ha caído)."""
+        async with self._lock:
+            if self.activo():
+                return self.browser
+            if self.browser is not None:
+                self.relanzamientos += 1
+                escribir_log("[POOL] El navegador se desconectó. Relanzando Chromium...")
+            try:
+                if self.playwright is None:
+                    self.playwright = await async_playwright().start()
+                self.browser = await self.playwright.chromium.launch(headless=True)
+            except Exception:
+                if self.playwright and self.browser is None:
+                    await self.playwright.stop()
+                    self.playwright = None
+                raise
+            escribir_log("[POOL] Chromium lanzado.")
+            return self.browser
+
+    async def cerrar(self):
+        if self.browser:
+            await self.browser.close()
+            self.browser = None
+        if self.playwright:
+            await self.playwright.stop()
+            self.playwright = None
+
+
+class PoolNavegadores:
+    """
+    Pool de sesiones Playwright que mantiene Chromium lanzado entre llamadas
+    a la API. Los contextos autenticados se reutilizan y el `storage_state`
+    se guarda para restaurar la sesión en contextos nuevos. Solo se vuelve a
+    hacer login cuando la sesión ha caducado.
+
+    `validar_sesion(page)` y `autenticar(page)` son corrutinas que devuelven
+    True/False y las proporciona el robot (el pool no conoce el portal).
+    `modo_rapido` se aplica a todas las sesiones (ver navegador.MODO_RAPIDO).
+    Con `lanzador`, el pool usa ese Chromium compartido en lugar de lanzar el
+    suyo; con `limite_global`, cada sesión ocupa además una plaza de ese
+    semáforo (tope de sesiones entre todos los pools que lo comparten), y
+    también cada contexto extra pedido con `contexto_extra`.
+    """
+    def __init__(self, validar_sesion: Callable[[Page], Awaitable[bool]], autenticar: Callable[[Page], Awaitable[bool]],
+                 max_sesiones: int | None = None, ruta_estado: str = RUTA_ESTADO_SESION,
+                 modo_rapido: bool | None = None, lanzador: LanzadorChromium | None = None,
+                 limite_global: asyncio.Semaphore | None = None, nombre: str | None = None):
+        self.validar_sesion = validar_sesion
+        self.autenticar = autenticar
+        self.max_sesiones = max(1, max_sesiones or MAX_SESIONES_POOL)
+        self.ruta_estado = ruta_estado
+        self.modo_rapido = MODO_RAPIDO if modo_rapido is None else modo_rapido
+        self.nombre = nombre
+
+        self.lanzador = lanzador or LanzadorChromium()
+        self._lanzador_propio = lanzador is None
+        self.limite_global = limite_global
+        self.storage_state: dict | None = None
+        self._semaforo = asyncio.Semaphore(self.max_sesiones)
+        self._libres: list[tuple[NavegadorAsync, float]] = []
+        # Plazas de limite_global ocupadas por los contextos extra de cada sesión prestada (id del robot -> plazas)
+        self._plazas_extra: dict[int, int] = {}
+        self.iniciado_en: float | None = None
+        _pools.add(self)
+
+        # Estadísticas
+        self.en_uso = 0
+        self.sesiones_creadas = 0
+        self.reutilizaciones = 0
+        self.validaciones = 0
+        self.logins = 0
+        self.logins_fallidos = 0
+
+    @property
+    def browser(self) -> Browser | None:
+        return self.lanzador.browser
+
+    # --- Ciclo de vida ---
+
+    async def iniciar(self):
+        """Arranca Playwright y Chromium una sola vez y carga la sesión guardada."""
+        await self.lanzador.asegurar()
+        if os.path.exists(self.ruta_estado):
+            try:
+                with open(self.ruta_estado, "r", encoding="utf-8") as f:
+                    self.storage_state = json.load(f)
+                escribir_log(f"[POOL] Estado de sesión restaurado desde {self.ruta_estado}")
+            except Exception as e:
+                escribir_log(f"[POOL] No se pudo leer el estado de sesión guardado: {e}")
+        self.iniciado_en = time.time()
+        return self
+
+    async def cerrar(self):
+        for robot, _ in self._libres:
+            await robot.cerrar()
+        self._libres = []
+        if self._lanzador_propio:
+            await self.lanzador.cerrar()
+            escribir_log("[POOL] Navegador del pool cerrado.")
+
+    async def _guardar_estado(self, robot: NavegadorAsync):
+        try:
+            self.storage_state = await robot.context.storage_state()
+            os.makedirs(os.path.dirname(self.ruta_estado) or ".", exist_ok=True)
+            with open(self.ruta_estado, "w", encoding="utf-8") as f:
+                json.dump(self.storage_state, f)
+        except Exception as e:
+            escribir_log(f"[POOL] No se pudo guardar el estado de sesión: {e}")
+
+    # --- Préstamo de sesiones ---
+
+    async def _preparar_sesion(self) -> NavegadorAsync:
+        """Devuelve una sesión autenticada: reutilizada, restaurada o con login nuevo."""
+        # Los contextos de un Chromium anterior (caído y relanzado) se descartan abajo
+        browser = await self.lanzador.asegurar()
+
+        # 1. Contexto libre y usado recientemente: se reutiliza tal cual
+        while self._libres:
+            robot, ultimo_uso = self._libres.pop()
+            if robot.browser is not browser:
+                continue
+            if time.time() - ultimo_uso < REVALIDAR_TRAS_S:
+                self.reutilizaciones += 1
+                return robot
+            self.validaciones += 1
+            if await self.validar_sesion(robot.get_page()):
+                self.reutilizaciones += 1
+                return robot
+            await robot.cerrar()
+
+        # 2. Contexto nuevo con la sesión guardada
+        robot = await NavegadorAsync(self.modo_rapido).iniciar_en_navegador(browser, self.storage_state)
+        self.sesiones_creadas += 1
+        if self.storage_state is not None:
+            self.validaciones += 1
+            if await self.validar_sesion(robot.get_page()):
+                escribir_log("[POOL] Sesión guardada válida. Se omite el login.")
+                return robot
+
+        # 3. Sesión caducada o inexistente: login
+        self.logins += 1
+        if not await self.autenticar(robot.get_page()):
+            self.logins_fallidos += 1
+            await robot.cerrar()
+            raise Exception("Fallo crítico: No se pudo iniciar sesión en el portal.")
+        await self._guardar_estado(robot)
+        return robot
+
+    @asynccontextmanager
+    async def sesion(self):
+        """
+        Presta una sesión autenticada (NavegadorAsync) durante el bloque `async with`.
+        Al salir, el contexto vuelve al pool para la siguiente llamada.
+        """
+        # Primero la plaza del pool y después la global, para no retener esta esperando a aquella
+        async with self._semaforo, (self.limite_global or nullcontext()):
+            robot = await self._preparar_sesion()
+            self.en_uso += 1
+            reutilizable = False
+            try:
+                yield robot
+                reutilizable = True
+            finally:
+                self.en_uso -= 1
+                await robot.cerrar_contextos_extra()
+                for _ in range(self._plazas_extra.pop(id(robot), 0)):
+                    self.limite_global.release()
+                if reutilizable and robot.browser is not None and robot.browser.is_connected():
+                    await self._guardar_estado(robot)
+                    self._libres.append((robot, time.time()))
+                else:
+                    await robot.cerrar()
+
+    async def contexto_extra(self, robot: NavegadorAsync) -> BrowserContext | None:
+        """
+        Contexto adicional para una sesión prestada por `sesion()`, con su
+        misma sesión autenticada. Con `limite_global` ocupa una plaza más, pero
+        solo si hay una libre: esperarla podría bloquear a todas las
+        ejecuciones, cada una reteniendo su sesión principal. Devuelve None si
+        el tope global está completo (la ejecución sigue con menos contextos).
+        """
+        if self.limite_global is not None:
+            if self.limite_global.locked():
+                return None
+            # Con plazas libres, acquire() no cede el control: nadie puede adelantarse entre ambas líneas
+            await self.limite_global.acquire()
+            self._plazas_extra[id(robot)] = self._plazas_extra.get(id(robot), 0) + 1
+        return await robot.nuevo_contexto()
+
+    def estadisticas(self) -> dict:
+        return {
+            "nombre": self.nombre,
+            "navegador_activo": self.lanzador.activo(),
+            "iniciado_en": self.iniciado_en,
+            "max_sesiones": self.max_sesiones,
+            "modo_rapido": self.modo_rapido,
+            "sesiones_en_uso": self.en_uso,
+            "contextos_extra_en_uso": sum(self._plazas_extra.values()),
+            "sesiones_libres": len(self._libres),
+            "sesion_guardada": self.storage_state is not None,
+            "sesiones_creadas": self.sesiones_creadas,
+            "reutilizaciones": self.reutilizaciones,
+            "validaciones": self.validaciones,
+            "logins": self.logins,
+            "logins_fallidos": self.logins_fallidos,
+            "relanzamientos": self.lanzador.relanzamientos,
+        }
+
+
+registrar_indicador(
+    "edistribucion_navegadores_activos", "Navegadores Chromium lanzados y conectados.",
+    lambda: len({id(p.lanzador) for p in list(_pools) if p.lanzador.activo()}),
+)
+registrar_indicador(
+    "edistribucion_sesiones_en_uso", "Sesiones de navegador prestadas a ejecuciones en curso.",
+    lambda: sum(p.en_uso for p in list(_pools)),
+)
@@ -1,28 +1,65 @@
-from navegador import NavegadorAsync, TEMP_DOWNLOAD_ROOT # Importamos la clase base y la ruta de descarga
+from navegador import TEMP_DOWNLOAD_ROOT, es_modo_rapido # Importamos la ruta de descarga
+from pool_navegadores import PoolNavegadores, LanzadorChromium, RUTA_ESTADO_SESION
 import asyncio
 import re
-import csv # Necesario para exportar los logs
-import base64 # Necesario para la codificación Base64
+import uuid
+import random
 import os # Necesario para manejar rutas de archivos
-from playwright.async_api import Page, TimeoutError, Locator # Importamos Page, TimeoutError, Locator
-from modelos_datos import FacturaEndesaDistribucion # Importamos la clase modelo de datos (AHORA ES PYDANTIC)
+from typing import AsyncIterator, Awaitable, Callable
+from datetime import date
+from playwright.async_api import Page, Locator, TimeoutError as PlaywrightTimeoutError # Importamos Page, Locator
+from modelos_datos import FacturaEndesaDistribucion, ProgresoEjecucion # Importamos la clase modelo de datos (AHORA ES PYDANTIC)
 # IMPORTACIÓN DE LA FUNCIÓN DE LOGGING
-from logs import escribir_log
-from pdf_parser import procesar_pdf_local
+from logs import escribir_log, contexto_log, anotar_contexto, restaurar_contexto, tramo
+from pdf_parser import procesar_pdf_local_async
+from pipeline_ocr import PipelineOCR, marcar_error_ocr, obtener_limite_ocr
+from lote_ocr import LoteOCR, OCR_LOTE
+from indice_facturas import IndiceFacturas, obtener_indice, estado_proceso_de, ESTADO_ERROR, ESTADO_COMPLETA
+from ventanas_fechas import a_fecha, a_texto, dividir_rango, partir_ventana, rangos_cubren, MAX_FILAS_VENTANA
+from motor_descargas import MotorDescargas
+from almacen_resultados import obtener_almacen
+from almacen_pdf import obtener_almacen_pdf
+from diario_ejecuciones import (obtener_diario, ETAPA_LISTADA, ETAPA_DESCARGADA, ETAPA_EXTRAIDA, ETAPA_EXPORTADA,
+                                EJECUCION_COMPLETADA, EJECUCION_INTERRUMPIDA)
+from cuentas import Cuenta, obtener_registro_cuentas, CUENTA_POR_DEFECTO
+from planificador_cuentas import PlanificadorCuentas
+from metricas import contar_error_rpa, FACTURAS_PROCESADAS, INTENTOS_LOGIN
 
 # --- CONSTANTES DE E-DISTRIBUCIÓN ---
-URL_LOGIN = "https://zonaprivada.edistribucion.com/areaprivada/s/login/?language=es"
-URL_FACTURAS = "https://zonaprivada.edistribucion.com/areaprivada/s/wp-billingchecking"
+# Configurables para apuntar el robot a un portal simulado (benchmarks/portal_simulado.py)
+URL_LOGIN = os.environ.get("EDISTRIBUCION_URL_LOGIN", "https://zonaprivada.edistribucion.com/areaprivada/s/login/?language=es")
+URL_FACTURAS = os.environ.get("EDISTRIBUCION_URL_FACTURAS", "https://zonaprivada.edistribucion.com/areaprivada/s/wp-billingchecking")
 
-# Credenciales REALES (Prioriza variables de entorno si existen)
-USER = os.environ.get("DISTRIBUCION_USER", "27298340P") 
-PASSWORD = os.environ.get("DISTRIBUCION_PASSWORD", "z5!tWZWzTDQ6rx9")
+# Las credenciales de cada cuenta del portal están en el registro de cuentas (cuentas.py)
 
 MAX_LOGIN_ATTEMPTS = 5 # NÚMERO MÁXIMO DE INTENTOS DE LOGIN
 
-# --- CONSTANTE DE LOGGING Y CARPETAS DE DESCARGA ---
-LOG_FILE_NAME_TEMPLATE = "csv/facturas_edistribucion_log.csv"
+# --- SELECTORES DE LA TABLA DE FACTURAS (Salesforce lightning-datatable) ---
+SELECTOR_FILAS_TABLA = 'table[lwc-392cvb27u8q] tbody tr'
+# Botones de "cargar más" y de paginación, si el portal los muestra
+SELECTOR_CARGAR_MAS = 'button:has-text("Cargar más"), button:has-text("Ver más"), button:has-text("Mostrar más")'
+SELECTOR_PAGINA_SIGUIENTE = 'button[title="Siguiente"], button[title="Página siguiente"], button:has-text("Siguiente")'
+SELECTOR_SPINNER_TABLA = 'lightning-spinner, .slds-spinner'
+ESPERA_CARGA_FILAS_MS = 4000 # Tiempo máximo esperando nuevas filas tras scroll / "cargar más"
+ESPERA_SCROLL_SIN_SPINNER_MS = 750 # Si tras el scroll no aparece spinner, asumimos fin de tabla antes
+MAX_PAGINAS_TABLA = 500 # Salvaguarda contra bucles de paginación infinitos
+SELECTOR_CELDA_TABLA = 'lightning-primitive-cell-factory'
+SELECTOR_SIN_RESULTADOS = 'div:has-text("No se encuentran resultados")'
+ESPERA_TABLA_MS = 60000 # Tiempo máximo esperando la tabla tras aplicar el filtro
+ESPERA_NAVEGACION_MS = 30000 # Modo rápido: tiempo máximo esperando la navegación tras login o cambio de rol
+# Columnas leídas de cada fila (atributo data-label de la celda)
+COLUMNAS_TABLA = ["CUPS", "FACTURA FISCAL", "FECHA", "TOTAL/PDTE", "Estado", "Tipo"]
+# Lectura de todas las celdas en una sola llamada al navegador (1) o fila a fila (0)
+LECTURA_TABLA_BULK = os.environ.get("EDISTRIBUCION_LECTURA_BULK", "1") == "1"
 
+# Número de contextos de navegador que procesan roles en paralelo (1 = modo secuencial)
+NUM_WORKERS_ROLES = int(os.environ.get("EDISTRIBUCION_WORKERS_ROLES", "1"))
+
+# Reintento selectivo de facturas con error: intentos extra por operación y base del backoff exponencial
+REINTENTOS_FACTURA = int(os.environ.get("EDISTRIBUCION_REINTENTOS_FACTURA", "3"))
+BACKOFF_REINTENTO_S = float(os.environ.get("EDISTRIBUCION_BACKOFF_REINTENTO_S", "2.0"))
+
+# --- CARPETAS DE DESCARGA ---
 # Definición de las subcarpetas usando la constante TEMP_DOWNLOAD_ROOT de navegador.py
 DOWNLOAD_FOLDERS = {
     'PDF': os.path.join(TEMP_DOWNLOAD_ROOT, 'Facturas_Edistribucion_PDFs')
@@ -72,146 +109,371 @@ def _clean_and_convert_float(text: str) -> float:
         escribir_log(f"Error al convertir importe '{text}': {e}")
         return 0.0
 
-def _exportar_log_csv(facturas: list[FacturaEndesaDistribucion], filepath: str):
+def _guardar_resultados(facturas: list[FacturaEndesaDistribucion], rol: str, cuenta: str = CUENTA_POR_DEFECTO) -> bool:
     """
-    Exporta TODA la metadata de las facturas extraídas a un archivo CSV.
+    Guarda las facturas del rol en el almacén de resultados, etiquetadas con
+    la cuenta y el rol (una transacción, upsert por cups y número de factura).
+    Devuelve False si no se pudo guardar.
     """
-    if not facturas: return
-    fieldnames = list(FacturaEndesaDistribucion.model_fields.keys())
-    
+    if not facturas: return True
     try:
-        escribir_log(f"[CSV]")
-        file_exists = os.path.isfile(filepath)
-        # Usamos 'a' (append) para ir acumulando las facturas de todos los roles en el mismo fichero
-        with open(filepath, 'a', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter=';')
-            if not file_exists:
-                writer.writeheader()
-            for f in facturas:
-                writer.writerow(f.model_dump())
-        escribir_log(f"    -> [OK] Log CSV exportado a: {filepath}")
+        escribir_log(f"[RESULTADOS]")
+        guardadas = obtener_almacen().guardar_lote(facturas, rol=rol, cuenta=cuenta)
+        escribir_log(f"    -> [OK] {guardadas} facturas de {rol} ({cuenta}) guardadas en: {obtener_almacen().ruta}")
+        return True
     except Exception as e:
-        escribir_log(f"    -> [ERROR CSV] Fallo al exportar CSV: {e}")
+        escribir_log(f"    -> [ERROR RESULTADOS] Fallo al guardar los resultados de {rol}: {e}")
+        return False
 
 
 # --- LÓGICA DE DESCARGA LOCAL Y EXTRACCIÓN ---
 
-async def _descargar_archivo_fila(page: Page, row_locator: Locator, factura: FacturaEndesaDistribucion) -> str | None:
+def _ruta_pdf_factura(cups: str, numero_factura: str) -> str:
+    """Ruta temporal de descarga del PDF de una factura (luego pasa al almacén de PDF)."""
+    return os.path.join(DOWNLOAD_FOLDERS['PDF'], f"{cups}_{numero_factura}.pdf")
+
+def _ruta_pdf_guardado(cups: str, numero_factura: str) -> str | None:
+    """PDF de la factura en el almacén o, si se descargó antes de existir este, en la carpeta temporal."""
+    ruta = obtener_almacen_pdf().ruta(cups, numero_factura)
+    if ruta is None and os.path.exists(_ruta_pdf_factura(cups, numero_factura)):
+        ruta = _ruta_pdf_factura(cups, numero_factura)
+    return ruta
+
+def _fila_de_factura(page: Page, numero_factura: str) -> Locator:
     """
-    Intenta descargar el archivo PDF haciendo clic en el botón de la fila.
+    Localiza la fila de una factura por su número (y no por su posición),
+    para que una descarga diferida siga apuntando a la fila correcta.
     """
-    # En Edistribución el botón se identifica por name="PDF"
-    button_locator = row_locator.locator('button[name="PDF"]')
-    
-    if await button_locator.count() == 0:
-        return None
+    celda = page.locator('td[data-label="FACTURA FISCAL"]', has_text=re.compile(rf"^\s*{re.escape(numero_factura)}\s*$"))
+    return page.locator(SELECTOR_FILAS_TABLA).filter(has=celda).first
 
+async def _descargar_y_procesar(motor: MotorDescargas, row: Locator, factura: FacturaEndesaDistribucion, pipeline_ocr: PipelineOCR | None = None,
+                                reutilizar_pdf: bool = False):
+    """
+    Descarga el PDF de la factura y lo entrega al OCR (cola o en línea).
+    Con reutilizar_pdf=True (ejecución retomada), si el PDF ya está en el
+    almacén no se vuelve a descargar. Los errores quedan anotados en la propia factura.
+    """
     try:
-        target_folder = DOWNLOAD_FOLDERS['PDF']
-        filename = f"{factura.cups}_{factura.numero_factura}.pdf"
-        save_path = os.path.join(target_folder, filename)
-        
-        async with page.expect_download(timeout=5000) as download_info:
-            await button_locator.click(timeout=5000)
-            
-        download = await download_info.value
-        await download.save_as(save_path)
-        
-        escribir_log(f"    -> [OK] [DESCARGA PDF] Guardado en: {save_path}")
-        return save_path
+        ruta_pdf = _ruta_pdf_guardado(factura.cups, factura.numero_factura) if reutilizar_pdf else None
+        if ruta_pdf:
+            escribir_log(f"    [REANUDACIÓN] PDF de {factura.numero_factura} ya descargado. Se omite la descarga.")
+        else:
+            with tramo("descarga") as t:
+                ruta_pdf = await motor.descargar(row, factura, _ruta_pdf_factura(factura.cups, factura.numero_factura))
+                if ruta_pdf:
+                    # El PDF pasa al almacén por contenido; el OCR y el índice usan la ruta definitiva
+                    ruta_pdf = await asyncio.to_thread(obtener_almacen_pdf().guardar, ruta_pdf, factura)
+                t["ok"] = bool(ruta_pdf)
+        if not ruta_pdf:
+            raise Exception("NO_DISPONIBLE: No existe botón PDF.")
+        # === INTEGRACION OCR ===
+        if not factura.error_RPA and factura.importe_total_tabla >= 0:
+            escribir_log(f"    -> [OCR]")
+            if pipeline_ocr is not None:
+                await pipeline_ocr.encolar(factura, ruta_pdf)
+                escribir_log(f"        -> [COLA] {factura.numero_factura} encolada para OCR ({pipeline_ocr.profundidad()} en espera)")
+            else:
+                # Sin pipeline, el OCR se ejecuta en línea sobre el extractor asíncrono
+                with tramo("ocr") as t:
+                    exito_ocr = await procesar_pdf_local_async(factura, ruta_pdf)
+                    t["ok"] = exito_ocr
+                if exito_ocr:
+                    escribir_log(f"        -> [OK] OCR completado para {factura.numero_factura}")
+                else:
+                    marcar_error_ocr(factura)
+                    escribir_log(f"        -> [!] [OCR] No se pudieron extraer datos adicionales.")
+
+    except Exception as e_pdf:
+        _anotar_error_pdf(factura, e_pdf)
+
+def _anotar_error_pdf(factura: FacturaEndesaDistribucion, e_pdf: Exception):
+    """Marca la factura con error técnico y concatena el error del PDF al mensaje existente (si lo hay)."""
+    factura.error_RPA = True
+    msg_error = str(e_pdf).split("Call log:")[0].strip()
     
-    except TimeoutError:
-        raise Exception("TIMEOUT: El botón PDF no respondió o no es visible.")
-        
-    except Exception as e:
-        escribir_log(f"   -> [ERROR PDF] Fallo inesperado en la descarga")
-        error_limpio = str(e).split('\n')[0]
-        raise Exception(f"FALLO_DESCARGA: {error_limpio}")
+    # Concatenamos de forma limpia
+    prefijo = (factura.direccion_suministro + " | ") if factura.direccion_suministro else ""
+    factura.direccion_suministro = f"{prefijo}ERROR_PDF: {msg_error}"
+    contar_error_rpa(msg_error)
+    
+    escribir_log(f"    -> [!] {msg_error}", mostrar_tiempo=False)
+
+async def _esperar_mas_filas(page: Page, filas_previas: int, timeout_ms: int = ESPERA_CARGA_FILAS_MS) -> bool:
+    """Espera a que la tabla renderice más de `filas_previas` filas."""
+    if es_modo_rapido(page):
+        # La condición se evalúa dentro del navegador en cada frame, sin idas y vueltas desde Python
+        try:
+            await page.wait_for_function(
+                "([selector, previas]) => document.querySelectorAll(selector).length > previas",
+                arg=[SELECTOR_FILAS_TABLA, filas_previas], timeout=timeout_ms,
+            )
+            return True
+        except PlaywrightTimeoutError:
+            return False
+    filas = page.locator(SELECTOR_FILAS_TABLA)
+    limite = asyncio.get_running_loop().time() + timeout_ms / 1000
+    while asyncio.get_running_loop().time() < limite:
+        if await filas.count() > filas_previas:
+            return True
+        await asyncio.sleep(0.25)
+    return False
+
+async def _cargar_mas_filas(page: Page, filas_previas: int) -> bool:
+    """
+    Intenta que la tabla añada más filas: primero con el botón "cargar más"
+    y, si no existe, con scroll hasta la última fila (carga perezosa).
+    Devuelve True si aparecieron filas nuevas.
+    """
+    boton = page.locator(SELECTOR_CARGAR_MAS).first
+    if await boton.count() > 0 and await boton.is_visible() and await boton.is_enabled():
+        await boton.click()
+        return await _esperar_mas_filas(page, filas_previas)
+
+    if filas_previas == 0:
+        return False
+    filas = page.locator(SELECTOR_FILAS_TABLA)
+    try:
+        await filas.nth(filas_previas - 1).scroll_into_view_if_needed(timeout=2000)
+        # El datatable dispara su 'loadmore' al acercarse al final del contenedor con scroll
+        await filas.nth(filas_previas - 1).evaluate("""fila => {
+            let nodo = fila.parentElement;
+            while (nodo && nodo.scrollHeight <= nodo.clientHeight) { nodo = nodo.parentElement; }
+            if (nodo) { nodo.scrollTop = nodo.scrollHeight; }
+        }""")
+    except Exception:
+        return False
+
+    # Espera corta; solo alargamos si el datatable muestra que está cargando
+    if await _esperar_mas_filas(page, filas_previas, ESPERA_SCROLL_SIN_SPINNER_MS):
+        return True
+    if await page.locator(SELECTOR_SPINNER_TABLA).first.is_visible():
+        return await _esperar_mas_filas(page, filas_previas)
+    return False
+
+async def _pasar_pagina(page: Page) -> bool:
+    """
+    Avanza a la siguiente página de la tabla si hay paginación clásica.
+    Devuelve True si el contenido de la tabla cambió.
+    """
+    boton = page.locator(SELECTOR_PAGINA_SIGUIENTE).first
+    if await boton.count() == 0 or not await boton.is_visible() or not await boton.is_enabled():
+        return False
+
+    primera_celda = page.locator(SELECTOR_FILAS_TABLA).first.locator('td[data-label="FACTURA FISCAL"]')
+    anterior = (await primera_celda.inner_text()).strip() if await primera_celda.count() > 0 else None
+    await boton.click()
+
+    limite = asyncio.get_running_loop().time() + ESPERA_CARGA_FILAS_MS / 1000
+    while asyncio.get_running_loop().time() < limite:
+        if await primera_celda.count() > 0 and (await primera_celda.inner_text()).strip() != anterior:
+            return True
+        await asyncio.sleep(0.25)
+    return False
+
+# Lee las celdas de todas las filas en el propio navegador y devuelve registros planos
+_JS_LEER_FILAS = """(filas, columnas) => filas.map(fila => {
+    const registro = {};
+    for (const columna of columnas) {
+        const celda = fila.querySelector(`[data-label="${columna}"]`);
+        registro[columna] = celda ? celda.innerText : null;
+    }
+    return registro;
+})"""
+
+async def _leer_celdas_bulk(page: Page) -> list[dict]:
+    """
+    Lee las columnas de TODAS las filas renderizadas con un único
+    `evaluate_all` (una ida y vuelta al navegador para toda la tabla).
+    """
+    return await page.locator(SELECTOR_FILAS_TABLA).evaluate_all(_JS_LEER_FILAS, COLUMNAS_TABLA)
+
+async def _leer_celdas_fila(row: Locator) -> dict:
+    """Lectura clásica fila a fila: una llamada `inner_text()` por celda."""
+    return {
+        "CUPS": await row.locator('th[data-label="CUPS"]').inner_text(),
+        "FACTURA FISCAL": await row.locator('td[data-label="FACTURA FISCAL"]').inner_text(),
+        "FECHA": await row.locator('td[data-label="FECHA"]').inner_text(),
+        "TOTAL/PDTE": await row.locator('td[data-label="TOTAL/PDTE"]').inner_text(),
+        "Estado": await row.locator('td[data-label="Estado"]').inner_text(),
+        "Tipo": await row.locator('td[data-label="Tipo"]').inner_text(),
+    }
+
+def _asignar_celdas(factura: FacturaEndesaDistribucion, celdas: dict):
+    """Vuelca un registro de celdas de la tabla sobre el objeto factura."""
+    faltantes = [c for c in COLUMNAS_TABLA if celdas.get(c) is None]
+    if faltantes:
+        raise ValueError(f"Celdas no encontradas en la fila: {', '.join(faltantes)}")
+
+    factura.cups = celdas["CUPS"].strip()
+    factura.numero_factura = celdas["FACTURA FISCAL"].strip()
+    factura.fecha_emision = celdas["FECHA"].strip()
+    factura.importe_total_tabla = _clean_and_convert_float(celdas["TOTAL/PDTE"])
+    factura.estado_factura = celdas["Estado"].strip()
+    factura.tipo_factura = celdas["Tipo"].strip()
+    factura.descarga_selector = factura.numero_factura
+
+async def _iterar_filas_tabla(page: Page, antes_de_pasar_pagina: Callable[[], Awaitable] | None = None):
+    """
+    Generador asíncrono que recorre TODAS las filas de la tabla de facturas,
+    incluyendo "cargar más", scroll infinito y paginación clásica.
+    Emite (indice, fila, celdas) en cuanto cada fila está disponible y
+    descarta duplicados por número de factura. `celdas` es None si la
+    lectura en bloque falló y la fila debe leerse por la vía clásica.
+    `antes_de_pasar_pagina` se espera antes de cambiar de página, cuando las
+    filas actuales aún existen (p. ej. para terminar sus descargas).
+    """
+    vistas: set[str] = set()
+    indice = 0
+    posicion = 0
 
-async def _extraer_pagina_actual(page: Page) -> list[FacturaEndesaDistribucion]:
+    for _ in range(MAX_PAGINAS_TABLA):
+        filas = page.locator(SELECTOR_FILAS_TABLA)
+        total = await filas.count()
+        nuevas_en_bloque = 0
+
+        # Una sola ida y vuelta para todas las filas del bloque
+        registros: list[dict] | None = None
+        if LECTURA_TABLA_BULK and posicion < total:
+            try:
+                with tramo("lectura_tabla", filas=total - posicion):
+                    registros = await _leer_celdas_bulk(page)
+            except Exception as e:
+                escribir_log(f"    [!] Lectura en bloque fallida, se usa la lectura fila a fila: {e}")
+
+        while posicion < total:
+            fila = filas.nth(posicion)
+            celdas = registros[posicion] if registros and posicion < len(registros) else None
+            posicion += 1
+            try:
+                if celdas is None:
+                    with tramo("lectura_fila"):
+                        celdas = await _leer_celdas_fila(fila)
+                clave = (celdas.get("FACTURA FISCAL") or "").strip() or None
+            except Exception:
+                # Sin clave no podemos deduplicar: la emitimos para que se registre el error de estructura
+                celdas, clave = None, None
+            if clave:
+                if clave in vistas:
+                    continue
+                vistas.add(clave)
+            nuevas_en_bloque += 1
+            yield indice, fila, celdas
+            indice += 1
+
+        if await _cargar_mas_filas(page, total):
+            continue
+        if nuevas_en_bloque > 0 and antes_de_pasar_pagina is not None:
+            await antes_de_pasar_pagina()
+        if nuevas_en_bloque > 0 and await _pasar_pagina(page):
+            # Nueva página: las filas se sustituyen, volvemos a empezar desde la primera
+            escribir_log(f"    [PAGINACIÓN] Nueva página de resultados ({indice} filas hasta ahora).")
+            posicion = 0
+            continue
+        break
+
+async def _extraer_pagina_actual(page: Page, pipeline_ocr: PipelineOCR | None = None, indice: IndiceFacturas | None = None,
+                                 progreso: ProgresoEjecucion | None = None, vistas: dict | None = None,
+                                 max_filas: int | None = None, reutilizar_pdfs: bool = False) -> tuple[list[FacturaEndesaDistribucion], bool]:
     """
-    Extrae los datos de todas las filas visibles en la tabla y descarga el PDF.
+    Extrae los datos de todas las filas de la tabla (todas las páginas y
+    bloques de carga perezosa) y descarga el PDF.
+    Si se recibe un pipeline OCR, las facturas descargadas se encolan en él en
+    lugar de procesarse en línea. Si se recibe un índice (modo incremental),
+    las facturas ya completas y sin cambios se toman del índice sin descargarlas.
+    Las facturas presentes en `vistas` (ya leídas en esta ejecución) se reutilizan
+    tal cual. Con `max_filas`, la lectura se detiene al alcanzarlo. Con
+    `reutilizar_pdfs`, los PDF ya guardados en el almacén no se descargan de nuevo.
+    Devuelve las facturas y si la tabla se leyó completa.
     """
     facturas_pagina: list[FacturaEndesaDistribucion] = []
-    # Selector de filas basado en la tabla de Salesforce
-    rows = page.locator('table[lwc-392cvb27u8q] tbody tr')
-    row_count = await rows.count()
+    motor = MotorDescargas(page)
+    descargas_en_curso: list[asyncio.Task] = []
+    completa = True
 
-    if row_count == 0:
-        return facturas_pagina
-    
-    for i in range(row_count):
-        escribir_log(f"{'='*40} [ROW {i+1}]", mostrar_tiempo=False)
-        row = rows.nth(i)
+    async def _esperar_descargas():
+        # Una descarga directa fallida reintenta por clic sobre su fila: debe terminar antes de cambiar de página
+        if descargas_en_curso:
+            escribir_log(f"[FILES] Esperando {len(descargas_en_curso)} descargas directas en curso...")
+            await asyncio.gather(*descargas_en_curso)
+            descargas_en_curso.clear()
 
-        # Inicializamos la factura con valores por defecto
-        factura = FacturaEndesaDistribucion(
-            cups="PENDIENTE", 
-            error_RPA=False,
-            secuencial=str(i))
+    # Las filas se procesan según aparecen, sin esperar a que termine la paginación
+    async for i, row, celdas in _iterar_filas_tabla(page, _esperar_descargas):
+        if max_filas is not None and i >= max_filas:
+            completa = False
+            break
+        # Contexto de log por fila: las descargas lanzadas desde aquí lo heredan
+        with contexto_log():
+            escribir_log(f"{'='*40} [ROW {i+1}]", mostrar_tiempo=False)
+            if progreso is not None:
+                progreso.filas_procesadas += 1
+
+            # Inicializamos la factura con valores por defecto
+            factura = FacturaEndesaDistribucion(
+                cups="PENDIENTE", 
+                error_RPA=False,
+                secuencial=str(i))
 
-        try:
-            # Extracción de datos de la fila
-            cups_val = (await row.locator('th[data-label="CUPS"]').inner_text()).strip()
-            f_fiscal = (await row.locator('td[data-label="FACTURA FISCAL"]').inner_text()).strip()
-            fecha_em = (await row.locator('td[data-label="FECHA"]').inner_text()).strip()
-            imp_raw = await row.locator('td[data-label="TOTAL/PDTE"]').inner_text()
-            est = (await row.locator('td[data-label="Estado"]').inner_text()).strip()
-            tipo_f = (await row.locator('td[data-label="Tipo"]').inner_text()).strip()
-
-            # Asignamos los datos extraídos al objeto factura 
-            factura.cups = cups_val
-            factura.numero_factura = f_fiscal
-            factura.fecha_emision = fecha_em
-            factura.importe_total_tabla = _clean_and_convert_float(imp_raw)
-            factura.estado_factura = est
-            factura.tipo_factura = tipo_f
-            factura.descarga_selector = f_fiscal
-
-            escribir_log(f"    [OK] Datos extraídos: Factura {factura.numero_factura} ({factura.cups})")
-
-            # Validación de Importe Negativo (Requisito de negocio)
-            if factura.importe_total_tabla < 0:
-                factura.error_RPA = True
-                factura.direccion_suministro = "NOTIFICACIÓN: Factura rectificativa o importe negativo."
-                escribir_log("    [!] Importe negativo detectado.")
-            
-            # Proceso de Descarga de PDF (Solo si no hay error previo)
-            escribir_log(f"[FILES]")
             try:
-                ruta_pdf = await _descargar_archivo_fila(page, row, factura)
-                if not ruta_pdf:
-                    raise Exception("NO_DISPONIBLE: No existe botón PDF.")
-                # === INTEGRACION OCR ===
-                if not factura.error_RPA and factura.importe_total_tabla >= 0:
-                    escribir_log(f"    -> [OCR]")
-                    exito_ocr = procesar_pdf_local(factura, ruta_pdf)
-                    if exito_ocr:
-                        escribir_log(f"        -> [OK] OCR completado para {factura.numero_factura}")
-                    else:
-                        escribir_log(f"        -> [!] [OCR] No se pudieron extraer datos adicionales.")
-
-            except Exception as e_pdf:
+                # Extracción de datos de la fila (ya leídos en bloque o, si no, fila a fila)
+                if celdas is None:
+                    celdas = await _leer_celdas_fila(row)
+                _asignar_celdas(factura, celdas)
+                anotar_contexto(cups=factura.cups, factura=factura.numero_factura)
+
+                escribir_log(f"    [OK] Datos extraídos: Factura {factura.numero_factura} ({factura.cups})")
+
+                # Ya leída en otra ventana de esta ejecución: no se descarga de nuevo
+                clave = (factura.cups, factura.numero_factura)
+                if vistas is not None:
+                    if clave in vistas:
+                        facturas_pagina.append(vistas[clave])
+                        escribir_log(f"    [DUPLICADA] Factura {factura.numero_factura} ya leída en esta ejecución.")
+                        continue
+                    vistas[clave] = factura
+
+                # Modo incremental: si ya está completa y no ha cambiado, omitimos descarga y OCR
+                if indice is not None:
+                    factura_indexada = indice.factura_reutilizable(factura)
+                    if factura_indexada is not None:
+                        factura_indexada.secuencial = factura.secuencial
+                        if vistas is not None:
+                            vistas[clave] = factura_indexada
+                        facturas_pagina.append(factura_indexada)
+                        escribir_log(f"    [INCREMENTAL] Factura {factura.numero_factura} ya procesada. Se omite descarga y OCR.")
+                        continue
+
+                # Validación de Importe Negativo (Requisito de negocio)
+                if factura.importe_total_tabla < 0:
+                    factura.error_RPA = True
+                    factura.direccion_suministro = "NOTIFICACIÓN: Factura rectificativa o importe negativo."
+                    escribir_log("    [!] Importe negativo detectado.")
+            
+                # Proceso de Descarga de PDF
+                escribir_log(f"[FILES]")
+                if motor.modo_directo:
+                    # Descarga directa por HTTP: se lanza en paralelo y seguimos leyendo filas
+                    fila_estable = _fila_de_factura(page, factura.numero_factura)
+                    descargas_en_curso.append(asyncio.create_task(
+                        _descargar_y_procesar(motor, fila_estable, factura, pipeline_ocr, reutilizar_pdfs)
+                    ))
+                else:
+                    await _descargar_y_procesar(motor, row, factura, pipeline_ocr, reutilizar_pdfs)
+
+            except Exception as e_critico:
+                # Este bloque captura errores si falla la lectura de la propia tabla (selectores)
                 factura.error_RPA = True
-                # Concatenamos el error del PDF al mensaje existente (si lo hay)
-                msg_error = str(e_pdf).split("Call log:")[0].strip()
-                
-                # Concatenamos de forma limpia
-                prefijo = (factura.direccion_suministro + " | ") if factura.direccion_suministro else ""
-                factura.direccion_suministro = f"{prefijo}ERROR_PDF: {msg_error}"
-                
-                escribir_log(f"    -> [!] {msg_error}", mostrar_tiempo=False)
+                factura.direccion_suministro = f"ERROR_ESTRUCTURA_TABLA: {str(e_critico)}"
+                contar_error_rpa("ERROR_ESTRUCTURA_TABLA")
+                escribir_log(f"    [CRÍTICO] Fallo estructural en fila {i+1}: {e_critico}")
         
+            facturas_pagina.append(factura)
 
-        except Exception as e_critico:
-            # Este bloque captura errores si falla la lectura de la propia tabla (selectores)
-            factura.error_RPA = True
-            factura.direccion_suministro = f"ERROR_ESTRUCTURA_TABLA: {str(e_critico)}"
-            escribir_log(f"    [CRÍTICO] Fallo estructural en fila {i+1}: {e_critico}")
-        
-        facturas_pagina.append(factura)
+    await _esperar_descargas()
+    escribir_log(f"[FILES] PDF descargados: {motor.directas} directos, {motor.por_clic} por clic.")
 
-    return facturas_pagina
+    return facturas_pagina, completa
 
 
 # --- FUNCIONES AUXILIARES DE FLUJO ---
@@ -221,6 +483,11 @@ async def _iniciar_sesion(page: Page, username: str, password: str) -> bool:
         await page.wait_for_selector('input[name="username"]', timeout=20000)
         await page.fill('input[name="username"]', username)
         await page.fill('input[name="password"]', password)
+        if es_modo_rapido(page):
+            # Basta con salir del formulario de login; no esperamos a que calle la red
+            await page.click('button:has-text("ENTRAR")')
+            await page.wait_for_url(lambda url: "/login" not in url, wait_until="domcontentloaded", timeout=ESPERA_NAVEGACION_MS)
+            return True
         await page.click('button:has-text("ENTRAR")')
         await page.wait_for_load_state("networkidle")
         return True
@@ -228,6 +495,80 @@ async def _iniciar_sesion(page: Page, username: str, password: str) -> bool:
         escribir_log(f"Error en la autenticación: {e}")
         return False
 
+async def _login_con_reintentos(page: Page, cuenta: Cuenta | None = None) -> bool:
+    """
+    Realiza el login de la cuenta (la cuenta por defecto si no se indica) con
+    hasta MAX_LOGIN_ATTEMPTS intentos sobre el mismo navegador: entre
+    intentos solo se limpian las cookies del contexto.
+    """
+    cuenta = cuenta or obtener_registro_cuentas().obtener()
+    for attempt in range(1, MAX_LOGIN_ATTEMPTS + 1):
+        escribir_log(f"[LOGIN] [{cuenta.nombre}] Intento {attempt}/{MAX_LOGIN_ATTEMPTS}...", pretexto="\n\t")
+        try:
+            with tramo("login", intento=attempt, cuenta=cuenta.nombre) as t:
+                await page.goto(URL_LOGIN, wait_until="domcontentloaded", timeout=60000)
+                t["ok"] = await _iniciar_sesion(page, cuenta.usuario, cuenta.password)
+            INTENTOS_LOGIN.inc(resultado="ok" if t["ok"] else "fallido")
+            if t["ok"]:
+                escribir_log(f"[LOGIN] Sesión establecida correctamente.")
+                return True
+        except Exception as e:
+            INTENTOS_LOGIN.inc(resultado="error")
+            escribir_log(f"Error al cargar la página de login: {e}")
+
+        escribir_log(f"[ADVERTENCIA] Intento de login {attempt} fallido. Limpiando sesión.")
+        await page.context.clear_cookies()
+        if attempt < MAX_LOGIN_ATTEMPTS:
+            await asyncio.sleep(5)
+
+    escribir_log(f"Fallo crítico: No se pudo acceder al portal tras {MAX_LOGIN_ATTEMPTS} intentos.")
+    return False
+
+async def _sesion_valida(page: Page) -> bool:
+    """
+    Comprueba si el contexto sigue autenticado: la página de facturas debe
+    mostrar el selector de rol y no redirigir al formulario de login.
+    """
+    try:
+        await page.goto(URL_FACTURAS, wait_until="domcontentloaded", timeout=60000)
+        await page.wait_for_selector('button[title="Cambio de rol"], input[name="username"]', timeout=20000)
+    except Exception:
+        return False
+    return "/login" not in page.url and await page.locator('button[title="Cambio de rol"]').count() > 0
+
+def _ruta_estado_cuenta(cuenta: Cuenta) -> str:
+    """Estado de sesión guardado de la cuenta (la cuenta por defecto conserva el archivo de siempre)."""
+    if cuenta.nombre == CUENTA_POR_DEFECTO:
+        return RUTA_ESTADO_SESION
+    nombre = re.sub(r"[^\w.-]", "_", cuenta.nombre)
+    return os.path.join(os.path.dirname(RUTA_ESTADO_SESION), f"sesion_edistribucion_{nombre}.json")
+
+def crear_pool_navegadores(max_sesiones: int | None = None, modo_rapido: bool | None = None, cuenta: Cuenta | None = None,
+                           lanzador: LanzadorChromium | None = None, limite_global: asyncio.Semaphore | None = None) -> PoolNavegadores:
+    """
+    Pool de navegadores de una cuenta (la cuenta por defecto si no se indica),
+    configurado con su login, su estado de sesión y la validación del portal.
+    """
+    cuenta = cuenta or obtener_registro_cuentas().obtener()
+
+    async def autenticar(page: Page) -> bool:
+        return await _login_con_reintentos(page, cuenta)
+
+    return PoolNavegadores(
+        validar_sesion=_sesion_valida,
+        autenticar=autenticar,
+        max_sesiones=max_sesiones or cuenta.max_sesiones,
+        ruta_estado=_ruta_estado_cuenta(cuenta),
+        modo_rapido=modo_rapido,
+        lanzador=lanzador,
+        limite_global=limite_global,
+        nombre=cuenta.nombre,
+    )
+
+def crear_pool_cuenta(cuenta: Cuenta, lanzador: LanzadorChromium, limite_global: asyncio.Semaphore) -> PoolNavegadores:
+    """Creador de pools para el planificador de cuentas (ver planificador_cuentas.py)."""
+    return crear_pool_navegadores(cuenta=cuenta, lanzador=lanzador, limite_global=limite_global)
+
 async def obtener_todos_los_roles(page: Page) -> list[str]:
     """Extrae los nombres de todos los roles del desplegable filtrando valores nulos."""
     escribir_log("Obteniendo lista de roles disponibles...")
@@ -263,124 +604,808 @@ async def seleccionar_rol_especifico(page: Page, nombre_rol: str):
     clases = await opcion.get_attribute("class")
     if "wp-roleSelected" in (clases or ""):
         await page.locator('button[title="Cambio de rol"]').click()
+    elif es_modo_rapido(page):
+        # El cambio de rol recarga la página: esperamos a que llegue la respuesta, no a que calle la red
+        try:
+            async with page.expect_navigation(wait_until="commit", timeout=ESPERA_NAVEGACION_MS):
+                await opcion.click()
+        except PlaywrightTimeoutError:
+            await page.wait_for_load_state("networkidle")
     else:
         await opcion.click()
         await page.wait_for_load_state("networkidle")
 
+async def _esperar_tabla(page: Page) -> bool:
+    """Modo rápido: espera a que aparezca la tabla o el aviso de sin resultados, lo que ocurra antes."""
+    tabla = page.locator(SELECTOR_CELDA_TABLA).first
+    try:
+        await tabla.or_(page.locator(SELECTOR_SIN_RESULTADOS).first).first.wait_for(state="visible", timeout=ESPERA_TABLA_MS)
+    except PlaywrightTimeoutError:
+        return False
+    if await tabla.is_visible():
+        escribir_log("    [OK] Tabla cargada con éxito.")
+        return True
+    escribir_log("    [INFO] Sin resultados para este periodo.")
+    return False
+
 async def aplicar_filtros_fechas(page: Page, f_desde, f_hasta):
-    await page.goto(URL_FACTURAS, wait_until="networkidle")
+    rapido = es_modo_rapido(page)
+    await page.goto(URL_FACTURAS, wait_until="domcontentloaded" if rapido else "networkidle")
     
     # Activar radio de rango
     await page.locator('span.slds-form-element__label:has-text("Rango de fechas")').click()
-    await page.wait_for_timeout(1000)
-    
-    await page.fill('.filter-date-from input', "")
-    await page.type('.filter-date-from input', f_desde, delay=60)
-    await page.fill('.filter-date-to input', "")
-    await page.type('.filter-date-to input', f_hasta, delay=60)
+    if rapido:
+        # Las fechas se escriben de una vez en cuanto los campos están visibles
+        await page.locator('.filter-date-from input').wait_for(state="visible")
+        await page.fill('.filter-date-from input', f_desde)
+        await page.fill('.filter-date-to input', f_hasta)
+    else:
+        await page.wait_for_timeout(1000)
+
+        await page.fill('.filter-date-from input', "")
+        await page.type('.filter-date-from input', f_desde, delay=60)
+        await page.fill('.filter-date-to input', "")
+        await page.type('.filter-date-to input', f_hasta, delay=60)
     
     await page.locator('button:has-text("Aplicar")').last.click()
     escribir_log("Filtros Aplicados. Esperando carga de tabla (Máx 60s)...")
+    if rapido:
+        return await _esperar_tabla(page)
 
     for i in range(30):
-        if await page.locator('lightning-primitive-cell-factory').first.is_visible():
+        if await page.locator(SELECTOR_CELDA_TABLA).first.is_visible():
             escribir_log("    [OK] Tabla cargada con éxito.")
             return True
-        if await page.is_visible('div:has-text("No se encuentran resultados")'):
+        if await page.is_visible(SELECTOR_SIN_RESULTADOS):
             escribir_log("    [INFO] Sin resultados para este periodo.")
             return False
         await asyncio.sleep(2)
     return False
 
 
+def _clave_factura(factura: FacturaEndesaDistribucion):
+    """Clave de de-duplicación; las filas sin número legible no se fusionan entre sí."""
+    if factura.numero_factura and factura.numero_factura != "N/A" and factura.cups != "PENDIENTE":
+        return (factura.cups, factura.numero_factura)
+    return id(factura)
+
+
+class EjecucionRPA:
+    """
+    Estado compartido de una ejecución del robot: parámetros, etapas
+    (pipeline OCR, índice) y progreso, para no arrastrarlos función a función.
+    """
+    def __init__(self, fecha_desde: str, fecha_hasta: str, incremental: bool = False, progreso: ProgresoEjecucion | None = None,
+                 eventos: asyncio.Queue | None = None, reanudar: bool = False, id_ejecucion: str | None = None,
+                 cuenta: str = CUENTA_POR_DEFECTO):
+        # Identificador de la ejecución en las líneas de log y en el diario (el de la original si se retoma)
+        self.id = id_ejecucion or uuid.uuid4().hex[:12]
+        # Cuenta del portal con la que se ejecuta: etiqueta los resultados y separa sus ventanas en el índice
+        self.cuenta = cuenta
+        self.retomada = id_ejecucion is not None
+        self.fecha_desde = fecha_desde
+        self.fecha_hasta = fecha_hasta
+        self.incremental = incremental
+        self.reanudar = reanudar
+        self.progreso = progreso if progreso is not None else ProgresoEjecucion()
+        self.progreso.id_ejecucion = self.id
+        self.diario = obtener_diario()
+        # El índice se actualiza siempre; solo se consulta para omitir facturas en modo incremental
+        self.indice = obtener_indice()
+        # PipelineOCR (OCR en línea) o LoteOCR (Batch API), con la misma interfaz
+        self.pipeline_ocr: PipelineOCR | LoteOCR | None = None
+        # Resultados por posición del rol (de-duplicados por factura), para fusionarlos en orden estable
+        self.resultados: dict[int, dict] = {}
+        # Facturas ya leídas en cualquier ventana, para no descargarlas dos veces
+        self.vistas: dict[tuple[str, str], FacturaEndesaDistribucion] = {}
+        # Ventanas pendientes (en cola o en proceso), en total y por rol
+        self.ventanas_pendientes = 0
+        self.num_workers = 1
+        self.pendientes_por_rol: dict[int, int] = {}
+        self.roles_iniciados: set[int] = set()
+        self.roles_con_fallos: set[int] = set()
+        # Tareas que registran cada ventana cuando termina el OCR de sus facturas
+        self.cierres_ventana: list[asyncio.Task] = []
+        self.cierres_por_rol: dict[int, list[asyncio.Task]] = {}
+        # Tareas que guardan cada rol al terminar su OCR, y roles ya guardados
+        self.exportaciones: list[asyncio.Task] = []
+        self.roles_exportados: set[int] = set()
+        # Cola de eventos para el modo streaming (None si nadie los consume)
+        self.eventos = eventos
+        self._emitidas: set[int] = set()
+
+    @property
+    def indice_incremental(self) -> IndiceFacturas | None:
+        return self.indice if self.incremental else None
+
+    def rol_indice(self, rol: str) -> str:
+        """Rol con el que se registran las ventanas en el índice: dos cuentas pueden ver roles con el mismo nombre."""
+        return rol if self.cuenta == CUENTA_POR_DEFECTO else f"{self.cuenta}/{rol}"
+
+    def acumular(self, posicion: int, facturas: list[FacturaEndesaDistribucion]):
+        """Añade facturas al resultado del rol, descartando las ya presentes."""
+        resultado_rol = self.resultados.setdefault(posicion, {})
+        for factura in facturas:
+            clave = _clave_factura(factura)
+            if clave not in resultado_rol:
+                resultado_rol[clave] = factura
+                self.progreso.facturas.append(factura)
+
+    def emitir(self, evento: str, **datos):
+        if self.eventos is not None:
+            self.eventos.put_nowait({"evento": evento, **datos})
+
+    def emitir_factura(self, factura: FacturaEndesaDistribucion):
+        """Emite una factura terminada, una sola vez aunque llegue por dos caminos."""
+        if self.eventos is None or id(factura) in self._emitidas:
+            return
+        self._emitidas.add(id(factura))
+        self.emitir("factura", factura=factura.model_dump(mode="json"))
+
+    def emitir_facturas_rol(self, facturas: list[FacturaEndesaDistribucion]):
+        """
+        Al cerrar una ventana, emite las facturas que no dependen del OCR (reutilizadas,
+        con error de descarga...). Las que siguen en la cola se emitirán al terminar.
+        """
+        for factura in facturas:
+            if self.pipeline_ocr is None or not self.pipeline_ocr.pendiente(factura):
+                self.emitir_factura(factura)
+
+
+async def _procesar_ventana(page: Page, rol: str, desde: date, hasta: date, ejecucion: EjecucionRPA,
+                            cambiar_rol: bool = True) -> tuple[list[FacturaEndesaDistribucion], bool]:
+    """
+    Selecciona el rol (si la página no está ya en él), aplica el filtro de
+    fechas de la ventana y extrae sus facturas. El OCR de las facturas se
+    delega en el pipeline de la ejecución. Devuelve las facturas y si la
+    ventana se leyó completa (False si superó MAX_FILAS_VENTANA y debe partirse).
+    """
+    escribir_log(f"{'='*40}", pretexto="\n", mostrar_tiempo=False)
+    escribir_log(f"PROCESANDO EMPRESA: {rol} ({a_texto(desde)} - {a_texto(hasta)})")
+    escribir_log(f"{'='*80}", mostrar_tiempo=False)
+
+    if cambiar_rol:
+        with tramo("cambio_rol"):
+            await seleccionar_rol_especifico(page, rol)
+
+    escribir_log(f"[BUSQUEDA]")
+    with tramo("filtro", desde=a_texto(desde), hasta=a_texto(hasta)) as t:
+        hay_datos = await aplicar_filtros_fechas(page, a_texto(desde), a_texto(hasta))
+        t["con_datos"] = hay_datos
+    if not hay_datos:
+        return [], True
+
+    escribir_log(f"[EXTRACCIÓN]")
+    # Una ventana de un solo día no se puede partir: se lee entera
+    max_filas = MAX_FILAS_VENTANA if desde < hasta else None
+    facturas, completa = await _extraer_pagina_actual(
+        page, ejecucion.pipeline_ocr, ejecucion.indice_incremental, ejecucion.progreso, ejecucion.vistas, max_filas,
+        reutilizar_pdfs=ejecucion.retomada
+    )
+    escribir_log(f"{'='*80}", mostrar_tiempo=False)
+    escribir_log(f"[OK] {len(facturas)} facturas leídas para {rol} ({a_texto(desde)} - {a_texto(hasta)}).")
+    return facturas, completa
+
+def _registrar_en_indice(indice: IndiceFacturas, facturas: list[FacturaEndesaDistribucion]):
+    """Actualiza el índice de facturas con el resultado final de una ventana."""
+    try:
+        indice.registrar_lote([(f, _ruta_pdf_guardado(f.cups, f.numero_factura)) for f in facturas])
+    except Exception as e:
+        escribir_log(f"    -> [ERROR INDICE] Fallo al actualizar el índice de facturas: {e}")
+
+async def _cerrar_ventana(ejecucion: EjecucionRPA, rol: str, desde: date, hasta: date, facturas: list[FacturaEndesaDistribucion]):
+    """
+    Cuando termina el OCR de las facturas de una ventana, las registra en el
+    índice y marca la ventana como completada (solo si ninguna quedó con
+    error técnico), para que un backfill interrumpido pueda reanudarse.
+    """
+    if ejecucion.pipeline_ocr is not None:
+        await ejecucion.pipeline_ocr.esperar(facturas)
+    _registrar_en_indice(ejecucion.indice, facturas)
+    for f in facturas:
+        FACTURAS_PROCESADAS.inc(estado=estado_proceso_de(f))
+    _anotar_diario(ejecucion.diario.avanzar_facturas, ejecucion.id, rol,
+                   [(f, ETAPA_EXTRAIDA) for f in facturas if estado_proceso_de(f) == ESTADO_COMPLETA])
+    if any(estado_proceso_de(f) == ESTADO_ERROR for f in facturas):
+        return
+    try:
+        ejecucion.indice.registrar_ventana(ejecucion.rol_indice(rol), desde, hasta, facturas)
+    except Exception as e:
+        escribir_log(f"    -> [ERROR INDICE] Fallo al registrar la ventana {a_texto(desde)} - {a_texto(hasta)} de {rol}: {e}")
+
+def _anotar_diario(metodo, *args):
+    """Escribe en el diario de ejecuciones; un fallo del diario no detiene la ejecución."""
+    try:
+        metodo(*args)
+    except Exception as e:
+        escribir_log(f"    -> [ERROR DIARIO] Fallo al actualizar el diario de ejecuciones: {e}")
+
+def _etapas_ventana(facturas: list[FacturaEndesaDistribucion]) -> list[tuple[FacturaEndesaDistribucion, str]]:
+    """Etapa de cada factura al terminar de leer su ventana: DESCARGADA si su PDF está en el almacén."""
+    return [
+        (f, ETAPA_DESCARGADA if _ruta_pdf_guardado(f.cups, f.numero_factura) else ETAPA_LISTADA)
+        for f in facturas if isinstance(_clave_factura(f), tuple)
+    ]
+
+def _exportar_facturas_rol(ejecucion: EjecucionRPA, posicion: int, rol: str, facturas: list[FacturaEndesaDistribucion]):
+    """
+    Guarda las facturas del rol en el almacén de resultados y lo anota en el
+    diario. El rol solo queda EXPORTADO si ninguna ventana falló y ninguna
+    factura quedó con error técnico: al retomar, se vuelve a visitar.
+    """
+    guardado = _guardar_resultados(facturas, rol, ejecucion.cuenta)
+    ejecucion.roles_exportados.add(posicion)
+    if not guardado:
+        return
+    _anotar_diario(ejecucion.diario.avanzar_facturas, ejecucion.id, rol,
+                   [(f, ETAPA_EXPORTADA) for f in facturas if estado_proceso_de(f) == ESTADO_COMPLETA])
+    if posicion not in ejecucion.roles_con_fallos and not any(estado_proceso_de(f) == ESTADO_ERROR for f in facturas):
+        _anotar_diario(ejecucion.diario.avanzar_roles, ejecucion.id, [(posicion, rol)], ETAPA_EXPORTADA)
+
+async def _exportar_rol(ejecucion: EjecucionRPA, posicion: int, rol: str):
+    """Cuando termina el OCR de todas las ventanas del rol, lo guarda sin esperar al resto de roles."""
+    await asyncio.gather(*ejecucion.cierres_por_rol.get(posicion, []))
+    facturas = list(ejecucion.resultados.get(posicion, {}).values())
+    if ejecucion.pipeline_ocr is not None:
+        await ejecucion.pipeline_ocr.esperar(facturas)
+    if posicion not in ejecucion.roles_con_fallos and not any(estado_proceso_de(f) == ESTADO_ERROR for f in facturas):
+        _anotar_diario(ejecucion.diario.avanzar_roles, ejecucion.id, [(posicion, rol)], ETAPA_EXTRAIDA)
+    _exportar_facturas_rol(ejecucion, posicion, rol, facturas)
+
+def _preparar_reanudacion(ejecucion: EjecucionRPA, roles: list[str]) -> set[int]:
+    """
+    Al retomar una ejecución, los roles ya exportados se sirven desde el
+    índice sin visitar el portal, y las facturas ya extraídas del resto se
+    reutilizan tal cual. Devuelve las posiciones de los roles que se omiten.
+    """
+    exportados = set(ejecucion.diario.roles_en_etapa(ejecucion.id, ETAPA_EXPORTADA))
+    omitidos = set()
+    for posicion, rol in enumerate(roles):
+        if rol not in exportados:
+            continue
+        facturas = ejecucion.indice.cargar_facturas(ejecucion.diario.facturas_en_etapa(ejecucion.id, ETAPA_LISTADA, rol))
+        ejecucion.acumular(posicion, facturas)
+        ejecucion.roles_exportados.add(posicion)
+        ejecucion.progreso.roles_completados += 1
+        ejecucion.emitir_facturas_rol(facturas)
+        ejecucion.emitir("rol", rol=rol, estado="COMPLETADO", facturas=len(facturas),
+                         roles_completados=ejecucion.progreso.roles_completados, roles_totales=ejecucion.progreso.roles_totales)
+        omitidos.add(posicion)
+    extraidas = ejecucion.indice.cargar_facturas(ejecucion.diario.facturas_en_etapa(ejecucion.id, ETAPA_EXTRAIDA))
+    for factura in extraidas:
+        ejecucion.vistas[(factura.cups, factura.numero_factura)] = factura
+    escribir_log(f"[DIARIO] Retomando la ejecución {ejecucion.id}: {len(omitidos)}/{len(roles)} roles ya exportados, "
+                 f"{len(extraidas)} facturas ya extraídas.")
+    return omitidos
+
+def _ventana_ya_completada(ejecucion: EjecucionRPA, rol: str, desde: date, hasta: date) -> list[FacturaEndesaDistribucion] | None:
+    """
+    En modo reanudación, si ventanas ya registradas cubren [desde, hasta]
+    para el rol, devuelve sus facturas desde el índice sin visitar el portal.
+    """
+    if not ejecucion.reanudar:
+        return None
+    completadas = ejecucion.indice.ventanas_completadas(ejecucion.rol_indice(rol), desde, hasta)
+    if not rangos_cubren([(d, h) for d, h, _ in completadas], desde, hasta):
+        return None
+    claves = list(dict.fromkeys(c for _, _, claves in completadas for c in claves))
+    return ejecucion.indice.cargar_facturas(claves)
+
+async def _worker_ventanas(id_worker: int, page: Page, cola_ventanas: asyncio.Queue, ejecucion: EjecucionRPA):
+    """
+    Consume ventanas (rol, rango de fechas) de la cola compartida hasta que no
+    queda ninguna pendiente. Una ventana con demasiadas filas se parte en dos
+    y sus mitades vuelven a la cola; las facturas ya leídas no se descargan de nuevo.
+    """
+    rol_actual = None
+    while True:
+        unidad = await cola_ventanas.get()
+        if unidad is None:
+            return
+        posicion, rol, desde, hasta = unidad
+        # Cada worker es su propia tarea: el rol solo afecta a sus líneas de log (y a las tareas que lance)
+        anotar_contexto(rol=rol)
+        if posicion not in ejecucion.roles_iniciados:
+            ejecucion.roles_iniciados.add(posicion)
+            ejecucion.emitir("rol", rol=rol, estado="INICIADO")
+        partida = False
+        try:
+            facturas = _ventana_ya_completada(ejecucion, rol, desde, hasta)
+            if facturas is not None:
+                escribir_log(f"[REANUDACIÓN] Ventana {a_texto(desde)} - {a_texto(hasta)} de {rol} ya completada: {len(facturas)} facturas del índice.")
+                _anotar_diario(ejecucion.diario.avanzar_facturas, ejecucion.id, rol, [(f, ETAPA_EXTRAIDA) for f in facturas])
+            else:
+                facturas, completa = await _procesar_ventana(page, rol, desde, hasta, ejecucion, cambiar_rol=(rol != rol_actual))
+                rol_actual = rol
+                _anotar_diario(ejecucion.diario.avanzar_facturas, ejecucion.id, rol, _etapas_ventana(facturas))
+                if completa:
+                    cierre = asyncio.create_task(_cerrar_ventana(ejecucion, rol, desde, hasta, facturas))
+                    ejecucion.cierres_ventana.append(cierre)
+                    ejecucion.cierres_por_rol.setdefault(posicion, []).append(cierre)
+                else:
+                    # Demasiadas filas: partimos la ventana y reencolamos las mitades
+                    mitades = partir_ventana(desde, hasta)
+                    escribir_log(f"[VENTANAS] {rol}: {a_texto(desde)} - {a_texto(hasta)} supera {MAX_FILAS_VENTANA} filas. Se parte en {len(mitades)}.")
+                    for mitad_desde, mitad_hasta in mitades:
+                        ejecucion.ventanas_pendientes += 1
+                        ejecucion.pendientes_por_rol[posicion] += 1
+                        ejecucion.progreso.ventanas_totales += 1
+                        cola_ventanas.put_nowait((posicion, rol, mitad_desde, mitad_hasta))
+                    partida = True
+        except Exception as e:
+            escribir_log(f"[ERROR] [WORKER {id_worker}] Fallo en ROL {rol} ({a_texto(desde)} - {a_texto(hasta)}): {e}")
+            facturas = []
+            ejecucion.roles_con_fallos.add(posicion)
+            # Tras un fallo no sabemos en qué estado quedó la página: se vuelve a seleccionar el rol
+            rol_actual = None
+
+        ejecucion.acumular(posicion, facturas)
+        ejecucion.emitir_facturas_rol(facturas)
+        ejecucion.progreso.ventanas_completadas += 1
+        ejecucion.emitir(
+            "ventana", rol=rol, desde=a_texto(desde), hasta=a_texto(hasta), facturas=len(facturas), partida=partida
+        )
+
+        ejecucion.pendientes_por_rol[posicion] -= 1
+        if ejecucion.pendientes_por_rol[posicion] == 0:
+            ejecucion.progreso.roles_completados += 1
+            if posicion not in ejecucion.roles_con_fallos:
+                _anotar_diario(ejecucion.diario.avanzar_roles, ejecucion.id, [(posicion, rol)], ETAPA_DESCARGADA)
+            # Con OCR por lotes las facturas siguen pendientes: los roles se guardan al final
+            if not isinstance(ejecucion.pipeline_ocr, LoteOCR):
+                ejecucion.exportaciones.append(asyncio.create_task(_exportar_rol(ejecucion, posicion, rol)))
+            ejecucion.emitir(
+                "rol", rol=rol, estado="FALLIDO" if posicion in ejecucion.roles_con_fallos else "COMPLETADO",
+                facturas=len(ejecucion.resultados.get(posicion, {})),
+                roles_completados=ejecucion.progreso.roles_completados, roles_totales=ejecucion.progreso.roles_totales
+            )
+
+        ejecucion.ventanas_pendientes -= 1
+        if ejecucion.ventanas_pendientes == 0:
+            # No queda trabajo: despertamos a todos los workers para que terminen
+            for _ in range(ejecucion.num_workers):
+                cola_ventanas.put_nowait(None)
+
+
 # --------------------------------------------------------------------------------
 # --- FUNCIÓN PRINCIPAL PARA LA API ---
 # --------------------------------------------------------------------------------
 
-async def ejecutar_robot_api(fecha_desde: str, fecha_hasta: str) -> list[FacturaEndesaDistribucion]:
-    robot = NavegadorAsync()
+async def ejecutar_robot_api(fecha_desde: str, fecha_hasta: str, num_workers: int | None = None, incremental: bool = False,
+                             pool: PoolNavegadores | None = None, progreso: ProgresoEjecucion | None = None,
+                             eventos: asyncio.Queue | None = None, reanudar: bool = False,
+                             ocr_lote: bool | None = None, id_ejecucion: str | None = None,
+                             cuenta: str | None = None) -> list[FacturaEndesaDistribucion]:
+    """
+    Ejecuta el proceso RPA completo para todos los roles de una cuenta del
+    portal (la cuenta por defecto si no se indica).
+    El rango se divide en ventanas (mensuales por defecto) que se reparten
+    entre los contextos de navegador; las facturas se de-duplican por
+    (cups, numero_factura). Con reanudar=True, las ventanas ya completadas
+    en una ejecución anterior se sirven desde el índice sin visitar el portal.
+    Si se recibe un pool (API; debe ser el de la cuenta), reutiliza su
+    navegador y su sesión; si no, lanza un pool propio solo para esta
+    ejecución. Los contextos en paralelo se limitan a los `max_workers` de
+    la cuenta y los resultados se guardan etiquetados con ella. El progreso, si se
+    proporciona, se actualiza en vivo (roles, filas, cola OCR). Si se recibe
+    una cola de eventos, se publican en ella los roles y las facturas terminadas.
+    Con ocr_lote=True, las facturas que necesitan el LLM se envían al final en
+    un lote de la Batch API y se devuelven en estado PENDIENTE_OCR hasta que
+    el lote se concilia (ver lote_ocr.py).
+    Cada rol y cada factura quedan anotados en el diario de ejecuciones por
+    etapas; con id_ejecucion se retoma una ejecución anterior desde su último
+    punto de control (ver reanudar_ejecucion).
+    """
     todas_las_facturas = []
-    login_successful = False
+    cuenta_portal = obtener_registro_cuentas().obtener(cuenta)
+    num_workers = max(1, num_workers or NUM_WORKERS_ROLES)
+    if cuenta_portal.max_workers:
+        # Límite por cuenta: varios contextos sobre la misma sesión pueden disparar bloqueos en el portal
+        num_workers = min(num_workers, cuenta_portal.max_workers)
+    ocr_lote = OCR_LOTE if ocr_lote is None else ocr_lote
+    ejecucion = EjecucionRPA(fecha_desde, fecha_hasta, incremental, progreso, eventos, reanudar, id_ejecucion, cuenta_portal.nombre)
+    pool_propio = pool is None
+
+    desde, hasta = a_fecha(fecha_desde), a_fecha(fecha_hasta)
+    if desde is None or hasta is None or desde > hasta:
+        raise ValueError(f"Rango de fechas inválido: {fecha_desde} - {fecha_hasta}")
+    ventanas = dividir_rango(desde, hasta)
+    token_log = anotar_contexto(ejecucion=ejecucion.id, cuenta=ejecucion.cuenta)
+    _anotar_diario(ejecucion.diario.iniciar, ejecucion.id, fecha_desde, fecha_hasta,
+                   {"incremental": incremental, "num_workers": num_workers, "ocr_lote": ocr_lote, "cuenta": ejecucion.cuenta})
     
     try:
-        escribir_log(f"    [INICIO] Proceso RPA Edistribución. Desde={fecha_desde}, Hasta={fecha_hasta}", pretexto="\n")
+        escribir_log(f"    [INICIO] Proceso RPA Edistribución. Cuenta={ejecucion.cuenta}, Desde={fecha_desde}, Hasta={fecha_hasta}, Incremental={incremental}, Ventanas={len(ventanas)}", pretexto="\n")
         escribir_log(f"{'='*40} ", mostrar_tiempo=False)
-        
-        for attempt in range(1, MAX_LOGIN_ATTEMPTS + 1):
-            escribir_log(f"[LOGIN] Intento {attempt}/{MAX_LOGIN_ATTEMPTS}...", pretexto="\n\t")
-            await robot.iniciar()
-            await robot.goto_url(URL_LOGIN)
-            
-            login_successful = await _iniciar_sesion(robot.get_page(), USER, PASSWORD)
-            if login_successful:
-                escribir_log(f"[LOGIN] Sesión establecida correctamente.")
-                break
-            
-            escribir_log(f"[ADVERTENCIA] Intento de login {attempt} fallido. Cerrando contexto.")
-            await robot.cerrar()
 
-            if attempt < MAX_LOGIN_ATTEMPTS:
-                await asyncio.sleep(5)
+        if pool_propio:
+            pool = await crear_pool_navegadores(max_sesiones=1, cuenta=cuenta_portal).iniciar()
+
+        # La sesión llega ya autenticada: el login solo se repite si había caducado
+        async with pool.sesion() as robot:
+            page = robot.get_page()
+            roles = await obtener_todos_los_roles(page)
+            ejecucion.progreso.roles_totales = len(roles)
+            ejecucion.emitir("roles", roles=roles)
+            _anotar_diario(ejecucion.diario.registrar_roles, ejecucion.id, roles)
+            omitidos = _preparar_reanudacion(ejecucion, roles) if ejecucion.retomada else set()
+
+            # Repartimos las ventanas (rol x rango) mediante una cola compartida: cada worker toma la siguiente libre
+            cola_ventanas: asyncio.Queue = asyncio.Queue()
+            for posicion, rol in enumerate(roles):
+                if posicion in omitidos:
+                    continue
+                ejecucion.pendientes_por_rol[posicion] = len(ventanas)
+                for ventana_desde, ventana_hasta in ventanas:
+                    cola_ventanas.put_nowait((posicion, rol, ventana_desde, ventana_hasta))
+            ejecucion.ventanas_pendientes = cola_ventanas.qsize()
+            ejecucion.progreso.ventanas_totales = cola_ventanas.qsize()
+
+            num_workers = min(num_workers, max(1, cola_ventanas.qsize()))
+            if cola_ventanas.empty():
+                cola_ventanas.put_nowait(None)
+            paginas = [page]
+            for _ in range(num_workers - 1):
+                # Cada contexto extra hereda la sesión autenticada del principal y cuenta para el tope global de sesiones
+                contexto = await pool.contexto_extra(robot)
+                if contexto is None:
+                    escribir_log(f"[PARALELO] Tope global de sesiones completo: se continúa con {len(paginas)} de {num_workers} contextos.")
+                    break
+                pagina_extra = await contexto.new_page()
+                await pagina_extra.goto(URL_FACTURAS, wait_until="domcontentloaded" if es_modo_rapido(pagina_extra) else "networkidle")
+                paginas.append(pagina_extra)
+            num_workers = ejecucion.num_workers = len(paginas)
+
+            if num_workers > 1:
+                escribir_log(f"[PARALELO] Procesando {len(roles)} roles x {len(ventanas)} ventanas con {num_workers} contextos.")
+
+            # El OCR corre en su propia etapa mientras los workers siguen leyendo y descargando
+            if ocr_lote:
+                ejecucion.pipeline_ocr = LoteOCR(progreso=ejecucion.progreso).iniciar()
             else:
-                raise Exception(f"Fallo crítico: No se pudo acceder al portal tras {MAX_LOGIN_ATTEMPTS} intentos.")
+                ejecucion.pipeline_ocr = PipelineOCR(progreso=ejecucion.progreso, al_completar=ejecucion.emitir_factura).iniciar()
 
-        page = robot.get_page()
-        roles = await obtener_todos_los_roles(page)
+            await asyncio.gather(*[
+                _worker_ventanas(i, pagina, cola_ventanas, ejecucion)
+                for i, pagina in enumerate(paginas)
+            ])
 
-        for rol in roles:
-            escribir_log(f"{'='*40}", pretexto="\n", mostrar_tiempo=False)
-            escribir_log(f"PROCESANDO EMPRESA: {rol}")
-            escribir_log(f"{'='*80}", mostrar_tiempo=False)
-            
-            try:
-                await seleccionar_rol_especifico(page, rol)
-                
-                escribir_log(f"[BUSQUEDA]")
-                hay_datos = await aplicar_filtros_fechas(page, fecha_desde, fecha_hasta)
-                
-                if hay_datos:
-                    escribir_log(f"[EXTRACCIÓN]")
-                    facturas_rol = await _extraer_pagina_actual(page)
-                    todas_las_facturas.extend(facturas_rol)
-                    # Guardamos el CSV acumulado
-                    _exportar_log_csv(facturas_rol, LOG_FILE_NAME_TEMPLATE)
-                    escribir_log(f"{'='*80}", mostrar_tiempo=False)
-                    escribir_log(f"[OK] {len(facturas_rol)} facturas procesadas para {rol}.")
-                
-            except Exception as e:
-                escribir_log(f"[ERROR] Fallo en ROL {rol}: {e}")
-                continue
+        escribir_log(f"[OCR] Esperando a que finalice la cola OCR ({ejecucion.pipeline_ocr.profundidad()} pendientes)...")
+        await ejecucion.pipeline_ocr.cerrar()
+        await asyncio.gather(*ejecucion.cierres_ventana)
+        await asyncio.gather(*ejecucion.exportaciones)
+        if isinstance(ejecucion.pipeline_ocr, LoteOCR) and ejecucion.pipeline_ocr.nombres:
+            escribir_log(f"[LOTE OCR] {ejecucion.pipeline_ocr.profundidad()} facturas quedan PENDIENTE_OCR en {', '.join(ejecucion.pipeline_ocr.nombres)}.")
+            ejecucion.emitir("lote_ocr", lotes=ejecucion.pipeline_ocr.nombres, facturas=ejecucion.pipeline_ocr.profundidad())
 
+        # Fusión en el mismo orden en que se listaron los roles, sin duplicados entre ventanas
+        claves_vistas = set()
+        for posicion in range(len(roles)):
+            resultado_rol = ejecucion.resultados.get(posicion, {})
+            if posicion not in ejecucion.roles_exportados:
+                # OCR por lotes: los roles se guardan ahora, con sus facturas ya en PENDIENTE_OCR
+                _exportar_facturas_rol(ejecucion, posicion, roles[posicion], list(resultado_rol.values()))
+            facturas_rol = [f for clave, f in resultado_rol.items() if clave not in claves_vistas]
+            claves_vistas.update(resultado_rol.keys())
+            todas_las_facturas.extend(facturas_rol)
+
+        _anotar_diario(ejecucion.diario.finalizar, ejecucion.id, EJECUCION_COMPLETADA)
         escribir_log(f"[OK][FIN] Proceso completado. Total facturas: {len(todas_las_facturas)}")
         return todas_las_facturas
 
+    except BaseException as e:
+        # También cancelaciones: la ejecución queda en el diario lista para retomarse
+        _anotar_diario(ejecucion.diario.finalizar, ejecucion.id, EJECUCION_INTERRUMPIDA, str(e) or type(e).__name__)
+        escribir_log(f"[DIARIO] Ejecución {ejecucion.id} interrumpida. Puede retomarse con reanudar_ejecucion('{ejecucion.id}').")
+        raise
+
     finally:
-        await robot.cerrar()
-        escribir_log("[SISTEMA] Navegador cerrado.\n")
-
-def obtener_pdf_local_base64(cups: str, numero_factura: str) -> dict:
-    """Lee el PDF descargado y lo devuelve en Base64."""
-    target_folder = DOWNLOAD_FOLDERS['PDF']
-    filename = f"{cups}_{numero_factura}.pdf"
-    file_path = os.path.join(target_folder, filename)
-    
-    respuesta = {"filename": filename, "cups": cups, "numero_factura": numero_factura, "pdf_base64": ""}
+        for tarea in ejecucion.cierres_ventana + ejecucion.exportaciones:
+            tarea.cancel()
+        if ejecucion.pipeline_ocr is not None:
+            # Si la ejecución se interrumpe, detenemos los workers OCR sin esperar a la cola
+            await ejecucion.pipeline_ocr.cerrar(esperar=False)
+        if pool_propio and pool is not None:
+            await pool.cerrar()
+            escribir_log("[SISTEMA] Navegador cerrado.\n")
+        else:
+            escribir_log("[SISTEMA] Sesión devuelta al pool.\n")
+        restaurar_contexto(token_log)
 
+async def reanudar_ejecucion(id_ejecucion: str, num_workers: int | None = None, pool: PoolNavegadores | None = None,
+                             progreso: ProgresoEjecucion | None = None,
+                             eventos: asyncio.Queue | None = None) -> list[FacturaEndesaDistribucion]:
+    """
+    Retoma una ejecución del diario desde su último punto de control, con sus
+    mismos parámetros (cuenta incluida; el pool recibido debe ser el de esa
+    cuenta): los roles ya exportados y las ventanas ya completadas
+    se sirven desde el índice, las facturas ya extraídas se reutilizan y los
+    PDF ya guardados no se descargan de nuevo (el OCR de un PDF ya procesado
+    sale de la caché de extracciones). Una ejecución ya completada se
+    devuelve desde el índice sin abrir el navegador.
+    """
+    diario = obtener_diario()
+    datos = diario.obtener(id_ejecucion)
+    if datos is None:
+        raise ValueError(f"Ejecución {id_ejecucion} no encontrada en el diario.")
+    if datos["estado"] == EJECUCION_COMPLETADA:
+        escribir_log(f"[DIARIO] La ejecución {id_ejecucion} ya está completada. Se devuelve desde el índice.")
+        return obtener_indice().cargar_facturas(diario.facturas_en_etapa(id_ejecucion, ETAPA_LISTADA))
+    parametros = datos["parametros"]
+    return await ejecutar_robot_api(
+        datos["fecha_desde"], datos["fecha_hasta"],
+        num_workers=num_workers or parametros.get("num_workers"),
+        incremental=parametros.get("incremental", False),
+        pool=pool, progreso=progreso, eventos=eventos, reanudar=True,
+        ocr_lote=parametros.get("ocr_lote"),
+        id_ejecucion=id_ejecucion,
+        cuenta=parametros.get("cuenta"),
+    )
+
+async def ejecutar_robot_stream(fecha_desde: str, fecha_hasta: str, num_workers: int | None = None, incremental: bool = False,
+                                pool: PoolNavegadores | None = None, cuenta: str | None = None) -> AsyncIterator[dict]:
+    """
+    Variante en streaming de ejecutar_robot_api: genera un evento por rol
+    (inicio y fin) y uno por factura en cuanto termina su OCR, y un evento
+    final con el total. Si el consumidor abandona el generador, la ejecución
+    se cancela.
+    """
+    eventos: asyncio.Queue = asyncio.Queue()
+    tarea = asyncio.create_task(ejecutar_robot_api(
+        fecha_desde, fecha_hasta, num_workers=num_workers, incremental=incremental, pool=pool, eventos=eventos, cuenta=cuenta
+    ))
     try:
-        if not os.path.exists(file_path):
-            escribir_log(f"⚠️ PDF no encontrado: {filename}")
-            respuesta["pdf_base64"] = "ERROR: ARCHIVO_NO_ENCONTRADO"
-            return respuesta
+        while not (tarea.done() and eventos.empty()):
+            siguiente = asyncio.ensure_future(eventos.get())
+            await asyncio.wait({siguiente, tarea}, return_when=asyncio.FIRST_COMPLETED)
+            if siguiente.done():
+                yield siguiente.result()
+            else:
+                siguiente.cancel()
+        try:
+            facturas = tarea.result()
+            yield {"evento": "fin", "total": len(facturas)}
+        except Exception as e:
+            yield {"evento": "error", "detalle": f"Fallo crítico en el proceso RPA: {e}"}
+    finally:
+        if not tarea.done():
+            tarea.cancel()
+            await asyncio.gather(tarea, return_exceptions=True)
 
-        with open(file_path, 'rb') as f:
-            respuesta["pdf_base64"] = base64.b64encode(f.read()).decode('utf-8')
-        
-        escribir_log(f"✅ PDF '{filename}' codificado con éxito.")
-        return respuesta
-    except Exception as e:
-        respuesta["pdf_base64"] = f"ERROR: {str(e)}"
-        return respuesta
-    
+async def ejecutar_cuentas(fecha_desde: str, fecha_hasta: str, planificador: PlanificadorCuentas, cuentas: list[str] | None = None,
+                           **opciones) -> dict[str, list[FacturaEndesaDistribucion] | Exception]:
+    """
+    Ejecuta el mismo rango para varias cuentas (las activas del registro si
+    no se indican) en paralelo a través del planificador de cuentas, cada una
+    con su propio pool. `opciones` se pasan a ejecutar_robot_api. Devuelve las
+    facturas de cada cuenta, o la excepción si esa cuenta falló.
+    """
+    async def _ejecutar(cuenta: Cuenta, pool: PoolNavegadores):
+        return await ejecutar_robot_api(fecha_desde, fecha_hasta, pool=pool, cuenta=cuenta.nombre, **opciones)
+
+    return await planificador.ejecutar_todas(_ejecutar, cuentas)
+
+
+# --------------------------------------------------------------------------------
+# --- REINTENTO SELECTIVO DE FACTURAS CON ERROR ---
+# --------------------------------------------------------------------------------
+
+# Campos que proceden de la tabla del portal (el resto los rellena el OCR)
+CAMPOS_TABLA_FACTURA = ("cups", "numero_factura", "fecha_emision", "importe_total_tabla", "estado_factura",
+                        "tipo_factura", "descarga_selector", "secuencial")
+
+async def _con_backoff(descripcion: str, operacion: Callable[[], Awaitable], reintentos: int = REINTENTOS_FACTURA):
+    """
+    Ejecuta `operacion` hasta 1 + reintentos veces, con backoff exponencial y
+    jitter completo entre intentos. Un resultado falso cuenta como fallo.
+    Devuelve el primer resultado válido o lanza el último error.
+    """
+    ultimo_error: Exception | None = None
+    for intento in range(reintentos + 1):
+        try:
+            resultado = await operacion()
+            if resultado:
+                return resultado
+            ultimo_error = Exception(f"{descripcion}: sin resultado.")
+        except Exception as e:
+            ultimo_error = e
+        if intento < reintentos:
+            espera = random.uniform(0, BACKOFF_REINTENTO_S * (2 ** intento))
+            detalle = str(ultimo_error).split("Call log:")[0].strip()
+            escribir_log(f"        -> [REINTENTO] {descripcion}: intento {intento + 1}/{reintentos + 1} fallido ({detalle}). Nuevo intento en {espera:.1f}s")
+            await asyncio.sleep(espera)
+    raise ultimo_error
+
+def _factura_para_reintento(registro: dict) -> FacturaEndesaDistribucion:
+    """Factura del índice sin errores ni datos de OCR: solo conserva lo leído de la tabla."""
+    previa = FacturaEndesaDistribucion.model_validate_json(registro["datos_json"])
+    return FacturaEndesaDistribucion(error_RPA=False, **{c: getattr(previa, c) for c in CAMPOS_TABLA_FACTURA})
+
+async def _localizar_fila(page: Page, numero_factura: str) -> Locator | None:
+    """Fila de la factura en la tabla filtrada, cargando más bloques si aún no se ha renderizado."""
+    fila = _fila_de_factura(page, numero_factura)
+    while await fila.count() == 0:
+        if not await _cargar_mas_filas(page, await page.locator(SELECTOR_FILAS_TABLA).count()):
+            return None
+    return fila
+
+async def _redescargar_facturas(page: Page, facturas: dict[tuple[str, str], FacturaEndesaDistribucion],
+                                roles: dict[tuple[str, str], str], informe: dict[tuple[str, str], dict]):
+    """
+    Vuelve a descargar los PDF de las facturas dadas visitando solo sus roles
+    y, dentro de cada rol, filtrando la tabla por el día de emisión de cada
+    una. Los PDF pasan al almacén; los fallos quedan anotados en la factura.
+    """
+    motor = MotorDescargas(page)
+    por_rol: dict[str, dict[date, list[tuple[str, str]]]] = {}
+    for clave, factura in facturas.items():
+        por_rol.setdefault(roles[clave], {}).setdefault(a_fecha(factura.fecha_emision), []).append(clave)
+
+    for rol, por_fecha in por_rol.items():
+        escribir_log(f"[REINTENTO] Rol {rol}: {sum(len(c) for c in por_fecha.values())} facturas a descargar de nuevo.")
+        with tramo("cambio_rol"):
+            await seleccionar_rol_especifico(page, rol)
+        for emision, claves in sorted(por_fecha.items()):
+            with tramo("filtro"):
+                hay_tabla = await aplicar_filtros_fechas(page, a_texto(emision), a_texto(emision))
+            for clave in claves:
+                factura = facturas[clave]
+                with contexto_log(cups=factura.cups, factura=factura.numero_factura):
+                    try:
+                        fila = await _localizar_fila(page, factura.numero_factura) if hay_tabla else None
+                        if fila is None:
+                            raise Exception("NO_ENCONTRADA: La factura no aparece en la tabla del portal.")
+                        # Los datos de la tabla pueden haber cambiado desde la ejecución original
+                        _asignar_celdas(factura, await _leer_celdas_fila(fila))
+                        with tramo("descarga", modo="reintento") as t:
+                            ruta_pdf = await _con_backoff(
+                                f"Descarga {factura.numero_factura}",
+                                lambda: motor.descargar(_fila_de_factura(page, factura.numero_factura), factura,
+                                                        _ruta_pdf_factura(factura.cups, factura.numero_factura)),
+                            )
+                            await asyncio.to_thread(obtener_almacen_pdf().guardar, ruta_pdf, factura)
+                            t["ok"] = True
+                        informe[clave]["operaciones"].append("descarga")
+                        escribir_log(f"    -> [OK] PDF de {factura.numero_factura} descargado.")
+                    except Exception as e:
+                        _anotar_error_pdf(factura, e)
+
+async def _reintentar_ocr(clave: tuple[str, str], factura: FacturaEndesaDistribucion, informe: dict):
+    """OCR de una factura cuyo PDF ya está en el almacén, con backoff entre intentos (cada intento, dentro del tope global de OCR)."""
+    ruta_pdf = _ruta_pdf_guardado(*clave)
+    if factura.error_RPA or ruta_pdf is None:
+        return
+    # Validación de Importe Negativo (Requisito de negocio): no pasa por el OCR
+    if factura.importe_total_tabla < 0:
+        factura.error_RPA = True
+        factura.direccion_suministro = "NOTIFICACIÓN: Factura rectificativa o importe negativo."
+        return
+
+    async def _intento_ocr() -> bool:
+        # El tope global se toma en cada intento: las esperas del backoff no ocupan plaza de OCR
+        async with obtener_limite_ocr():
+            return await procesar_pdf_local_async(factura, ruta_pdf)
+
+    with contexto_log(cups=factura.cups, factura=factura.numero_factura):
+        try:
+            with tramo("ocr", modo="reintento") as t:
+                await _con_backoff(f"OCR {factura.numero_factura}", _intento_ocr)
+                t["ok"] = True
+            informe["operaciones"].append("ocr")
+            escribir_log(f"        -> [OK] OCR completado para {factura.numero_factura}")
+        except Exception:
+            marcar_error_ocr(factura)
+            escribir_log(f"        -> [!] [OCR] No se pudieron extraer datos tras {REINTENTOS_FACTURA + 1} intentos.")
+
+async def reintentar_facturas(claves: list[tuple[str, str]] | None = None, id_ejecucion: str | None = None,
+                              planificador: PlanificadorCuentas | None = None) -> dict:
+    """
+    Reintenta solo las facturas que quedaron con error técnico (TIMEOUT,
+    fallo de descarga u OCR), sin repetir el rango completo. Recibe una lista
+    de (cups, numero_factura) y/o un id de ejecución del diario (se toman sus
+    facturas que no llegaron a EXTRAIDA). Las que tienen el PDF en el almacén
+    solo repiten el OCR; el resto se descarga de nuevo visitando únicamente
+    sus cuentas, roles y filas (con los pools del planificador o, sin él, con
+    un pool propio por cuenta). El índice, el almacén de resultados y el
+    diario se actualizan en el sitio. Devuelve un informe por factura.
+    """
+    diario, indice = obtener_diario(), obtener_indice()
+    # (cuenta, rol) de cada factura: del diario de la ejecución o, para las claves sueltas, del almacén de resultados
+    ubicaciones: dict[tuple[str, str], tuple[str, str]] = {}
+    if id_ejecucion is not None:
+        datos = diario.obtener(id_ejecucion)
+        if datos is None:
+            raise ValueError(f"Ejecución {id_ejecucion} no encontrada en el diario.")
+        cuenta_ejecucion = datos["parametros"].get("cuenta") or CUENTA_POR_DEFECTO
+        for cups, numero_factura, rol in diario.facturas_pendientes(id_ejecucion):
+            ubicaciones[(cups, numero_factura)] = (cuenta_ejecucion, rol)
+    claves = list(dict.fromkeys([tuple(c) for c in (claves or [])] + list(ubicaciones)))
+    ubicaciones.update(obtener_almacen().ubicaciones_de([c for c in claves if c not in ubicaciones]))
+
+    informe: dict[tuple[str, str], dict] = {}
+    facturas: dict[tuple[str, str], FacturaEndesaDistribucion] = {}
+    for clave in claves:
+        cuenta, rol = ubicaciones.get(clave, (None, None))
+        informe[clave] = {"cups": clave[0], "numero_factura": clave[1], "cuenta": cuenta, "rol": rol,
+                          "resultado": None, "operaciones": [], "detalle": None}
+        registro = indice.obtener(*clave)
+        if registro is None:
+            informe[clave]["resultado"] = "NO_ENCONTRADA"
+        elif registro["estado_proceso"] != ESTADO_ERROR:
+            informe[clave]["resultado"] = "SIN_ERROR"
+        else:
+            facturas[clave] = _factura_para_reintento(registro)
+
+    # Sin PDF guardado hay que volver al portal, y para eso hace falta la cuenta, el rol y la fecha de la fila
+    sin_pdf: dict[str, dict[tuple[str, str], FacturaEndesaDistribucion]] = {}
+    for clave, factura in list(facturas.items()):
+        if _ruta_pdf_guardado(*clave) is not None:
+            continue
+        motivo = "SIN_ROL" if clave not in ubicaciones else ("SIN_FECHA" if a_fecha(factura.fecha_emision) is None else None)
+        if motivo:
+            informe[clave]["resultado"] = motivo
+            del facturas[clave]
+        else:
+            sin_pdf.setdefault(ubicaciones[clave][0], {})[clave] = factura
+    descargas = sum(len(f) for f in sin_pdf.values())
+    escribir_log(f"[REINTENTO] {len(facturas)}/{len(claves)} facturas con error a reintentar "
+                 f"({descargas} con descarga en {len(sin_pdf)} cuenta(s), {len(facturas) - descargas} solo OCR).", pretexto="\n")
+
+    async def _redescargar_cuenta(cuenta: str, facturas_cuenta: dict[tuple[str, str], FacturaEndesaDistribucion]):
+        roles = {c: ubicaciones[c][1] for c in facturas_cuenta}
+        with contexto_log(cuenta=cuenta):
+            try:
+                if planificador is not None:
+                    pool = await planificador.pool(cuenta)
+                else:
+                    pool = await crear_pool_navegadores(max_sesiones=1, cuenta=obtener_registro_cuentas().obtener(cuenta)).iniciar()
+                try:
+                    async with pool.sesion() as robot:
+                        await _redescargar_facturas(robot.get_page(), facturas_cuenta, roles, informe)
+                finally:
+                    if planificador is None:
+                        await pool.cerrar()
+            except Exception as e:
+                # Sin sesión en la cuenta (login, cuenta dada de baja...): sus facturas siguen con error
+                escribir_log(f"[REINTENTO] No se pudo trabajar con la cuenta {cuenta}: {e}")
+                for clave, factura in facturas_cuenta.items():
+                    if not factura.error_RPA and _ruta_pdf_guardado(*clave) is None:
+                        _anotar_error_pdf(factura, e)
+
+    # Cada cuenta en su propio pool y en paralelo (los límites por cuenta y globales los aplican los pools)
+    await asyncio.gather(*(_redescargar_cuenta(c, f) for c, f in sin_pdf.items()))
+    await asyncio.gather(*(_reintentar_ocr(c, f, informe[c]) for c, f in facturas.items()))
+
+    # Actualización en el sitio: índice, almacén de resultados (por cuenta y rol) y diario
+    _registrar_en_indice(indice, list(facturas.values()))
+    por_rol: dict[tuple[str | None, str | None], list[tuple[str, str]]] = {}
+    for clave in facturas:
+        por_rol.setdefault(ubicaciones.get(clave, (None, None)), []).append(clave)
+    for (cuenta, rol), claves_rol in por_rol.items():
+        _guardar_resultados([facturas[c] for c in claves_rol], rol, cuenta or CUENTA_POR_DEFECTO)
+        recuperadas = [facturas[c] for c in claves_rol if estado_proceso_de(facturas[c]) == ESTADO_COMPLETA]
+        if id_ejecucion is not None and rol is not None and recuperadas:
+            _anotar_diario(diario.avanzar_facturas, id_ejecucion, rol, [(f, ETAPA_EXPORTADA) for f in recuperadas])
+    for clave, factura in facturas.items():
+        estado = estado_proceso_de(factura)
+        FACTURAS_PROCESADAS.inc(estado=estado)
+        informe[clave]["resultado"] = "RECUPERADA" if estado == ESTADO_COMPLETA else "ERROR"
+        informe[clave]["detalle"] = factura.direccion_suministro if factura.error_RPA else None
+
+    resultados = list(informe.values())
+    resumen = {
+        "id_ejecucion": id_ejecucion,
+        "solicitadas": len(claves),
+        "reintentadas": len(facturas),
+        "recuperadas": sum(r["resultado"] == "RECUPERADA" for r in resultados),
+        "con_error": sum(r["resultado"] == "ERROR" for r in resultados),
+        "descargas": sum("descarga" in r["operaciones"] for r in resultados),
+        "ocr": sum("ocr" in r["operaciones"] for r in resultados),
+        "facturas": resultados,
+    }
+    escribir_log(f"[REINTENTO] Fin: {resumen['recuperadas']} recuperadas, {resumen['con_error']} siguen con error "
+                 f"({resumen['descargas']} descargas, {resumen['ocr']} OCR).")
+    return resumen
 
 # --- FUNCIÓN DE PRUEBA Y EJECUCIÓN MANUAL ---
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+import os
+import uuid
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable
+from logs import escribir_log
+from modelos_datos import EstadoTrabajo, ProgresoEjecucion, FacturaEndesaDistribucion
+
+# --- CONFIGURACIÓN DE LA COLA DE TRABAJOS ---
+# Ejecuciones del robot que pueden correr a la vez entre todas las cuentas (cada una ocupa una sesión de su pool)
+NUM_SLOTS_TRABAJOS = int(os.environ.get("EDISTRIBUCION_SLOTS_TRABAJOS", "4"))
+# Trabajos finalizados que se conservan en memoria para su consulta
+MAX_TRABAJOS_FINALIZADOS = int(os.environ.get("EDISTRIBUCION_TRABAJOS_HISTORICO", "100"))
+
+EN_COLA = "EN_COLA"
+EN_CURSO = "EN_CURSO"
+COMPLETADO = "COMPLETADO"
+FALLIDO = "FALLIDO"
+CANCELADO = "CANCELADO"
+ESTADOS_FINALES = (COMPLETADO, FALLIDO, CANCELADO)
+
+# (fecha_desde, fecha_hasta, incremental, workers, reanudar, ocr_lote, progreso, id_ejecucion, cuenta) -> facturas
+Ejecutor = Callable[[str, str, bool, int | None, bool, bool | None, ProgresoEjecucion, str | None, str | None],
+                    Awaitable[list[FacturaEndesaDistribucion]]]
+# cuenta -> ejecuciones simultáneas permitidas para ella
+LimiteCuenta = Callable[[str | None], int]
+
+
+def _ahora() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class Trabajo:
+    """
+    Una ejecución del robot solicitada a través de la API de trabajos, para
+    una cuenta del portal (None = la cuenta por defecto). Con id_ejecucion,
+    el trabajo retoma esa ejecución del diario en lugar de empezar una nueva.
+    """
+    def __init__(self, fecha_desde: str, fecha_hasta: str, incremental: bool = False, workers: int | None = None, reanudar: bool = False,
+                 ocr_lote: bool | None = None, id_ejecucion: str | None = None, cuenta: str | None = None):
+        self.id = uuid.uuid4().hex
+        self.fecha_desde = fecha_desde
+        self.fecha_hasta = fecha_hasta
+        self.incremental = incremental
+        self.workers = workers
+        self.reanudar = reanudar
+        self.ocr_lote = ocr_lote
+        self.id_ejecucion = id_ejecucion
+        self.cuenta = cuenta
+        self.estado = EN_COLA
+        self.progreso = ProgresoEjecucion(id_ejecucion=id_ejecucion)
+        self.creado_en = _ahora()
+        self.iniciado_en: str | None = None
+        self.finalizado_en: str | None = None
+        self.error: str | None = None
+        self.tarea: asyncio.Task | None = None
+
+    def finalizar(self, estado: str, error: str | None = None):
+        self.estado = estado
+        self.error = error
+        self.finalizado_en = _ahora()
+
+    def a_modelo(self) -> EstadoTrabajo:
+        return EstadoTrabajo(
+            id=self.id,
+            estado=self.estado,
+            fecha_desde=self.fecha_desde,
+            fecha_hasta=self.fecha_hasta,
+            incremental=self.incremental,
+            cuenta=self.cuenta,
+            creado_en=self.creado_en,
+            iniciado_en=self.iniciado_en,
+            finalizado_en=self.finalizado_en,
+            error=self.error,
+            progreso=self.progreso,
+        )
+
+
+class GestorTrabajos:
+    """
+    Cola de trabajos en memoria con un número fijo de slots de ejecución.
+    POST /jobs encola y devuelve el id al momento; los slots consumen la cola
+    y van actualizando el progreso que consulta GET /jobs/{id}.
+    Con `limite_cuenta`, cada slot toma el trabajo más antiguo cuya cuenta no
+    haya alcanzado su límite de ejecuciones simultáneas: una cuenta ocupada
+    no bloquea los trabajos de las demás.
+    """
+    def __init__(self, ejecutor: Ejecutor, num_slots: int | None = None, limite_cuenta: LimiteCuenta | None = None):
+        self.ejecutor = ejecutor
+        self.num_slots = max(1, num_slots or NUM_SLOTS_TRABAJOS)
+        self.limite_cuenta = limite_cuenta
+        self.trabajos: OrderedDict[str, Trabajo] = OrderedDict()
+        # Ids de los trabajos en cola, por orden de llegada, y ejecuciones en curso por cuenta
+        self.cola: list[str] = []
+        self.en_curso_por_cuenta: dict[str | None, int] = {}
+        self._cambios = asyncio.Condition()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.slots: list[asyncio.Task] = []
+
+    def iniciar(self):
+        """Lanza los slots de ejecución sobre el event loop actual."""
+        self._loop = asyncio.get_running_loop()
+        self.slots = [asyncio.create_task(self._slot(i)) for i in range(self.num_slots)]
+        return self
+
+    async def cerrar(self):
+        """Cancela los trabajos en curso y detiene los slots."""
+        for trabajo in self.trabajos.values():
+            if trabajo.estado == EN_COLA:
+                trabajo.finalizar(CANCELADO, "Servicio detenido.")
+        self.cola = []
+        for slot in self.slots:
+            slot.cancel()
+        await asyncio.gather(*self.slots, return_exceptions=True)
+        self.slots = []
+
+    def encolar(self, fecha_desde: str, fecha_hasta: str, incremental: bool = False, workers: int | None = None,
+                reanudar: bool = False, ocr_lote: bool | None = None, id_ejecucion: str | None = None,
+                cuenta: str | None = None) -> Trabajo:
+        trabajo = Trabajo(fecha_desde, fecha_hasta, incremental, workers, reanudar, ocr_lote, id_ejecucion, cuenta)
+        self.trabajos[trabajo.id] = trabajo
+        self.cola.append(trabajo.id)
+        self._avisar()
+        self._purgar_finalizados()
+        escribir_log(f"[TRABAJOS] Trabajo {trabajo.id} encolado ({len(self.cola)} en cola).")
+        return trabajo
+
+    def obtener(self, id_trabajo: str) -> Trabajo | None:
+        return self.trabajos.get(id_trabajo)
+
+    def cancelar(self, id_trabajo: str) -> Trabajo | None:
+        """
+        Cancela un trabajo. Si aún está en cola, el slot lo descartará al
+        sacarlo; si está en curso, se cancela su tarea (el robot libera la sesión).
+        """
+        trabajo = self.trabajos.get(id_trabajo)
+        if trabajo is None or trabajo.estado in ESTADOS_FINALES:
+            return trabajo
+        if trabajo.estado == EN_COLA:
+            trabajo.finalizar(CANCELADO)
+        elif trabajo.tarea is not None:
+            trabajo.tarea.cancel()
+        return trabajo
+
+    def estadisticas(self) -> dict:
+        por_estado: dict[str, int] = {}
+        for trabajo in self.trabajos.values():
+            por_estado[trabajo.estado] = por_estado.get(trabajo.estado, 0) + 1
+        return {
+            "slots": self.num_slots,
+            "en_cola": por_estado.get(EN_COLA, 0),
+            "en_curso_por_cuenta": {c or "": n for c, n in self.en_curso_por_cuenta.items() if n},
+            "trabajos": por_estado,
+        }
+
+    def _purgar_finalizados(self):
+        finalizados = [t.id for t in self.trabajos.values() if t.estado in ESTADOS_FINALES]
+        for id_trabajo in finalizados[:max(0, len(finalizados) - MAX_TRABAJOS_FINALIZADOS)]:
+            del self.trabajos[id_trabajo]
+
+    def _avisar(self):
+        """
+        Despierta a los slots en espera (nuevo trabajo o cuenta liberada). Se
+        puede llamar desde los endpoints síncronos, que corren en otro hilo.
+        """
+        async def _notificar():
+            async with self._cambios:
+                self._cambios.notify_all()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(lambda: self._loop.create_task(_notificar()))
+
+    def _siguiente(self) -> Trabajo | None:
+        """Trabajo más antiguo de la cola cuya cuenta no ha alcanzado su límite, o None."""
+        for id_trabajo in list(self.cola):
+            trabajo = self.trabajos.get(id_trabajo)
+            if trabajo is None or trabajo.estado != EN_COLA:
+                # Cancelado mientras esperaba: se descarta aquí, en el hilo del event loop
+                self.cola.remove(id_trabajo)
+                continue
+            limite = self.limite_cuenta(trabajo.cuenta) if self.limite_cuenta else None
+            if limite is None or self.en_curso_por_cuenta.get(trabajo.cuenta, 0) < limite:
+                return trabajo
+        return None
+
+    async def _slot(self, id_slot: int):
+        while True:
+            async with self._cambios:
+                trabajo = await self._cambios.wait_for(self._siguiente)
+                self.cola.remove(trabajo.id)
+                self.en_curso_por_cuenta[trabajo.cuenta] = self.en_curso_por_cuenta.get(trabajo.cuenta, 0) + 1
+            try:
+                await self._ejecutar(id_slot, trabajo)
+            finally:
+                self.en_curso_por_cuenta[trabajo.cuenta] -= 1
+                self._avisar()
+
+    async def _ejecutar(self, id_slot: int, trabajo: Trabajo):
+        trabajo.estado = EN_CURSO
+        trabajo.iniciado_en = _ahora()
+        escribir_log(f"[TRABAJOS] [SLOT {id_slot}] Iniciando trabajo {trabajo.id} (cuenta {trabajo.cuenta or 'por defecto'}).")
+        trabajo.tarea = asyncio.create_task(self.ejecutor(
+            trabajo.fecha_desde, trabajo.fecha_hasta, trabajo.incremental, trabajo.workers, trabajo.reanudar, trabajo.ocr_lote, trabajo.progreso,
+            trabajo.id_ejecucion, trabajo.cuenta
+        ))
+        try:
+            facturas = await trabajo.tarea
+            # El resultado final (ya con el OCR aplicado) sustituye a las parciales
+            trabajo.progreso.facturas = facturas
+            trabajo.finalizar(COMPLETADO)
+        except asyncio.CancelledError:
+            trabajo.finalizar(CANCELADO)
+            # Si es el propio slot el que se cancela (cierre del servicio), propagamos
+            if asyncio.current_task().cancelling():
+                raise
+        except Exception as e:
+            trabajo.finalizar(FALLIDO, str(e))
+            escribir_log(f"[TRABAJOS] Trabajo {trabajo.id} fallido: {e}")
+        finally:
+            trabajo.tarea = None
+        escribir_log(f"[TRABAJOS] Trabajo {trabajo.id} {trabajo.estado}.")
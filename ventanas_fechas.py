@@ -0,0 +1,57 @@
+import os
+from datetime import date, datetime, timedelta
+from typing import Iterable
+
+# --- CONFIGURACIÓN DE VENTANAS DE FECHAS ---
+# Tamaño de ventana para dividir rangos largos: "mes" (meses naturales) o un número de días
+TAMANO_VENTANA = os.environ.get("EDISTRIBUCION_VENTANA", "mes")
+# Filas a partir de las cuales una ventana se considera demasiado grande y se parte en dos
+MAX_FILAS_VENTANA = int(os.environ.get("EDISTRIBUCION_VENTANA_MAX_FILAS", "500"))
+
+FORMATO_FECHA = "%d/%m/%Y"
+
+
+def a_fecha(texto: str | None) -> date | None:
+    """Convierte 'DD/MM/YYYY' en date; None si no es una fecha válida."""
+    try:
+        return datetime.strptime((texto or "").strip(), FORMATO_FECHA).date()
+    except ValueError:
+        return None
+
+def a_texto(fecha: date) -> str:
+    return fecha.strftime(FORMATO_FECHA)
+
+
+def dividir_rango(desde: date, hasta: date, tamano: str = TAMANO_VENTANA) -> list[tuple[date, date]]:
+    """
+    Divide [desde, hasta] en ventanas consecutivas y sin solape: meses
+    naturales (recortados a los extremos) o bloques de N días.
+    """
+    ventanas = []
+    inicio = desde
+    while inicio <= hasta:
+        if tamano == "mes":
+            siguiente_mes = (inicio.replace(day=1) + timedelta(days=32)).replace(day=1)
+            fin = siguiente_mes - timedelta(days=1)
+        else:
+            fin = inicio + timedelta(days=max(1, int(tamano)) - 1)
+        fin = min(fin, hasta)
+        ventanas.append((inicio, fin))
+        inicio = fin + timedelta(days=1)
+    return ventanas
+
+def partir_ventana(desde: date, hasta: date) -> list[tuple[date, date]]:
+    """Parte una ventana en dos mitades; una ventana de un día no se puede partir."""
+    if desde >= hasta:
+        return [(desde, hasta)]
+    mitad = desde + (hasta - desde) // 2
+    return [(desde, mitad), (mitad + timedelta(days=1), hasta)]
+
+def rangos_cubren(rangos: Iterable[tuple[date, date]], desde: date, hasta: date) -> bool:
+    """Indica si la unión de los rangos cubre todos los días de [desde, hasta]."""
+    cubierto_hasta = desde - timedelta(days=1)
+    for inicio, fin in sorted(rangos):
+        if inicio > cubierto_hasta + timedelta(days=1):
+            break
+        cubierto_hasta = max(cubierto_hasta, fin)
+    return cubierto_hasta >= hasta